@@ -1,6 +1,8 @@
 import flask_admin as admin
 from api.models import Book, Transaction, User, db
 from api.views import main
+from api.views.pool import PoolView
+from api.views.slow_queries import SlowQueryView
 from app import app
 from flask_admin.contrib.sqla import ModelView
 
@@ -9,3 +11,5 @@ admin = admin.Admin(app, name='api', index_view=main.MyAdminIndexView(),
 admin.add_view(ModelView(User, db.session))
 admin.add_view(ModelView(Book, db.session))
 admin.add_view(ModelView(Transaction, db.session))
+admin.add_view(SlowQueryView(name='Slow queries', endpoint='slow_queries'))
+admin.add_view(PoolView(name='Connection pools', endpoint='pool'))
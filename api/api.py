@@ -1,20 +1,32 @@
 from flask_apispec.extension import FlaskApiSpec
 from flask_restful import Api
 
-from api.resources import Book, Books, Transaction, Transactions, User, Users
+from api.resources import (Book, Books, BooksImport, CacheStats, Changes, PoolStats,
+                           Transaction, Transactions, TransactionsBatch, User,
+                           Users)
 
 api = Api()
 api.add_resource(Books, '/api/v1/books/', '/api/v1/books/<request_type>/')
+api.add_resource(BooksImport, '/api/v1/books/bulk/')
 api.add_resource(Book, '/api/v1/books/<int:book_id>/')
 api.add_resource(Users, '/api/v1/users/', '/api/v1/users/<highest_paying>/')
 api.add_resource(User, '/api/v1/users/<int:user_id>/')
 api.add_resource(Transactions, '/api/v1/transactions/')
+api.add_resource(TransactionsBatch, '/api/v1/transactions/batch/')
 api.add_resource(Transaction, '/api/v1/transactions/<int:transaction_id>/')
+api.add_resource(CacheStats, '/api/v1/cache/')
+api.add_resource(PoolStats, '/api/v1/pool/')
+api.add_resource(Changes, '/api/v1/changes/')
 
 docs = FlaskApiSpec()
 docs.register(Book)
 docs.register(Books)
+docs.register(BooksImport)
 docs.register(User)
 docs.register(Users)
 docs.register(Transaction)
 docs.register(Transactions)
+docs.register(TransactionsBatch)
+docs.register(CacheStats)
+docs.register(PoolStats)
+docs.register(Changes)
@@ -0,0 +1,167 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from sqlalchemy import literal_column, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from api.messages import INVALID_JSON
+
+CSV_MIMETYPES = ('text/csv', 'application/csv')
+
+
+def read_jsonl(lines):
+    '''
+    Yield (row number, row) per non blank line; malformed lines yield None.
+    '''
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+
+        yield number, row if isinstance(row, dict) else None
+
+
+def read_csv(lines):
+    '''
+    Yield (row number, row) per CSV record, leaving out empty cells.
+    '''
+    for number, row in enumerate(csv.DictReader(lines), start=1):
+        yield number, {key: value for key, value in row.items() if value not in ('', None)}
+
+
+def read_rows(stream, csv_format=False):
+    '''
+    Parse an uploaded file incrementally, one line at a time.
+    '''
+    if isinstance(stream, io.TextIOBase):
+        lines = stream
+    else:
+        lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+    if csv_format:
+        return read_csv(lines)
+    return read_jsonl(lines)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+
+def invalid_json_error(number):
+    return {'row': number, 'errors': {'_schema': [INVALID_JSON]}}
+
+
+def version_bump(table):
+    '''
+    Values that move a versioned table's row version on with an update.
+    '''
+    if 'version' in table.c:
+        return {'version': table.c.version + 1}
+    return {}
+
+
+def upsert(connection, table, rows, key, columns):
+    '''
+    Insert `rows` in one multi row statement, updating `columns` of the rows
+    whose `key` already exists.
+    '''
+    dialects = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+    insert = dialects.get(connection.dialect.name)
+
+    if insert:
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[key],
+            set_=dict({column: statement.excluded[column] for column in columns},
+                      **version_bump(table))
+        )
+        connection.execute(statement, rows)
+        return
+
+    keys = [row[key] for row in rows]
+    existing = {value for value, in connection.execute(
+        table.select().with_only_columns([table.c[key]]).where(table.c[key].in_(keys)))}
+
+    new_rows = [row for row in rows if row[key] not in existing]
+    if new_rows:
+        connection.execute(table.insert(), new_rows)
+
+    for row in rows:
+        if row[key] in existing:
+            connection.execute(table.update()
+                               .where(table.c[key] == row[key])
+                               .values(dict({column: row[column] for column in columns},
+                                            **version_bump(table))))
+
+
+def upsert_rows(connection, table, rows, key, required=()):
+    '''
+    Insert each of `rows`, or update just the columns it holds when its
+    `key` already exists. Rows lacking a `required` column can only update.
+
+    Rows holding the same columns share one statement on Postgres, which
+    reports inserts through RETURNING. SQLite, lacking RETURNING here,
+    tries `INSERT ... ON CONFLICT DO NOTHING` and updates on a no-op.
+
+    Returns, per row, True when it was created, False when it was updated
+    and None when it neither existed nor could be created.
+    '''
+    created = [None] * len(rows)
+    shapes = {}
+    for index, row in enumerate(rows):
+        shapes.setdefault(tuple(sorted(row)), []).append(index)
+
+    dialect = connection.dialect.name
+    for columns, indexes in shapes.items():
+        complete = all(column in columns for column in required)
+        updated = [column for column in columns if column != key]
+
+        if complete and updated and dialect == 'postgresql':
+            statement = postgresql.insert(table).values([rows[index] for index in indexes])
+            statement = statement.on_conflict_do_update(
+                index_elements=[key],
+                set_=dict({column: statement.excluded[column] for column in updated},
+                          **version_bump(table))
+            ).returning(table.c[key], literal_column('xmax = 0'))
+            inserted = dict(connection.execute(statement).fetchall())
+            for index in indexes:
+                created[index] = inserted[rows[index][key]]
+            continue
+
+        for index in indexes:
+            row = rows[index]
+            if complete and dialect == 'sqlite':
+                statement = sqlite.insert(table).values(row)\
+                                  .on_conflict_do_nothing(index_elements=[key])
+                if connection.execute(statement).rowcount:
+                    created[index] = True
+                    continue
+
+            if updated:
+                found = connection.execute(table.update()
+                                           .where(table.c[key] == row[key])
+                                           .values(dict({column: row[column]
+                                                          for column in updated},
+                                                         **version_bump(table))))\
+                                  .rowcount
+            else:
+                found = connection.execute(select([table.c[key]])
+                                           .where(table.c[key] == row[key])).first()
+
+            if found:
+                created[index] = False
+            elif complete:
+                connection.execute(table.insert().values(row))
+                created[index] = True
+
+    return created
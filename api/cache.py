@@ -0,0 +1,264 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context, json
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from api.constants import CACHE_SIZE, CACHE_TTL
+from api.routing import pinned_to_primary
+
+
+class CacheBackend():
+    '''
+    Serialized payloads by key, counting hits, misses and evictions.
+
+    Counters are kept per process.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def get(self, key):
+        '''
+        Return the payload stored under `key`, or None.
+        '''
+        raise NotImplementedError
+
+    def set(self, key, payload):
+        raise NotImplementedError
+
+    def delete(self, keys):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class NullCacheBackend(CacheBackend):
+    '''
+    Stores nothing, so every read goes to the database.
+    '''
+    def get(self, key):
+        self.count('misses')
+        return None
+
+    def set(self, key, payload):
+        pass
+
+    def delete(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    '''
+    Least recently used entries dropped past `size`, and any entry after
+    `ttl` seconds. Private to the process.
+    '''
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        super().__init__()
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] <= time.monotonic():
+                del self.entries[key]
+                self.counters['evictions'] += 1
+                entry = None
+
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[1]
+
+    def set(self, key, payload):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, payload)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteCacheBackend(CacheBackend):
+    '''
+    Entries in a local SQLite file shared by every worker on the host.
+
+    Past `size` entries the ones closest to expiry are dropped, so reads
+    never write. Each thread of each process opens its own connection.
+    '''
+    def __init__(self, path, size=CACHE_SIZE, ttl=CACHE_TTL):
+        super().__init__()
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                               '(key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def get(self, key):
+        row = self.connection.execute('SELECT payload, expires FROM entries WHERE key = ?',
+                                      (key, )).fetchone()
+        if row and row[1] <= time.time():
+            deleted = self.connection.execute('DELETE FROM entries WHERE key = ? AND expires = ?',
+                                              (key, row[1])).rowcount
+            self.count('evictions', deleted)
+            row = None
+
+        if row is None:
+            self.count('misses')
+            return None
+
+        self.count('hits')
+        return row[0]
+
+    def set(self, key, payload):
+        self.connection.execute('INSERT OR REPLACE INTO entries (key, payload, expires) '
+                                'VALUES (?, ?, ?)', (key, payload, time.time() + self.ttl))
+
+        evicted = self.connection.execute(
+            'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires '
+            'LIMIT max(0, (SELECT count(*) FROM entries) - ?))', (self.size, )).rowcount
+        if evicted:
+            self.count('evictions', evicted)
+
+    def delete(self, keys):
+        self.connection.executemany('DELETE FROM entries WHERE key = ?',
+                                    [(key, ) for key in keys])
+
+    def clear(self):
+        self.connection.execute('DELETE FROM entries')
+
+
+class EntityCache():
+    '''
+    Read-through cache of serialized single resources, keyed by table and id.
+
+    The backend is chosen per application from `CACHE_BACKEND`: `memory`
+    (default), `sqlite` at `CACHE_PATH`, or `null` to disable caching.
+    Rows written through a session, by the ORM or with `record_writes`,
+    are evicted once it commits, whichever code wrote them. A read racing
+    that write, or answered by a lagging replica, may store the old
+    payload, which then lives at most `CACHE_TTL` seconds. Clients pinned
+    to the primary after a write skip the lookup and store what they read.
+    '''
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_SIZE', CACHE_SIZE)
+        app.config.setdefault('CACHE_TTL', CACHE_TTL)
+        app.config.setdefault('CACHE_PATH', os.path.join(app.instance_path, 'cache.sqlite'))
+
+        name = app.config['CACHE_BACKEND']
+        size, ttl = app.config['CACHE_SIZE'], app.config['CACHE_TTL']
+        if name == 'sqlite':
+            path = app.config['CACHE_PATH']
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            backend = SQLiteCacheBackend(path, size, ttl)
+        elif name == 'memory':
+            backend = MemoryCacheBackend(size, ttl)
+        elif name == 'null':
+            backend = NullCacheBackend()
+        else:
+            raise ValueError(f'Unknown cache backend: {name}')
+
+        app.extensions['cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['cache']
+
+    def fetch(self, model, row_id, schema):
+        '''
+        The row's version and its JSON payload as dumped by `schema`, or
+        None when the row does not exist.
+        '''
+        key = f'{model.__tablename__}:{row_id}'
+        entry = None if pinned_to_primary() else self.backend.get(key)
+
+        if entry is None:
+            row = model.query.get(row_id)
+            if row is None:
+                return None
+
+            # Dumped JSON has no raw newlines, so one separates the two.
+            entry = f'{row.version}\n{json.dumps(schema.dump(row))}'
+            self.backend.set(key, entry)
+
+        version, payload = entry.split('\n', 1)
+        return int(version), payload
+
+    def evict(self, rows):
+        '''
+        Drop the entries of (table, row id) pairs.
+        '''
+        self.backend.delete([f'{table}:{row_id}' for table, row_id in rows])
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def payload_response(payload, fields=None):
+    '''
+    Respond with a cached payload, narrowed to `fields` when given.
+    '''
+    if fields:
+        data = json.loads(payload)
+        payload = json.dumps({name: data[name] for name in fields})
+
+    return current_app.response_class(payload, mimetype='application/json')
+
+
+entity_cache = EntityCache()
+
+
+@event.listens_for(Session, 'after_commit')
+def evict_written(session):
+    written = session.info.pop('written_rows', None)
+    if written and has_app_context() and 'cache' in current_app.extensions:
+        entity_cache.evict(written)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_written(session):
+    session.info.pop('written_rows', None)
@@ -3,3 +3,17 @@ BOOKS_ENDPOINT = '/api/v1/books'
 TRANSACTIONS_ENDPOINT = '/api/v1/transactions'
 USERS_ENDPOINT = '/api/v1/users'
 DEFAULT_RESULT_LIMIT = 10
+MAX_RESULT_LIMIT = 100
+IMPORT_BATCH_SIZE = 1000
+STREAM_CHUNK_SIZE = 500
+CACHE_SIZE = 1024
+CACHE_TTL = 300
+MAX_BATCH_SIZE = 50
+# Conditional stock takes retried while copies show up as available,
+# backing off from this many seconds.
+CHECKOUT_RETRIES = 5
+CHECKOUT_BACKOFF = 0.01
+SLOW_QUERY_LOG_SIZE = 200
+SLOW_QUERY_EXPLAIN_INTERVAL = 60
+# Seconds a client reads from the primary after its own write.
+READ_YOUR_WRITES_WINDOW = 5
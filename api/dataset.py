@@ -0,0 +1,135 @@
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+from sqlalchemy import bindparam
+
+from api.constants import MAX_ALLOWED_DUE
+from api.models import Book, Transaction, User, bump_version
+
+FIRST_NAMES = ('Ada', 'Alan', 'Amara', 'Chen', 'Dara', 'Elena', 'Farah', 'Grace', 'Hugo',
+               'Ines', 'Jonas', 'Kenji', 'Lena', 'Mateo', 'Nadia', 'Omar', 'Priya', 'Ravi',
+               'Sofia', 'Tariq', 'Uma', 'Viktor', 'Wen', 'Yusuf', 'Zoe')
+LAST_NAMES = ('Abbott', 'Bauer', 'Costa', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Haddad',
+              'Ito', 'Jensen', 'Kowalski', 'Lopez', 'Mensah', 'Novak', 'Okafor', 'Patel',
+              'Quinn', 'Rossi', 'Silva', 'Tanaka', 'Ueda', 'Varga', 'Weber', 'Yilmaz')
+TITLE_WORDS = ('Atlas', 'Brief', 'Code', 'Dark', 'Empire', 'Field', 'Garden', 'History',
+               'Island', 'Journey', 'Kingdom', 'Light', 'Memory', 'Night', 'Ocean', 'Practice',
+               'Quiet', 'River', 'Silent', 'Time', 'Under', 'Voices', 'Water', 'Winter',
+               'Years', 'Zero')
+
+CHUNK_SIZE = 10000
+# Rentals span this many days up to now, each lasting up to RENTAL_DAYS.
+HISTORY_DAYS = 730
+RENTAL_DAYS = 30
+
+
+def zipf_weights(count, exponent):
+    '''
+    Cumulative weights of a Zipf distribution over `count` ranks.
+    '''
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def ranked_ids(count, rng):
+    '''
+    Ids 1..count in a random popularity order, so popular rows are spread
+    over the table rather than clustered at its start.
+    '''
+    ids = list(range(1, count + 1))
+    rng.shuffle(ids)
+    return ids
+
+
+def execute_chunks(connection, statement, rows):
+    '''
+    Execute `statement` over `rows` CHUNK_SIZE at a time.
+    '''
+    rows = iter(rows)
+    chunk = list(islice(rows, CHUNK_SIZE))
+    while chunk:
+        connection.execute(statement, chunk)
+        chunk = list(islice(rows, CHUNK_SIZE))
+
+
+def generate(connection, users, books, transactions, open_ratio=0.5, seed=0):
+    '''
+    Bulk insert `users` members, `books` titles and `transactions` rentals.
+
+    Rentals follow Zipf distributions: a few titles and members account for
+    most of the history. `open_ratio` of the rentals from the last
+    RENTAL_DAYS days are still out, within each member's due limit. Rent
+    counts, rent totals and dues are filled in to match, so the data passes
+    `reconcile_dues`. Rows are written with Core inserts and do not appear
+    in the change feed.
+    '''
+    rng = random.Random(seed)
+    now = datetime.now()
+
+    execute_chunks(connection, User.__table__.insert(), (
+        {'first_name': rng.choice(FIRST_NAMES), 'last_name': rng.choice(LAST_NAMES),
+         'email': f'member{number}@example.com',
+         'contact': str(rng.randrange(10 ** 9, 10 ** 10))}
+        for number in range(1, users + 1)))
+
+    prices = [rng.choice((10, 20, 25, 30, 40, 50)) for _ in range(books)]
+    execute_chunks(connection, Book.__table__.insert(), (
+        {'title': ' '.join(rng.sample(TITLE_WORDS, rng.randint(1, 4))),
+         'author': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+         'isbn': str(9780000000000 + number), 'price': prices[number - 1],
+         'stock': rng.randint(0, 10)}
+        for number in range(1, books + 1)))
+
+    book_ids, book_weights = ranked_ids(books, rng), zipf_weights(books, 1.1)
+    member_ids, member_weights = ranked_ids(users, rng), zipf_weights(users, 0.8)
+
+    rent_count = [0] * (books + 1)
+    total_rent = [0] * (users + 1)
+    outstanding_due = [0] * (users + 1)
+
+    start = now - timedelta(days=HISTORY_DAYS)
+    recent = now - timedelta(days=RENTAL_DAYS)
+    step = timedelta(days=HISTORY_DAYS) / max(transactions, 1)
+    for offset in range(0, transactions, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, transactions - offset)
+        book_column = rng.choices(book_ids, cum_weights=book_weights, k=size)
+        member_column = rng.choices(member_ids, cum_weights=member_weights, k=size)
+
+        rows = []
+        for number, book, member in zip(range(offset, offset + size), book_column, member_column):
+            num_copies = 1 if rng.random() < 0.9 else 2
+            rent = num_copies * prices[book - 1]
+            date_rented = start + step * number
+            still_out = date_rented > recent and rng.random() < open_ratio \
+                and outstanding_due[member] + rent <= MAX_ALLOWED_DUE
+
+            date_return = None
+            if not still_out:
+                date_return = min(date_rented + timedelta(days=rng.randint(1, RENTAL_DAYS)), now)
+
+            rows.append({'member': member, 'book': book, 'num_copies': num_copies,
+                         'rent': rent, 'date_rented': date_rented, 'date_return': date_return})
+
+            rent_count[book] += 1
+            total_rent[member] += rent
+            if still_out:
+                outstanding_due[member] += rent
+
+        connection.execute(Transaction.__table__.insert(), rows)
+
+    books_table, users_table = Book.__table__, User.__table__
+    execute_chunks(connection, books_table.update()
+                  .where(books_table.c.id == bindparam('_id'))
+                  .values(rent_count=bindparam('_rent_count')),
+                  ({'_id': book, '_rent_count': rent_count[book]}
+                   for book in range(1, books + 1)))
+    execute_chunks(connection, users_table.update()
+                  .where(users_table.c.id == bindparam('_id'))
+                  .values(total_rent=bindparam('_total_rent'),
+                          outstanding_due=bindparam('_outstanding_due')),
+                  ({'_id': member, '_total_rent': total_rent[member],
+                    '_outstanding_due': outstanding_due[member]}
+                   for member in range(1, users + 1)))
+
+    for table in ('books', 'transactions', 'users'):
+        bump_version(connection, table)
@@ -2,18 +2,32 @@ from functools import wraps
 
 from flask import request
 from flask_restful import abort
+from marshmallow import ValidationError
 
+from api.messages import STATUS_400
 
-def validate_request_data(schema, partial):
 
+def load_request_data(schema, partial):
+    '''
+    Validate and deserialize the JSON body in a single `schema.load` and
+    pass the result to the view as `request_data`.
+
+    `schema` is built once, when the view is decorated, and reused for every
+    request. Full loads hand over what the schema's `post_load` builds,
+    usually a model instance; partial loads hand over a dict of the fields
+    sent. A body that fails to load is answered with 400.
+    '''
     def inner_function(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            if request.json:
-                request_data = request.get_json()
-                data_errors = schema.validate(request_data, partial=partial)
-                if data_errors:
-                    abort(400, message=data_errors)
+            request_data = request.get_json()
+            if request_data is None:
+                abort(400, message=STATUS_400)
+
+            try:
+                kwargs['request_data'] = schema.load(request_data, partial=partial)
+            except ValidationError as e:
+                abort(400, message=e.messages)
 
             return f(*args, **kwargs)
         return wrapper
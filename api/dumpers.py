@@ -0,0 +1,177 @@
+import re
+from threading import Lock
+
+from flask import current_app, has_request_context, request, url_for
+from flask_marshmallow.fields import URLFor
+from marshmallow import fields
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+
+# Stands in for the row attribute while building a URL template; must pass
+# the `int` converter and never occur in a real URL.
+URL_PLACEHOLDER = 918273645546372819
+
+_compiled = {}
+_compile_lock = Lock()
+
+
+def url_template(field):
+    '''
+    Split the URL of a single attribute `URLFor` field around that attribute.
+
+    Built with `url_for` once per app and script root, so rows only pay for
+    a string join. The host comes from the client, so it is never part of
+    the cached template; external URLs get it prepended per request.
+    '''
+    cache = current_app.extensions.setdefault('url_templates', {})
+    root = request.script_root if has_request_context() else None
+    key = (id(field), root)
+
+    if key not in cache:
+        values = {'_external': False}
+        for name, value in field.values.items():
+            attribute = re.match(r'<([^<>]+)>$', str(value))
+            if name != '_external':
+                values[name] = URL_PLACEHOLDER if attribute else value
+
+        prefix, suffix = url_for(field.endpoint, **values).split(str(URL_PLACEHOLDER))
+        cache[key] = (prefix, suffix)
+
+    prefix, suffix = cache[key]
+    if field.values.get('_external') and has_request_context():
+        prefix = request.host_url.rstrip('/') + prefix
+    return prefix, suffix
+
+
+def url_attribute(field):
+    '''
+    The one object attribute a `URLFor` field reads, or None when the field
+    reads several and needs the regular serializer.
+    '''
+    attributes = [re.match(r'<([^<>.]+)>$', str(value)) for value in field.values.values()]
+    attributes = [match.group(1) for match in attributes if match]
+    return attributes[0] if len(attributes) == 1 else None
+
+
+def is_plain(field):
+    if type(field) is fields.Integer:
+        return not field.as_string
+    return type(field) is fields.String
+
+
+def compile_schema(schema):
+    '''
+    Flatten the dump fields of `schema` into one generated function that
+    turns a list of rows into a list of dicts.
+
+    Integer and String fields read column values that already have the
+    right type and are copied as is; DateTime fields use isoformat like
+    marshmallow's default `iso` format. Any other field keeps its own
+    `serialize`, so output matches `Schema.dump`.
+    '''
+    namespace = {'getattr': getattr, 'str': str}
+    url_fields = []
+    items = []
+
+    for index, (name, field) in enumerate(declared_order(schema)):
+        key = field.data_key or name
+        attribute = field.attribute or name
+        value = f'row.{attribute}' if attribute.isidentifier() else f'getattr(row, {attribute!r})'
+
+        if isinstance(field, URLFor) and url_attribute(field):
+            source = f'row.{url_attribute(field)}'
+            url_fields.append(field)
+            position = len(url_fields) - 1
+            expression = (f'(None if {source} is None else '
+                          f'urls[{position}][0] + str({source}) + urls[{position}][1])')
+        elif is_plain(field):
+            expression = value
+        elif type(field) is fields.DateTime and field.format in (None, 'iso'):
+            expression = f'(None if {value} is None else {value}.isoformat())'
+        else:
+            namespace[f'field_{index}'] = field
+            expression = f'field_{index}.serialize({name!r}, row)'
+
+        items.append(f'{key!r}: {expression}')
+
+    source = ('def dump_rows(rows, urls):\n'
+              f'    return [{{{", ".join(items)}}} for row in rows]\n')
+    exec(compile(source, f'<compiled {type(schema).__name__}>', 'exec'), namespace)
+    dump_rows = namespace['dump_rows']
+
+    def dump(rows):
+        return dump_rows(rows, [url_template(field) for field in url_fields])
+
+    return dump
+
+
+def declared_order(schema):
+    '''
+    The dump fields of `schema` in declaration order, whatever order a
+    sparse field set was requested in.
+    '''
+    positions = {name: index for index, name in enumerate(schema.declared_fields)}
+    return sorted(schema.dump_fields.items(),
+                  key=lambda item: (positions.get(item[0], len(positions)), item[0]))
+
+
+def compiled_dumper(schema):
+    # One function per field set: permutations of `?fields=` share it.
+    key = (type(schema), frozenset(schema.dump_fields))
+    if key not in _compiled:
+        with _compile_lock:
+            if key not in _compiled:
+                _compiled[key] = compile_schema(schema)
+    return _compiled[key]
+
+
+class CompiledDumpMixin():
+    '''
+    Dumps through a function compiled once per schema and field set instead
+    of marshmallow's per field dispatch. Loading and validation are
+    unchanged, and schemas with dump hooks fall back to marshmallow.
+    '''
+    def dump(self, obj, *, many=None):
+        if self._has_processors(PRE_DUMP) or self._has_processors(POST_DUMP):
+            return super().dump(obj, many=many)
+
+        many = self.many if many is None else bool(many)
+        dump = compiled_dumper(self)
+
+        if many:
+            return dump(obj)
+        return dump([obj])[0]
+
+
+def dump_in_order(schema, rows):
+    '''
+    Dump `rows` in one pass of `schema`, keeping None in place of the rows
+    that are missing.
+    '''
+    dumped = iter(schema.dump([row for row in rows if row is not None], many=True))
+    return [None if row is None else next(dumped) for row in rows]
+
+
+class Embedded():
+    '''
+    Dumps with `schema`, replacing foreign key fields by the related rows.
+
+    `relations` maps each field to the relationship attribute holding the
+    related row and the schema dumping it. Related rows are dumped in one
+    pass per relation, so they are best loaded with `selectinload`.
+    '''
+    def __init__(self, schema, relations):
+        self.schema = schema
+        self.relations = relations
+        self.many = schema.many
+
+    def dump(self, obj, *, many=None):
+        many = self.many if many is None else bool(many)
+        rows = list(obj) if many else [obj]
+        dumped = self.schema.dump(rows, many=True)
+
+        for field, (attribute, schema) in self.relations.items():
+            related = dump_in_order(schema, [getattr(row, attribute) for row in rows])
+            for item, value in zip(dumped, related):
+                item[field] = value
+
+        return dumped if many else dumped[0]
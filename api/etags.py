@@ -0,0 +1,83 @@
+import hashlib
+
+from flask import current_app, request
+from werkzeug.http import quote_etag
+
+from api.models import get_version
+
+ANY_VERSION = '*'
+
+
+def collection_etag(*tables):
+    '''
+    Strong ETag for a listing drawn from `tables`.
+
+    Built from the tables' change counters and what shapes the body (query
+    string and Accept header), so it is known before the listing query
+    runs.
+    '''
+    versions = ','.join(str(get_version(table)) for table in tables)
+    representation = (f'{versions}\n{request.full_path}\n'
+                      f'{request.headers.get("Accept", "")}')
+    return hashlib.sha1(representation.encode()).hexdigest()
+
+
+def not_modified(etag):
+    '''
+    A 304 response when the client already holds `etag`, otherwise None.
+    '''
+    if etag in request.if_none_match:
+        return current_app.response_class(status=304, headers=etag_headers(etag))
+    return None
+
+
+def etag_headers(etag, headers=None):
+    return dict(headers or {}, ETag=quote_etag(etag))
+
+
+def version_etag(row_id, version, fields=None):
+    '''
+    Strong ETag of row `row_id` at `version`, so rows of one table that
+    happen to share a version never share a tag. A narrowed representation
+    gets its own tag, leading with the same row and version.
+    '''
+    tag = f'{row_id}.{version}'
+    if fields:
+        tag += f';fields={",".join(fields)}'
+    return tag
+
+
+def versioned(response, row_id, version, fields=None):
+    '''
+    Tag `response` with the row's version and answer 304 on a match.
+    '''
+    response.set_etag(version_etag(row_id, version, fields))
+    return response.make_conditional(request)
+
+
+def if_match(row_id):
+    '''
+    The versions of row `row_id` a write is conditional on: None without
+    If-Match, ANY_VERSION for `*`, otherwise the versions of the tags
+    listed. Tags that are not version ETags of this row name no version,
+    so never match.
+    '''
+    if not request.if_match:
+        return None
+    if request.if_match.star_tag:
+        return ANY_VERSION
+
+    versions = []
+    for tag in request.if_match:
+        tagged_id, _, version = tag.split(';', 1)[0].partition('.')
+        if tagged_id == str(row_id) and version.isdigit():
+            versions.append(int(version))
+    return versions
+
+
+def conditional(response):
+    '''
+    Tag `response` with a hash of its body and answer 304 on a match.
+    '''
+    response.add_etag()
+    return response.make_conditional(request)
@@ -0,0 +1,87 @@
+from flask import request
+from flask_restful import abort
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only
+
+from api.dumpers import Embedded
+from api.messages import UNKNOWN_EXPANSIONS, UNKNOWN_FIELDS
+from api.pagination import list_arg
+
+
+def requested_fields(schema):
+    '''
+    The field names asked for with `?fields=`, or None for all of them.
+
+    Aborts with 400 when a name is not one of the fields `schema` dumps.
+    '''
+    value = request.args.get('fields')
+    if value is None:
+        return None
+
+    names = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in names if name not in schema.dump_fields]
+    if unknown or not names:
+        abort(400, message=UNKNOWN_FIELDS % ', '.join(unknown))
+
+    return names
+
+
+def requested_expansions(schema):
+    '''
+    The foreign keys asked to be expanded with `?expand=`, out of the
+    schema's `expandable` ones. Aborts with 400 on any other name.
+    '''
+    expandable = getattr(schema, 'expandable', {})
+    names = list_arg('expand') or []
+
+    unknown = [name for name in names if name not in expandable]
+    if unknown:
+        abort(400, message=UNKNOWN_EXPANSIONS % ', '.join(unknown))
+
+    return list(dict.fromkeys(names))
+
+
+def expanded_tables(schema, expand):
+    return [schema.expandable[name][1].Meta.model.__tablename__ for name in expand]
+
+
+def sparse_schema(schema):
+    '''
+    `schema` narrowed to the requested fields, embedding the requested
+    expansions.
+    '''
+    expand = requested_expansions(schema)
+    fields = requested_fields(schema)
+    if fields is not None:
+        schema = type(schema)(only=fields, many=schema.many)
+
+    relations = {name: schema.expandable[name] for name in expand if name in schema.dump_fields}
+    if relations:
+        return Embedded(schema, relations)
+    return schema
+
+
+def load_fields(query, model, fields, *keys):
+    '''
+    Restrict `query` to the columns behind `fields`.
+
+    The primary key, which URLs are built from, and any sort `keys` are
+    always loaded. Columns left out are deferred rather than fetched.
+    '''
+    if not fields:
+        return query
+
+    columns = {column.key for column in inspect(model).column_attrs}
+    names = [name for name in fields if name in columns]
+    names += [key for key in ('id', ) + keys if key not in names]
+
+    return query.options(load_only(*names))
+
+
+class SparseFieldsMixin():
+    '''
+    Lets `marshal_with` honour `?fields=`: flask_apispec calls schema
+    objects that are callable with the request before dumping.
+    '''
+    def __call__(self, request):
+        return sparse_schema(self)
@@ -2,6 +2,16 @@ STATUS_400 = 'Invalid Data'
 STATUS_404 = 'Resource not found'
 STATUS_405 = 'Operation not allowed'
 STATUS_409 = 'Resource already exists:  %s'
+STATUS_412 = 'Resource changed since it was read'
 OVERDUE = 'Rent Overdue'
 STOCK_SHORTAGE = 'Only %s books available'
 OUT_OF_STOCK = 'Out of Stock'
+CHECKOUT_CONFLICT = 'Too many concurrent checkouts, try again'
+INVALID_CURSOR = 'Invalid pagination cursor'
+INVALID_LIMIT = 'Limit must be a positive integer'
+INVALID_JSON = 'Invalid JSON'
+UNKNOWN_FIELDS = 'Unknown fields: %s'
+INVALID_LIST = '%s must list 1 to %s comma separated values'
+UNKNOWN_EXPANSIONS = 'Cannot expand: %s'
+DUPLICATE_IDS = 'Repeated ids: %s'
+TOO_MANY_ROWS = 'At most %s rows per request'
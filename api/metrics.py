@@ -0,0 +1,255 @@
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PREFIX = 'elibrary'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Request latency, by endpoint and method.',
+                                      LATENCY_BUCKETS),
+    'http_request_queries': ('SQL statements run per request, by endpoint and method.',
+                             QUERY_BUCKETS),
+    'http_request_sql_duration_seconds': ('Time spent in SQL per request, by endpoint and method.',
+                                          LATENCY_BUCKETS),
+}
+
+# The request being served by this thread, if any, for the engine hooks.
+_current = threading.local()
+
+
+class RequestState():
+    __slots__ = ('start', 'queries', 'sql_time', 'status')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.status = 500
+
+
+class Histogram():
+    '''
+    Observations counted per bucket upper bound, plus their sum. Not
+    locked; a writer takes its own lock or keeps the histogram per thread.
+    '''
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # A count per bucket, then one for +Inf.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def add(self, other):
+        for index, count in enumerate(list(other.counts)):
+            self.counts[index] += count
+        self.sum += other.sum
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.add(self)
+        return histogram
+
+    def cumulative(self):
+        '''
+        Observations at or below each bucket bound, +Inf last.
+        '''
+        total = 0
+        counts = []
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class Shard():
+    '''
+    Metrics recorded by one thread. Only that thread writes to it, so
+    recording takes no lock; readers sum every shard.
+    '''
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = defaultdict(int)
+        self.histograms = {}
+
+    def observe(self, name, labels, value):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram(HISTOGRAMS[name][1])
+        histogram.observe(value)
+
+    def add(self, other):
+        '''
+        Add the figures of `other`, copying its containers first as its
+        thread may still be writing to them.
+        '''
+        self.in_flight += other.in_flight
+        for labels, count in dict(other.requests).items():
+            self.requests[labels] += count
+        for key, histogram in dict(other.histograms).items():
+            total = self.histograms.get(key)
+            if total is None:
+                total = self.histograms[key] = Histogram(histogram.buckets)
+            total.add(histogram)
+
+
+class Registry():
+    '''
+    A shard per live thread. When a thread is garbage collected its shard
+    is folded into `retired`, so servers starting a thread per request
+    keep a bounded number of shards.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.shards = []
+        self.retired = Shard()
+
+    @property
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = Shard()
+            with self.lock:
+                self.shards.append(shard)
+            weakref.finalize(threading.current_thread(), self.retire, shard)
+        return shard
+
+    def retire(self, shard):
+        with self.lock:
+            self.shards.remove(shard)
+            self.retired.add(shard)
+
+    def collect(self):
+        '''
+        Sum the shards into (in flight, request counts, histograms).
+        '''
+        total = Shard()
+        with self.lock:
+            total.add(self.retired)
+            shards = list(self.shards)
+
+        for shard in shards:
+            total.add(shard)
+        return total.in_flight, total.requests, total.histograms
+
+
+def format_labels(**labels):
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in labels.items())
+    return '{' + pairs + '}'
+
+
+class Metrics():
+    '''
+    Request latency, status counts, requests in flight and per request SQL
+    statement count and time, served in Prometheus text format at
+    `/metrics`. Each process keeps its own figures.
+    '''
+    def init_app(self, app):
+        app.extensions['metrics'] = Registry()
+        app.before_request(self.start_request)
+        app.after_request(self.record_status)
+        app.teardown_request(self.finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+    @property
+    def registry(self):
+        return current_app.extensions['metrics']
+
+    def start_request(self):
+        _current.request = RequestState()
+        self.registry.shard.in_flight += 1
+
+    def record_status(self, response):
+        state = getattr(_current, 'request', None)
+        if state:
+            state.status = response.status_code
+        return response
+
+    def finish_request(self, exception=None):
+        state = getattr(_current, 'request', None)
+        if state is None:
+            return
+        _current.request = None
+
+        shard = self.registry.shard
+        shard.in_flight -= 1
+
+        labels = (request.endpoint or 'none', request.method)
+        shard.requests[labels + (state.status, )] += 1
+        shard.observe('http_request_duration_seconds', labels, time.perf_counter() - state.start)
+        shard.observe('http_request_queries', labels, state.queries)
+        shard.observe('http_request_sql_duration_seconds', labels, state.sql_time)
+
+    def export(self):
+        in_flight, requests, histograms = self.registry.collect()
+        lines = []
+
+        lines.append(f'# HELP {PREFIX}_http_requests_in_flight Requests being served.')
+        lines.append(f'# TYPE {PREFIX}_http_requests_in_flight gauge')
+        lines.append(f'{PREFIX}_http_requests_in_flight {in_flight}')
+
+        lines.append(f'# HELP {PREFIX}_http_requests_total Requests served, '
+                     f'by endpoint, method and status.')
+        lines.append(f'# TYPE {PREFIX}_http_requests_total counter')
+        for (endpoint, method, status), count in sorted(requests.items()):
+            labels = format_labels(endpoint=endpoint, method=method, status=status)
+            lines.append(f'{PREFIX}_http_requests_total{labels} {count}')
+
+        for name, (description, buckets) in HISTOGRAMS.items():
+            lines.append(f'# HELP {PREFIX}_{name} {description}')
+            lines.append(f'# TYPE {PREFIX}_{name} histogram')
+            for (histogram, (endpoint, method)), values in sorted(histograms.items(),
+                                                                  key=lambda item: item[0]):
+                if histogram != name:
+                    continue
+
+                counts = values.cumulative()
+                for bound, count in zip(buckets + ('+Inf', ), counts):
+                    labels = format_labels(endpoint=endpoint, method=method, le=bound)
+                    lines.append(f'{PREFIX}_{name}_bucket{labels} {count}')
+
+                labels = format_labels(endpoint=endpoint, method=method)
+                lines.append(f'{PREFIX}_{name}_sum{labels} {values.sum}')
+                lines.append(f'{PREFIX}_{name}_count{labels} {counts[-1]}')
+
+        cache = current_app.extensions.get('cache')
+        if cache:
+            for name, count in sorted(cache.stats().items()):
+                lines.append(f'# HELP {PREFIX}_cache_{name}_total Entity cache {name}.')
+                lines.append(f'# TYPE {PREFIX}_cache_{name}_total counter')
+                lines.append(f'{PREFIX}_cache_{name}_total {count}')
+
+        return current_app.response_class('\n'.join(lines) + '\n',
+                                          mimetype='text/plain; version=0.0.4')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(connection, cursor, statement, parameters, context, executemany):
+    if getattr(_current, 'request', None) is not None:
+        connection.info['metrics_query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_query(connection, cursor, statement, parameters, context, executemany):
+    state = getattr(_current, 'request', None)
+    start = connection.info.pop('metrics_query_start', None)
+    if state is not None and start is not None:
+        state.queries += 1
+        state.sql_time += time.perf_counter() - start
+
+
+metrics = Metrics()
@@ -1,8 +1,13 @@
 from datetime import datetime
+from itertools import chain
 
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, event, inspect, or_, select, text, true
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import func
 
-db = SQLAlchemy()
+from api.routing import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 
 class User(db.Model):
@@ -17,6 +22,16 @@ class User(db.Model):
     first_name = db.Column(db.String(255), nullable=False)
     last_name = db.Column(db.String(255))
     contact = db.Column(db.String(10), nullable=False)
+    total_rent = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    outstanding_due = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Checked by ORM updates and bumped by Core writes to the fields the API
+    # exposes; served as the row's ETag.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __table_args__ = (
+        db.Index('ix_users_total_rent', total_rent.desc(), id),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, first_name, contact, email=None, last_name=None):
         self.email = email
@@ -56,6 +71,13 @@ class Book(db.Model):
     author = db.Column(db.String(255), nullable=False)
     price = db.Column(db.Integer(), default=30)
     stock = db.Column(db.Integer, default=1)
+    rent_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __table_args__ = (
+        db.Index('ix_books_popularity', rent_count.desc(), id),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, title, isbn, author, stock=None, price=None):
         self.title = title
@@ -88,6 +110,18 @@ class Transaction(db.Model):
     rent = db.Column(db.Integer, nullable=False)
     date_rented = db.Column(db.DateTime, default=datetime.now)
     date_return = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    rented_by = db.relationship(User, viewonly=True)
+    rented_book = db.relationship(Book, viewonly=True)
+
+    __table_args__ = (
+        # Open rentals per member, as summed when reconciling dues.
+        db.Index('ix_transactions_open_member', member, rent,
+                 sqlite_where=date_return.is_(None), postgresql_where=date_return.is_(None)),
+        db.Index('ix_transactions_book', book),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, member, book, num_copies, rent, date_rented=None, date_return=None):
         self.member = member
@@ -102,3 +136,276 @@ class Transaction(db.Model):
 
     def __repr__(self):
         return '<id {}>'.format(self.id)
+
+
+class TableVersion(db.Model):
+    '''
+    Change counter per table, bumped after every commit that writes to it.
+    '''
+
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, name, version=0):
+        self.name = name
+        self.version = version
+
+    def __repr__(self):
+        return '<name {}>'.format(self.name)
+
+
+class Change(db.Model):
+    '''
+    Append-only log of row writes, read by the change feed.
+    '''
+
+    __tablename__ = 'changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # The writing transaction on Postgres, 0 elsewhere; see `feed_condition`.
+    txid = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    table_name = db.Column(db.String(64), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(6), nullable=False)
+    date_changed = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_changes_position', txid, id),
+    )
+
+    def __init__(self, table_name, row_id, operation):
+        self.table_name = table_name
+        self.row_id = row_id
+        self.operation = operation
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+# Tables whose writes are logged for the change feed.
+FEED_TABLES = ('books', 'transactions', 'users')
+
+
+def log_changes(connection, table, changes):
+    '''
+    Append (row id, operation) pairs for `table` to the change log.
+    '''
+    if not changes:
+        return
+
+    insert = Change.__table__.insert()
+    if connection.dialect.name == 'postgresql':
+        insert = insert.values(txid=func.txid_current())
+
+    connection.execute(insert, [{'table_name': table, 'row_id': row_id, 'operation': operation}
+                                for row_id, operation in changes])
+
+
+def feed_condition(connection, after=None):
+    '''
+    Condition on `changes` for the rows following the (txid, id) position
+    `after` that no unfinished write can still come before.
+
+    Postgres writers append concurrently, so ids may commit out of order.
+    Every transaction below the snapshot's xmin has finished and later ones
+    get larger txids, so rows under that horizon are final in (txid, id)
+    order and the rest wait for the next read. Elsewhere writers are
+    serialized by the database, txid stays 0 and the order is by id.
+    '''
+    changes = Change.__table__
+    condition = true()
+    if connection.dialect.name == 'postgresql':
+        horizon = connection.execute(
+            text('SELECT txid_snapshot_xmin(txid_current_snapshot())')).scalar()
+        condition = and_(condition, changes.c.txid < horizon)
+
+    if after:
+        txid, change_id = after
+        condition = and_(condition, or_(changes.c.txid > txid,
+                                        and_(changes.c.txid == txid, changes.c.id > change_id)))
+    return condition
+
+
+# Tables whose denormalized counters change along with another table.
+DERIVED_TABLES = {
+    'transactions': ('books', 'users'),
+}
+
+
+def get_version(name):
+    version = db.session.query(TableVersion.version).filter_by(name=name).scalar()
+    return version or 0
+
+
+def bump_version(connection, name):
+    versions = TableVersion.__table__
+    result = connection.execute(versions.update()
+                                .where(versions.c.name == name)
+                                .values(version=versions.c.version + 1))
+    if not result.rowcount:
+        connection.execute(versions.insert().values(name=name, version=1))
+
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def seed_versions(table, connection, **kwargs):
+    connection.execute(table.insert(), [{'name': name, 'version': 0}
+                                        for name in ('books', 'transactions', 'users')])
+
+
+def mark_written(session, *tables):
+    '''
+    Note that `session` wrote to `tables`; their versions move once it
+    commits.
+
+    The version rows are shared by every writer, so they are bumped in a
+    short transaction of their own after the commit instead of being held
+    locked until the writer's commit.
+    '''
+    session.info.setdefault('written_tables', set()).update(tables)
+
+
+def record_writes(session, table, changes):
+    '''
+    Log (row id, operation) pairs written to `table` in `session`.
+
+    The log rows are appended at once; the table version and the cached
+    payloads of the rows follow the commit (see `mark_written` and the
+    entity cache).
+    '''
+    if not changes:
+        return
+
+    mark_written(session, table)
+    session.info.setdefault('written_rows', set()).update((table, row_id)
+                                                          for row_id, _ in changes)
+    log_changes(session.connection(), table, changes)
+
+
+@event.listens_for(Session, 'after_flush')
+def bump_versions(session, flush_context):
+    written = set()
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if instance in session.dirty and not session.is_modified(instance):
+            continue
+
+        table = inspect(instance).mapper.local_table.name
+        if table != TableVersion.__tablename__:
+            written.add(table)
+            written.update(DERIVED_TABLES.get(table, ()))
+
+    mark_written(session, *written)
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_versions(session):
+    written = session.info.pop('written_tables', None)
+    if not written:
+        return
+
+    versions = TableVersion.__table__
+    engine = session.get_bind(TableVersion.__mapper__, clause=versions.update())
+    with engine.begin() as connection:
+        for table in sorted(written):
+            bump_version(connection, table)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_versions(session):
+    session.info.pop('written_tables', None)
+
+
+@event.listens_for(Session, 'after_flush')
+def log_writes(session, flush_context):
+    written = {}
+    for operation, instances in (('insert', session.new), ('update', session.dirty),
+                                 ('delete', session.deleted)):
+        for instance in instances:
+            if operation == 'update' and not session.is_modified(instance):
+                continue
+
+            table = inspect(instance).mapper.local_table.name
+            if table in FEED_TABLES:
+                written.setdefault(table, []).append((instance.id, operation))
+
+    for table in sorted(written):
+        record_writes(session, table, written[table])
+
+
+# Denormalized counters, kept in step with `transactions` in the same flush
+# whichever way a transaction is written (service layer or admin).
+
+def adjust_rent_count(connection, book_id, delta):
+    books = Book.__table__
+    connection.execute(books.update()
+                       .where(books.c.id == book_id)
+                       .values(rent_count=books.c.rent_count + delta))
+
+
+def adjust_total_rent(connection, member_id, delta):
+    users = User.__table__
+    connection.execute(users.update()
+                       .where(users.c.id == member_id)
+                       .values(total_rent=users.c.total_rent + delta))
+
+
+def previous_value(transaction, attribute):
+    history = inspect(transaction).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(transaction, attribute)
+
+
+@event.listens_for(Session, 'after_flush')
+def count_rentals(session, flush_context):
+    # Runs once the whole flush is written, so the books and members a new
+    # rental points at have been inserted already.
+    connection = session.connection()
+
+    for transaction in session.new:
+        if isinstance(transaction, Transaction):
+            adjust_rent_count(connection, transaction.book, 1)
+            adjust_total_rent(connection, transaction.member, transaction.rent)
+
+    for transaction in session.deleted:
+        if isinstance(transaction, Transaction):
+            adjust_rent_count(connection, transaction.book, -1)
+            adjust_total_rent(connection, transaction.member, -transaction.rent)
+
+    for transaction in session.dirty:
+        if not isinstance(transaction, Transaction):
+            continue
+
+        book = previous_value(transaction, 'book')
+        if book != transaction.book:
+            adjust_rent_count(connection, book, -1)
+            adjust_rent_count(connection, transaction.book, 1)
+
+        member = previous_value(transaction, 'member')
+        rent = previous_value(transaction, 'rent')
+        if (member, rent) != (transaction.member, transaction.rent):
+            adjust_total_rent(connection, member, -rent)
+            adjust_total_rent(connection, transaction.member, transaction.rent)
+
+
+def rebuild_counters(connection):
+    '''
+    Recompute every denormalized counter from the transaction history.
+    '''
+    books = Book.__table__
+    users = User.__table__
+    transactions = Transaction.__table__
+
+    rentals = select([func.count(transactions.c.id)])\
+        .where(transactions.c.book == books.c.id)\
+        .scalar_subquery()
+    connection.execute(books.update().values(rent_count=rentals))
+
+    rent = select([func.coalesce(func.sum(transactions.c.rent), 0)])\
+        .where(transactions.c.member == users.c.id)\
+        .scalar_subquery()
+    connection.execute(users.update().values(total_rent=rent))
+
+    for table in ('books', 'users'):
+        bump_version(connection, table)
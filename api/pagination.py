@@ -0,0 +1,139 @@
+import base64
+import json
+from urllib.parse import urlencode
+
+from flask import request
+from flask_restful import abort
+
+from api.constants import DEFAULT_RESULT_LIMIT, MAX_RESULT_LIMIT
+from api.messages import INVALID_CURSOR, INVALID_LIMIT, INVALID_LIST
+
+# Cursor shapes: the types of a listing's sort key, in order.
+ID_KEY = (int, )
+RANKED_KEY = (int, int)
+SCORED_KEY = ((int, float), int)
+LOG_KEY = (int, int)
+
+
+class Page(list):
+    '''
+    One page of a keyset paginated listing.
+
+    Behaves like the plain list the services used to return, and additionally
+    carries the sort key of its last row when more rows follow.
+    '''
+    def __init__(self, items, next_key=None):
+        super().__init__(items)
+        self.next_key = next_key
+
+
+def encode_cursor(key):
+    payload = json.dumps(list(key), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor, shape=ID_KEY):
+    '''
+    Decode a cursor, checking it is a sort key of the listing's `shape` so
+    a tampered cursor or one from another listing is rejected.
+    '''
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError(INVALID_CURSOR)
+
+    if not isinstance(key, list) or len(key) != len(shape):
+        raise ValueError(INVALID_CURSOR)
+    for value, kind in zip(key, shape):
+        if isinstance(value, bool) or not isinstance(value, kind):
+            raise ValueError(INVALID_CURSOR)
+    return tuple(key)
+
+
+def get_limit(limit, default=DEFAULT_RESULT_LIMIT, maximum=MAX_RESULT_LIMIT):
+    '''
+    Parse a requested page size, clamping it to the server maximum.
+    '''
+    if limit in (None, ''):
+        return default
+
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError(INVALID_LIMIT)
+
+    if limit < 1:
+        raise ValueError(INVALID_LIMIT)
+    return min(limit, maximum) if maximum else limit
+
+
+def page_args(default=DEFAULT_RESULT_LIMIT, maximum=MAX_RESULT_LIMIT, cursor='after',
+              shape=ID_KEY):
+    '''
+    Read the `cursor` argument (`after` by default) and `limit` from the
+    query string, aborting on bad input. The cursor must be a sort key of
+    the given `shape`.
+    '''
+    after = request.args.get(cursor)
+
+    try:
+        after = decode_cursor(after, shape) if after else None
+        limit = get_limit(request.args.get('limit'), default, maximum)
+    except ValueError as e:
+        abort(400, message=e.args[0])
+
+    return after, limit
+
+
+def list_arg(name, convert=str, maximum=MAX_RESULT_LIMIT):
+    '''
+    Read a comma separated list from the query string, aborting on bad
+    input. Returns None when the argument is absent.
+    '''
+    value = request.args.get(name)
+    if value is None:
+        return None
+
+    try:
+        values = [convert(item.strip()) for item in value.split(',') if item.strip()]
+    except ValueError:
+        values = None
+
+    if not values or len(values) > maximum:
+        abort(400, message=INVALID_LIST % (name, maximum))
+    return values
+
+
+def paginate(query, limit, key, item=None):
+    '''
+    Fetch one page from an already keyset-filtered and ordered query.
+
+    One extra row is requested to learn whether a next page exists without
+    a separate count query. `key` maps a row to its sort key and `item`
+    optionally maps a row to the object placed on the page.
+    '''
+    rows = query.limit(limit + 1).all()
+
+    next_key = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_key = key(rows[-1])
+
+    if item:
+        rows = [item(row) for row in rows]
+    return Page(rows, next_key)
+
+
+def page_headers(page, cursor='after'):
+    '''
+    Build the `Link` header pointing at the page after `page`.
+    '''
+    if page.next_key is None:
+        return {}
+
+    args = request.args.to_dict()
+    args[cursor] = encode_cursor(page.next_key)
+    next_url = f'{request.base_url}?{urlencode(args)}'
+
+    return {'Link': f'<{next_url}>; rel="next"'}
@@ -0,0 +1,174 @@
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+from api.metrics import Histogram
+
+# Seconds a checkout took: waiting for a connection, opening or pinging it.
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+
+class PoolStats():
+    '''
+    Checkout figures of one pool, kept per process.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+        self.waits = Histogram(POOL_WAIT_BUCKETS)
+
+    def waited(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.waits.observe(seconds)
+
+    def overflowed(self):
+        with self.lock:
+            self.overflow_events += 1
+
+    def timed_out(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        with self.lock:
+            waits = self.waits.copy()
+            figures = {'checkouts': self.checkouts,
+                       'overflow_events': self.overflow_events, 'timeouts': self.timeouts}
+
+        buckets = [{'le': bound, 'count': count}
+                   for bound, count in zip(POOL_WAIT_BUCKETS + (None, ), waits.cumulative())]
+        return dict(figures, wait_buckets=buckets, wait_sum=waits.sum)
+
+
+class InstrumentedPool():
+    '''
+    Pool mixin timing each checkout and counting overflow connections
+    opened and checkouts that gave up after `pool_timeout`.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.timed_out()
+            raise
+
+        self.stats.waited(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(InstrumentedPool, QueuePool):
+    def _inc_overflow(self):
+        opened = super()._inc_overflow()
+        # The overflow counter starts at -pool_size, so past zero every
+        # connection opened is one over the pool size.
+        if opened and self._overflow > 0:
+            self.stats.overflowed()
+        return opened
+
+
+class InstrumentedNullPool(InstrumentedPool, NullPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.open = 0
+
+    def checkedout(self):
+        return self.open
+
+    def _do_get(self):
+        connection = super()._do_get()
+        with self.stats.lock:
+            self.open += 1
+        return connection
+
+    def _do_return_conn(self, connection):
+        with self.stats.lock:
+            self.open -= 1
+        super()._do_return_conn(connection)
+
+
+def pool_options(config, sa_url, options):
+    '''
+    Engine options for `sa_url` from the DATABASE_POOL_* settings.
+
+    SQLite opens a connection per checkout, so sizing does not apply to it;
+    the statement timeout is set for Postgres connections only.
+    '''
+    options = dict(options)
+    options['pool_recycle'] = config['DATABASE_POOL_RECYCLE']
+    options['pool_pre_ping'] = config['DATABASE_POOL_PRE_PING']
+
+    if options.get('poolclass') is NullPool:
+        options['poolclass'] = InstrumentedNullPool
+    elif 'poolclass' not in options:
+        options['poolclass'] = InstrumentedQueuePool
+        options['pool_size'] = config['DATABASE_POOL_SIZE']
+        options['max_overflow'] = config['DATABASE_MAX_OVERFLOW']
+        options['pool_timeout'] = config['DATABASE_POOL_TIMEOUT']
+
+    timeout = config['DATABASE_STATEMENT_TIMEOUT']
+    if timeout and sa_url.get_backend_name() == 'postgresql':
+        connect_args = dict(options.get('connect_args', {}))
+        connect_args['options'] = f'-c statement_timeout={int(timeout * 1000)}'
+        options['connect_args'] = connect_args
+
+    return options
+
+
+def engine_pool_stats(engine):
+    '''
+    Configuration and live figures of `engine`'s pool, or None when the
+    pool is not instrumented.
+    '''
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedPool):
+        return None
+
+    figures = {'dialect': engine.dialect.name, 'pool': type(pool).__name__,
+               'size': None, 'overflow': None, 'checked_out': pool.checkedout()}
+    if isinstance(pool, QueuePool):
+        figures.update(size=pool.size(), overflow=max(pool.overflow(), 0))
+    return dict(figures, **pool.stats.snapshot())
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    '''
+    Builds every engine, binds included, on an instrumented pool sized by
+    the DATABASE_POOL_* settings of the configuration class.
+    '''
+    def init_app(self, app):
+        app.config.setdefault('DATABASE_POOL_SIZE', 5)
+        app.config.setdefault('DATABASE_MAX_OVERFLOW', 10)
+        app.config.setdefault('DATABASE_POOL_TIMEOUT', 30)
+        app.config.setdefault('DATABASE_POOL_RECYCLE', -1)
+        app.config.setdefault('DATABASE_POOL_PRE_PING', False)
+        app.config.setdefault('DATABASE_STATEMENT_TIMEOUT', None)
+        super().init_app(app)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        return sa_url, pool_options(app.config, sa_url, options)
+
+    def pool_stats(self, app=None):
+        '''
+        Pool figures of the primary and every bind, by bind name.
+        '''
+        app = self.get_app(app)
+        binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())
+
+        stats = []
+        for bind in binds:
+            figures = engine_pool_stats(self.get_engine(app, bind))
+            if figures is not None:
+                stats.append(dict(figures, bind=bind or 'primary'))
+        return stats
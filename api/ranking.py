@@ -0,0 +1,35 @@
+from sqlalchemy import and_, desc, or_
+
+from api.fieldsets import load_fields
+from api.models import Book, User
+from api.pagination import paginate
+
+
+class Leaderboard():
+    '''
+    Rows of a model ranked by a denormalized score column.
+
+    Pages are read straight from the (score desc, id) index, so a page costs
+    one indexed range scan however often other writes touch the table.
+    '''
+    def __init__(self, model, score):
+        self.model = model
+        self.score = score
+
+    def query(self, after=None, fields=None):
+        score = getattr(self.model, self.score)
+        rows = load_fields(self.model.query, self.model, fields, self.score)
+        if after:
+            after_score, after_id = after
+            rows = rows.filter(or_(score < after_score,
+                                   and_(score == after_score, self.model.id > after_id)))
+
+        return rows.order_by(desc(score), self.model.id)
+
+    def page(self, limit, after=None, fields=None):
+        return paginate(self.query(after, fields), limit,
+                        key=lambda row: (getattr(row, self.score), row.id))
+
+
+popular_books = Leaderboard(Book, 'rent_count')
+highest_paying_users = Leaderboard(User, 'total_rent')
@@ -1,42 +1,89 @@
-from flask import request
+from flask import jsonify, request
 from flask_apispec import marshal_with
 from flask_apispec.views import MethodResource
 from flask_restful import Resource, abort
+from marshmallow import ValidationError
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm.exc import NoResultFound
-
-from api.constants import BOOKS_ENDPOINT, TRANSACTIONS_ENDPOINT, USERS_ENDPOINT
-from api.decorators import validate_request_data
-from api.messages import STATUS_404, STATUS_405, STATUS_409
-from api.serializers import (BookSchema, ResponseSchema, TransactionSchema,
-                             UserSchema)
-from api.services import BookService, TransactionService, UserService
+from sqlalchemy.orm.exc import NoResultFound, StaleDataError
+
+from api.bulk import CSV_MIMETYPES, read_rows
+from api.cache import entity_cache, payload_response
+from api.constants import (BOOKS_ENDPOINT, IMPORT_BATCH_SIZE, TRANSACTIONS_ENDPOINT,
+                           USERS_ENDPOINT)
+from api.decorators import load_request_data
+from api.dumpers import dump_in_order
+from api.etags import (collection_etag, conditional, etag_headers, if_match, not_modified,
+                       versioned)
+from api.fieldsets import (expanded_tables, requested_expansions, requested_fields,
+                           sparse_schema)
+from api.messages import STATUS_404, STATUS_405, STATUS_409, STATUS_412, TOO_MANY_ROWS
+from api.models import db
+from api.pagination import (ID_KEY, LOG_KEY, RANKED_KEY, SCORED_KEY, encode_cursor,
+                            list_arg, page_args, page_headers)
+from api.serializers import (BatchCheckoutSchema, BatchReturnSchema, BookSchema,
+                             CacheStatsSchema, ChangeFeedSchema, CheckoutResultSchema,
+                             ImportReportSchema, PoolStatsSchema, ResponseSchema,
+                             ReturnResultSchema,
+                             TransactionSchema, UpsertResultSchema, UserSchema,
+                             book_schema, transaction_schema, user_schema)
+from api.services import BookService, ChangeService, TransactionService, UserService
+from api.streaming import stream_format, stream_response
+
+
+def upsert_response(update, endpoint, rows):
+    '''
+    Upsert `rows` with `update` and report each row's url and whether it
+    was created.
+    '''
+    if len(rows) > IMPORT_BATCH_SIZE:
+        abort(400, message=TOO_MANY_ROWS % IMPORT_BATCH_SIZE)
+
+    try:
+        created = update(rows)
+    except ValidationError as e:
+        abort(400, message=e.messages)
+    except IntegrityError as e:
+        abort(409, message=STATUS_409 % e.orig)
+
+    return [{'url': f"{endpoint}/{row['id']}/", 'created': flag}
+            for row, flag in zip(rows, created)], 200
 
 
 class Book(MethodResource, Resource, BookService):
     @marshal_with(BookSchema)
     def get(self, book_id=None):
-        book = self.get_book(book_id)
+        fields = requested_fields(book_schema)
+        book = self.get_book_data(book_id)
 
         if not book:
             abort(404, message=STATUS_404)
 
-        return book, 200
+        version, payload = book
+        return versioned(payload_response(payload, fields), book_id, version, fields)
 
     @marshal_with(ResponseSchema, code=204)
-    @validate_request_data(BookSchema(), partial=True)
-    def put(self, book_id):
-        request_data = request.get_json()
+    @load_request_data(BookSchema(), partial=True)
+    def put(self, book_id, request_data):
+        try:
+            created = self.update_book(book_id, request_data, if_match(book_id))
+        except ValidationError as e:
+            abort(400, message=e.messages)
+        except IntegrityError as e:
+            abort(409, message=STATUS_409 % e.orig)
+        except StaleDataError:
+            abort(412, message=STATUS_412)
 
-        book = self.update_book(book_id, request_data)
-        if book:
-            return {'url': f'{BOOKS_ENDPOINT}/{str(book.id)}/'}, 201
+        if created:
+            return {'url': f'{BOOKS_ENDPOINT}/{book_id}/'}, 201
         else:
             return '', 204
 
     @marshal_with(ResponseSchema)
     def delete(self, book_id):
-        book_id = self.delete_book(book_id)
+        try:
+            book_id = self.delete_book(book_id, if_match(book_id))
+        except StaleDataError:
+            abort(412, message=STATUS_412)
 
         if book_id:
             return book_id, 200
@@ -47,13 +94,38 @@ class Book(MethodResource, Resource, BookService):
 class Books(MethodResource, Resource, BookService):
     @marshal_with(BookSchema(many=True))
     def get(self, request_type=None):
-        return self.get_books(request_type, **request.args)
+        fields = requested_fields(book_schema)
+        etag = collection_etag('books')
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
+        ids, isbns = list_arg('ids', int), list_arg('isbn')
+        if request_type is None and (ids or isbns):
+            books = self.get_books_by('id', ids, fields) if ids \
+                else self.get_books_by('isbn', isbns, fields)
+            response = jsonify(dump_in_order(sparse_schema(book_schema), books))
+            response.set_etag(etag)
+            return response
+
+        shape = {'popular': RANKED_KEY, 'search': SCORED_KEY}.get(request_type, ID_KEY)
+        streaming = stream_format()
+        if streaming and request_type != 'search':
+            after, limit = page_args(default=None, maximum=None, shape=shape)
+            response = stream_response(self.query_books(request_type, after, fields),
+                                       sparse_schema(book_schema), streaming, limit)
+            response.set_etag(etag)
+            return response
+
+        after, limit = page_args(shape=shape)
+        filters = {key: request.args[key] for key in ('title', 'author') if key in request.args}
+
+        books = self.get_books(request_type, limit, after, fields, **filters)
+        return books, 200, etag_headers(etag, page_headers(books))
 
     @marshal_with(ResponseSchema)
-    @validate_request_data(BookSchema(), partial=False)
-    def post(self):
-        request_data = request.get_json()
-
+    @load_request_data(BookSchema(), partial=False)
+    def post(self, request_data):
         try:
             book = self.add_book(request_data)
         except IntegrityError as e:
@@ -61,31 +133,59 @@ class Books(MethodResource, Resource, BookService):
         else:
             return {'url': f'{BOOKS_ENDPOINT}/{str(book.id)}/'}, 201
 
+    @marshal_with(UpsertResultSchema(many=True))
+    @load_request_data(BookSchema(many=True), partial=True)
+    def put(self, request_type=None, request_data=None):
+        if request_type is not None:
+            abort(405, message=STATUS_405)
+
+        return upsert_response(self.update_books, BOOKS_ENDPOINT, request_data)
+
+
+class BooksImport(MethodResource, Resource, BookService):
+    @marshal_with(ImportReportSchema)
+    def post(self):
+        csv_format = request.mimetype in CSV_MIMETYPES
+        report = self.import_books(read_rows(request.stream, csv_format))
+
+        return report, 200
+
 
 class User(MethodResource, Resource, UserService):
     @marshal_with(UserSchema)
     def get(self, user_id=None):
-        user = self.get_user(user_id)
+        fields = requested_fields(user_schema)
+        user = self.get_user_data(user_id)
 
         if not user:
             abort(404, message=STATUS_404)
 
-        return user, 200
+        version, payload = user
+        return versioned(payload_response(payload, fields), user_id, version, fields)
 
     @marshal_with(ResponseSchema)
-    @validate_request_data(UserSchema(), partial=True)
-    def put(self, user_id):
-        request_data = request.get_json()
+    @load_request_data(UserSchema(), partial=True)
+    def put(self, user_id, request_data):
+        try:
+            created = self.update_user(user_id, request_data, if_match(user_id))
+        except ValidationError as e:
+            abort(400, message=e.messages)
+        except IntegrityError as e:
+            abort(409, message=STATUS_409 % e.orig)
+        except StaleDataError:
+            abort(412, message=STATUS_412)
 
-        user = self.update_user(user_id, request_data)
-        if user:
-            return {'url': f'{USERS_ENDPOINT}/{str(user.id)}/'}, 201
+        if created:
+            return {'url': f'{USERS_ENDPOINT}/{user_id}/'}, 201
         else:
             return '', 204
 
     @marshal_with(ResponseSchema)
     def delete(self, user_id):
-        user_id = self.delete_user(user_id)
+        try:
+            user_id = self.delete_user(user_id, if_match(user_id))
+        except StaleDataError:
+            abort(412, message=STATUS_412)
 
         if user_id:
             return user_id, 200
@@ -96,13 +196,36 @@ class User(MethodResource, Resource, UserService):
 class Users(MethodResource, Resource, UserService):
     @marshal_with(UserSchema(many=True))
     def get(self, highest_paying=False):
-        limit = request.args.get('limit')
-        return self.get_users(highest_paying, limit)
+        fields = requested_fields(user_schema)
+        etag = collection_etag('users')
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
+        ids = list_arg('ids', int)
+        if ids and not highest_paying:
+            users = self.get_users_by('id', ids, fields)
+            response = jsonify(dump_in_order(sparse_schema(user_schema), users))
+            response.set_etag(etag)
+            return response
+
+        shape = RANKED_KEY if highest_paying else ID_KEY
+        streaming = stream_format()
+        if streaming:
+            after, limit = page_args(default=None, maximum=None, shape=shape)
+            response = stream_response(self.query_users(highest_paying, after, fields),
+                                       sparse_schema(user_schema), streaming, limit)
+            response.set_etag(etag)
+            return response
+
+        after, limit = page_args(shape=shape)
+
+        users = self.get_users(highest_paying, limit, after, fields)
+        return users, 200, etag_headers(etag, page_headers(users))
 
     @marshal_with(ResponseSchema)
-    @validate_request_data(UserSchema(), partial=False)
-    def post(self):
-        request_data = request.get_json()
+    @load_request_data(UserSchema(), partial=False)
+    def post(self, request_data):
 
         try:
             user = self.add_user(request_data)
@@ -111,27 +234,46 @@ class Users(MethodResource, Resource, UserService):
         else:
             return {'url': f'{USERS_ENDPOINT}/{str(user.id)}/'}, 201
 
+    @marshal_with(UpsertResultSchema(many=True))
+    @load_request_data(UserSchema(many=True), partial=True)
+    def put(self, highest_paying=False, request_data=None):
+        if highest_paying:
+            abort(405, message=STATUS_405)
+
+        return upsert_response(self.update_users, USERS_ENDPOINT, request_data)
+
 
 class Transaction(MethodResource, Resource, TransactionService):
     @marshal_with(TransactionSchema)
     def get(self, transaction_id=None):
-        transaction = self.get_transaction(transaction_id)
+        fields = requested_fields(transaction_schema)
+        expand = requested_expansions(transaction_schema)
+        if expand:
+            transaction = self.get_transaction(transaction_id, fields, expand)
+        else:
+            transaction = self.get_transaction_data(transaction_id)
 
         if not transaction:
             abort(404, message=STATUS_404)
 
-        return transaction, 200
+        if expand:
+            # Embeds rows of other tables, so its tag is a hash of the body.
+            return conditional(jsonify(sparse_schema(transaction_schema).dump(transaction)))
+
+        version, payload = transaction
+        return versioned(payload_response(payload, fields), transaction_id, version, fields)
 
     @marshal_with(ResponseSchema)
-    @validate_request_data(TransactionSchema(), partial=True)
     def put(self, transaction_id):
         if request.json or request.data:
             abort(405, message=STATUS_405)
 
         try:
-            self.update_transaction(transaction_id)
+            self.update_transaction(transaction_id, if_match(transaction_id))
         except NoResultFound:
             abort(404, message=STATUS_404)
+        except StaleDataError:
+            abort(412, message=STATUS_412)
         else:
             return '', 204
 
@@ -139,16 +281,78 @@ class Transaction(MethodResource, Resource, TransactionService):
 class Transactions(MethodResource, Resource, TransactionService):
     @marshal_with(TransactionSchema(many=True))
     def get(self):
-        return self.get_transactions()
+        fields = requested_fields(transaction_schema)
+        expand = requested_expansions(transaction_schema)
+        etag = collection_etag('transactions', *expanded_tables(transaction_schema, expand))
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
+        streaming = stream_format()
+        if streaming:
+            after, limit = page_args(default=None, maximum=None)
+            response = stream_response(self.query_transactions(after, fields, expand),
+                                       sparse_schema(transaction_schema), streaming, limit)
+            response.set_etag(etag)
+            return response
+
+        after, limit = page_args()
+
+        transactions = self.get_transactions(limit, after, fields, expand)
+        return transactions, 200, etag_headers(etag, page_headers(transactions))
 
     @marshal_with(ResponseSchema)
-    @validate_request_data(TransactionSchema(), partial=True)
-    def post(self):
-        request_data = request.get_json()
-
+    @load_request_data(TransactionSchema(), partial=('rent', ))
+    def post(self, request_data):
         try:
             transaction = self.add_transaction(request_data)
+        except NoResultFound:
+            abort(404, message=STATUS_404)
         except ValueError as e:
             abort(409, message=e.args[0])
         else:
             return {'url': f'{TRANSACTIONS_ENDPOINT}/{str(transaction.id)}/'}, 201
+
+
+class TransactionsBatch(MethodResource, Resource, TransactionService):
+    @marshal_with(CheckoutResultSchema(many=True))
+    @load_request_data(BatchCheckoutSchema(), partial=False)
+    def post(self, request_data):
+        results, rented = self.checkout_books(request_data['member'], request_data['items'])
+        if rented:
+            return results, 201
+        elif any(result.get('error') == STATUS_404 for result in results):
+            return results, 404
+        return results, 409
+
+    @marshal_with(ReturnResultSchema(many=True))
+    @load_request_data(BatchReturnSchema(), partial=False)
+    def put(self, request_data):
+
+        results, returned = self.return_transactions(request_data['transactions'])
+        return results, 200 if returned else 404
+
+
+class CacheStats(MethodResource, Resource):
+    @marshal_with(CacheStatsSchema)
+    def get(self):
+        return entity_cache.stats(), 200
+
+
+class PoolStats(MethodResource, Resource):
+    @marshal_with(PoolStatsSchema(many=True))
+    def get(self):
+        return db.pool_stats(), 200
+
+
+class Changes(MethodResource, Resource, ChangeService):
+    @marshal_with(ChangeFeedSchema)
+    def get(self):
+        since, limit = page_args(cursor='since', shape=LOG_KEY)
+
+        changes, position = self.get_changes(limit, since)
+        feed = {
+            'changes': changes,
+            'next': encode_cursor(position) if position else None,
+        }
+        return feed, 200, page_headers(changes, cursor='since')
@@ -0,0 +1,147 @@
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy import orm
+
+from api.constants import READ_YOUR_WRITES_WINDOW
+from api.pool import PooledSQLAlchemy
+
+# Requests whose statements may be answered by a replica.
+READ_METHODS = ('GET', 'HEAD')
+PIN_COOKIE = 'primary_until'
+
+
+def parse_replicas(value):
+    '''
+    Replica URIs with their weights, from a list of URIs or (URI, weight)
+    pairs, or from a comma separated string of `uri` or `uri|weight`.
+    '''
+    if isinstance(value, str):
+        value = [entry.strip().rsplit('|', 1) if '|' in entry else entry.strip()
+                 for entry in value.split(',') if entry.strip()]
+
+    replicas = []
+    for entry in value or ():
+        uri, weight = (entry, 1) if isinstance(entry, str) else entry
+        if int(weight) < 1:
+            raise ValueError(f'Replica weight must be positive: {uri}')
+        replicas.append((uri, int(weight)))
+    return replicas
+
+
+class WeightedRoundRobin():
+    '''
+    Smooth weighted round robin: over a cycle each name comes up `weight`
+    times, interleaved with the others rather than in runs.
+    '''
+    def __init__(self, weights):
+        self.lock = threading.Lock()
+        self.weights = dict(weights)
+        self.total = sum(self.weights.values())
+        self.current = dict.fromkeys(self.weights, 0)
+
+    def __bool__(self):
+        return bool(self.weights)
+
+    def next(self):
+        with self.lock:
+            for name, weight in self.weights.items():
+                self.current[name] += weight
+            chosen = max(self.current, key=self.current.get)
+            self.current[chosen] -= self.total
+            return chosen
+
+
+class ReplicaRouter():
+    '''
+    Sends the statements of GET requests to the replicas in
+    `SQLALCHEMY_REPLICAS`, weighted round robin, one replica per request.
+    Other requests and anything flushed or written stay on the primary.
+
+    A successful write pins the client to the primary for
+    `READ_YOUR_WRITES_WINDOW` seconds through a cookie, so a client that
+    keeps cookies reads its own writes whatever the replication lag.
+    Replicas become binds named `replica1`, `replica2`, ... the first time
+    a request is routed.
+    '''
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICAS', [])
+        app.config.setdefault('READ_YOUR_WRITES_WINDOW', READ_YOUR_WRITES_WINDOW)
+        app.extensions['replicas'] = None
+        app.before_request(self.route)
+        app.after_request(self.pin)
+
+    @property
+    def balancer(self):
+        extensions = current_app.extensions
+        if extensions.get('replicas') is None:
+            binds = dict(current_app.config.get('SQLALCHEMY_BINDS') or {})
+            weights = {}
+            replicas = parse_replicas(current_app.config['SQLALCHEMY_REPLICAS'])
+            for number, (uri, weight) in enumerate(replicas, 1):
+                binds[f'replica{number}'] = uri
+                weights[f'replica{number}'] = weight
+
+            current_app.config['SQLALCHEMY_BINDS'] = binds
+            extensions['replicas'] = WeightedRoundRobin(weights)
+        return extensions['replicas']
+
+    def pinned(self):
+        try:
+            return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def route(self):
+        g.read_bind = None
+        g.pinned = bool(self.balancer) and self.pinned()
+        if request.method in READ_METHODS and self.balancer and not g.pinned:
+            g.read_bind = self.balancer.next()
+
+    def pin(self, response):
+        window = current_app.config['READ_YOUR_WRITES_WINDOW']
+        if request.method not in READ_METHODS and response.status_code < 400 \
+                and window and self.balancer:
+            response.set_cookie(PIN_COOKIE, str(time.time() + window), max_age=window,
+                                httponly=True)
+        return response
+
+
+def read_bind():
+    '''
+    The replica bind chosen for the current request, or None.
+    '''
+    if has_request_context():
+        return g.get('read_bind')
+    return None
+
+
+def pinned_to_primary():
+    '''
+    Whether the current request comes from a client within its
+    read-your-writes window.
+    '''
+    return has_request_context() and g.get('pinned', False)
+
+
+class RoutingSession(SignallingSession):
+    '''
+    Session that runs reads on the request's replica, if it has one.
+    Flushes and INSERT, UPDATE and DELETE statements always go to the
+    bind the model maps to.
+    '''
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        bind = read_bind()
+        if bind and not self._flushing and not getattr(clause, 'is_dml', False):
+            return get_state(self.app).db.get_engine(self.app, bind=bind)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(PooledSQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+replicas = ReplicaRouter()
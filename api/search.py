@@ -0,0 +1,375 @@
+import math
+import re
+import sqlite3
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import DDL, event, inspect, select, text
+
+from api.constants import DEFAULT_RESULT_LIMIT
+from api.fieldsets import load_fields
+from api.models import Book, Change, TableVersion, db, feed_condition
+from api.pagination import Page
+
+FIELDS = ('title', 'author')
+
+
+def tokenize(value):
+    return re.findall(r'\w+', (value or '').lower())
+
+
+def fts5_available():
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute('CREATE VIRTUAL TABLE probe USING fts5(content)')
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+    return True
+
+
+class SearchBackend():
+    '''
+    Relevance ranked book search.
+
+    Scores sort ascending, best match first, and together with the book id
+    form the keyset used for paginating results.
+    '''
+    def index(self, connection, book):
+        pass
+
+    def remove(self, connection, book_id):
+        pass
+
+    def reindex(self, connection):
+        pass
+
+    def matches(self, terms, limit, after):
+        '''
+        Return up to `limit` (score, book_id) pairs following `after`.
+        '''
+        raise NotImplementedError
+
+    def search(self, title, author, limit=DEFAULT_RESULT_LIMIT, after=None, fields=None):
+        terms = {'title': tokenize(title), 'author': tokenize(author)}
+        if not any(terms.values()):
+            return Page([])
+
+        hits = self.matches(terms, limit + 1, after)
+
+        next_key = None
+        if len(hits) > limit:
+            hits = hits[:limit]
+            next_key = hits[-1]
+
+        books = load_fields(Book.query, Book, fields)\
+                    .filter(Book.id.in_([book_id for _, book_id in hits]))
+        books = {book.id: book for book in books}
+        return Page([books[book_id] for _, book_id in hits if book_id in books], next_key)
+
+
+class SQLiteSearchBackend(SearchBackend):
+    '''
+    FTS5 virtual table kept alongside `books` and ranked by bm25.
+    '''
+    def index(self, connection, book):
+        self.remove(connection, book.id)
+        connection.execute(text('INSERT INTO books_fts (rowid, title, author) '
+                                'VALUES (:id, :title, :author)'),
+                           {'id': book.id, 'title': book.title, 'author': book.author})
+
+    def remove(self, connection, book_id):
+        connection.execute(text('DELETE FROM books_fts WHERE rowid = :id'), {'id': book_id})
+
+    def reindex(self, connection):
+        connection.execute(text('DELETE FROM books_fts'))
+        connection.execute(text('INSERT INTO books_fts (rowid, title, author) '
+                                'SELECT id, title, author FROM books'))
+
+    def matches(self, terms, limit, after):
+        query = ' AND '.join(f'{field} : "{token}"*'
+                             for field in FIELDS for token in terms[field])
+
+        statement = ('SELECT rowid, score FROM ('
+                     '  SELECT rowid, bm25(books_fts) AS score FROM books_fts'
+                     '  WHERE books_fts MATCH :query) ')
+        params = {'query': query, 'limit': limit}
+        if after:
+            statement += 'WHERE score > :score OR (score = :score AND rowid > :id) '
+            params['score'], params['id'] = after
+        statement += 'ORDER BY score, rowid LIMIT :limit'
+
+        rows = db.session.execute(text(statement), params)
+        return [(score, book_id) for book_id, score in rows]
+
+
+class PostgresSearchBackend(SearchBackend):
+    '''
+    Weighted tsvector over title (A) and author (B) served by a GIN index,
+    which Postgres maintains on every write to `books`.
+    '''
+    DOCUMENT = ("setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+                "setweight(to_tsvector('simple', coalesce(author, '')), 'B')")
+
+    def matches(self, terms, limit, after):
+        weights = {'title': 'A', 'author': 'B'}
+        query = ' & '.join(f'{token}:*{weights[field]}'
+                           for field in FIELDS for token in terms[field])
+
+        statement = (f'SELECT id, score FROM ('
+                     f'  SELECT id, -ts_rank({self.DOCUMENT}, query) AS score'
+                     f'  FROM books, to_tsquery(\'simple\', :query) query'
+                     f'  WHERE {self.DOCUMENT} @@ query) ranked ')
+        params = {'query': query, 'limit': limit}
+        if after:
+            statement += 'WHERE score > :score OR (score = :score AND id > :id) '
+            params['score'], params['id'] = after
+        statement += 'ORDER BY score, id LIMIT :limit'
+
+        rows = db.session.execute(text(statement), params)
+        return [(score, book_id) for book_id, score in rows]
+
+
+class MemorySearchBackend(SearchBackend):
+    '''
+    Pure Python inverted index, used when the database has no full text
+    support. Each process builds its own from `books` on first use.
+
+    Before answering, the index checks the shared `table_versions` counter
+    of `books` and, when it moved, applies the book writes logged in
+    `changes` since, so every worker sees what the others committed.
+    Hits are ranked by BM25 per field with title weighted above author.
+    '''
+    WEIGHTS = {'title': 2.0, 'author': 1.0}
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.clear()
+
+    def clear(self):
+        self.documents = {}
+        self.postings = {field: {} for field in FIELDS}
+        self.vocabulary = {field: [] for field in FIELDS}
+        self.lengths = dict.fromkeys(FIELDS, 0)
+        self.position = None
+
+    def add(self, book):
+        self.discard(book.id)
+
+        document = {field: Counter(tokenize(getattr(book, field))) for field in FIELDS}
+        for field, counts in document.items():
+            for token, count in counts.items():
+                if token not in self.postings[field]:
+                    self.postings[field][token] = {}
+                    insort(self.vocabulary[field], token)
+                self.postings[field][token][book.id] = count
+            self.lengths[field] += sum(counts.values())
+        self.documents[book.id] = document
+
+    def discard(self, book_id):
+        document = self.documents.pop(book_id, None)
+        if document is None:
+            return
+
+        for field, counts in document.items():
+            self.lengths[field] -= sum(counts.values())
+            for token in counts:
+                postings = self.postings[field][token]
+                del postings[book_id]
+                if not postings:
+                    del self.postings[field][token]
+                    vocabulary = self.vocabulary[field]
+                    del vocabulary[bisect_left(vocabulary, token)]
+
+    def read_version(self, connection):
+        versions = TableVersion.__table__
+        version = connection.execute(select([versions.c.version])
+                                     .where(versions.c.name == 'books')).scalar()
+        return version or 0
+
+    def read_books(self, connection, condition=None):
+        books = Book.__table__
+        statement = select([books.c.id, books.c.title, books.c.author])
+        if condition is not None:
+            statement = statement.where(condition)
+        return connection.execute(statement).fetchall()
+
+    def reindex(self, connection):
+        with self.lock:
+            self.clear()
+            # Read the version and log position first: writes committed
+            # while the books are read are then applied again, not lost.
+            self.version = self.read_version(connection)
+            changes = Change.__table__
+            last = connection.execute(select([changes.c.txid, changes.c.id])
+                                      .where(feed_condition(connection))
+                                      .order_by(changes.c.txid.desc(), changes.c.id.desc())
+                                      .limit(1)).first()
+            self.position = tuple(last) if last else None
+            for row in self.read_books(connection):
+                self.add(row)
+
+    def refresh(self, connection):
+        '''
+        Catch up with the book writes committed since the index last looked.
+        '''
+        if self.version is None:
+            self.reindex(connection)
+            return
+
+        version = self.read_version(connection)
+        if version == self.version:
+            return
+
+        changes = Change.__table__
+        logged = connection.execute(select([changes.c.txid, changes.c.id, changes.c.row_id])
+                                    .where(feed_condition(connection, self.position))
+                                    .where(changes.c.table_name == 'books')
+                                    .order_by(changes.c.txid, changes.c.id)).fetchall()
+        if logged:
+            written = {row_id for _, _, row_id in logged}
+            rows = {row.id: row
+                    for row in self.read_books(connection, Book.__table__.c.id.in_(written))}
+            for book_id in written:
+                if book_id in rows:
+                    self.add(rows[book_id])
+                else:
+                    self.discard(book_id)
+            self.position = tuple(logged[-1][:2])
+
+        # Writes past the Postgres horizon are only read once it moves on.
+        if connection.dialect.name != 'postgresql':
+            self.version = version
+
+    def prefixed(self, field, prefix):
+        '''
+        Occurrences per book of the `field` tokens starting with `prefix`.
+        '''
+        vocabulary = self.vocabulary[field]
+        position = bisect_left(vocabulary, prefix)
+
+        matched = Counter()
+        while position < len(vocabulary) and vocabulary[position].startswith(prefix):
+            matched.update(self.postings[field][vocabulary[position]])
+            position += 1
+        return matched
+
+    def matches(self, terms, limit, after):
+        with self.lock:
+            self.refresh(db.session.connection())
+
+            total = len(self.documents)
+            scores = None
+            for field in FIELDS:
+                for token in terms[field]:
+                    matched = self.prefixed(field, token)
+                    idf = math.log(1 + total / len(matched)) if matched else 0
+                    average = self.lengths[field] / total if total else 1
+
+                    term_scores = {}
+                    for book_id, frequency in matched.items():
+                        length = sum(self.documents[book_id][field].values())
+                        norm = self.K1 * (1 - self.B + self.B * length / average)
+                        saturation = frequency * (self.K1 + 1) / (frequency + norm)
+                        term_scores[book_id] = self.WEIGHTS[field] * idf * saturation
+
+                    if scores is None:
+                        scores = term_scores
+                    else:
+                        scores = {book_id: score + term_scores[book_id]
+                                  for book_id, score in scores.items() if book_id in term_scores}
+
+        hits = sorted((-score, book_id) for book_id, score in scores.items())
+        if after:
+            hits = [hit for hit in hits if hit > tuple(after)]
+        return hits[:limit]
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+    'memory': MemorySearchBackend,
+}
+
+
+class SearchIndex():
+    '''
+    Chooses the search backend per application from `SEARCH_BACKEND`.
+
+    `auto` uses the database's own full text search when it has one and the
+    in-process index otherwise.
+    '''
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', 'auto')
+        app.extensions['search'] = None
+
+    @property
+    def backend(self):
+        extensions = current_app.extensions
+        if extensions.get('search') is None:
+            name = current_app.config.get('SEARCH_BACKEND', 'auto')
+
+            if name == 'auto':
+                engine = db.get_engine(current_app)
+                name = engine.dialect.name
+                if name == 'sqlite' and not inspect(engine).has_table('books_fts'):
+                    name = 'memory'
+                elif name not in BACKENDS:
+                    name = 'memory'
+
+            extensions['search'] = BACKENDS[name]()
+        return extensions['search']
+
+    def search(self, title, author, limit=DEFAULT_RESULT_LIMIT, after=None, fields=None):
+        return self.backend.search(title, author, limit, after, fields)
+
+    def index_isbns(self, connection, isbns):
+        '''
+        Index books written in bulk, bypassing the ORM write hooks.
+        '''
+        self.index_where(connection, Book.__table__.c.isbn.in_(isbns))
+
+    def index_ids(self, connection, ids):
+        self.index_where(connection, Book.__table__.c.id.in_(ids))
+
+    def index_where(self, connection, condition):
+        books = Book.__table__
+        rows = connection.execute(select([books.c.id, books.c.title, books.c.author])
+                                  .where(condition)).fetchall()
+        for row in rows:
+            self.backend.index(connection, row)
+
+    def reindex(self):
+        self.backend.reindex(db.session.connection())
+        db.session.commit()
+
+
+search_index = SearchIndex()
+
+
+event.listen(Book.__table__, 'after_create',
+             DDL('CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(title, author)')
+             .execute_if(dialect='sqlite', callable_=lambda *args, **kwargs: fts5_available()))
+event.listen(Book.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS books_fts').execute_if(dialect='sqlite'))
+event.listen(Book.__table__, 'after_create',
+             DDL(f'CREATE INDEX IF NOT EXISTS books_search_idx ON books '
+                 f'USING gin (({PostgresSearchBackend.DOCUMENT}))')
+             .execute_if(dialect='postgresql'))
+
+
+@event.listens_for(Book, 'after_insert')
+@event.listens_for(Book, 'after_update')
+def index_book(mapper, connection, book):
+    search_index.backend.index(connection, book)
+
+
+@event.listens_for(Book, 'after_delete')
+def remove_book(mapper, connection, book):
+    search_index.backend.remove(connection, book.id)
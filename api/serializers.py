@@ -1,6 +1,9 @@
 from flask_marshmallow import Marshmallow
-from marshmallow import Schema, post_load
+from marshmallow import Schema, fields, post_load, validate
 
+from api.constants import MAX_BATCH_SIZE
+from api.dumpers import CompiledDumpMixin
+from api.fieldsets import SparseFieldsMixin
 from api.models import Book, Transaction, User
 
 ma = Marshmallow()
@@ -11,51 +14,183 @@ class ResponseSchema(Schema):
         fields = ('url', )
 
 
-class BookSchema(ma.SQLAlchemyAutoSchema):
+class ImportReportSchema(Schema):
+    '''
+    Outcome of a bulk import: rows saved and per row errors.
+    '''
+    imported = fields.Integer()
+    errors = fields.List(fields.Dict())
+
+
+class UpsertResultSchema(Schema):
+    '''
+    Outcome of one row of a bulk PUT.
+    '''
+    url = fields.String()
+    created = fields.Boolean()
+
+
+class CacheStatsSchema(Schema):
+    '''
+    Entity cache counters of the answering worker.
+    '''
+    hits = fields.Integer()
+    misses = fields.Integer()
+    evictions = fields.Integer()
+
+
+class PoolWaitBucketSchema(Schema):
+    '''
+    Checkouts that took at most `le` seconds; `le` is null for +Inf.
+    '''
+    le = fields.Float(allow_none=True)
+    count = fields.Integer()
+
+
+class PoolStatsSchema(Schema):
+    '''
+    Connection pool of one bind in the answering worker.
+    '''
+    bind = fields.String()
+    dialect = fields.String()
+    pool = fields.String()
+    size = fields.Integer(allow_none=True)
+    overflow = fields.Integer(allow_none=True)
+    checked_out = fields.Integer()
+    checkouts = fields.Integer()
+    overflow_events = fields.Integer()
+    timeouts = fields.Integer()
+    wait_buckets = fields.List(fields.Nested(PoolWaitBucketSchema))
+    wait_sum = fields.Float()
+
+
+class ChangeSchema(Schema):
+    '''
+    One row written since the requested position of the change feed.
+    '''
+    table = fields.String()
+    id = fields.Integer()
+    operation = fields.String()
+    data = fields.Dict(allow_none=True)
+
+
+class ChangeFeedSchema(Schema):
+    changes = fields.List(fields.Nested(ChangeSchema))
+    next = fields.String(allow_none=True)
+
+
+class CheckoutItemSchema(Schema):
+    book = fields.Integer(required=True)
+    num_copies = fields.Integer(required=True, validate=validate.Range(min=1))
+
+
+class BatchCheckoutSchema(Schema):
+    '''
+    Books rented together by one member.
+    '''
+    member = fields.Integer(required=True)
+    items = fields.List(fields.Nested(CheckoutItemSchema), required=True,
+                        validate=validate.Length(min=1, max=MAX_BATCH_SIZE))
+
+
+class BatchReturnSchema(Schema):
+    '''
+    Rentals returned together.
+    '''
+    transactions = fields.List(fields.Integer(), required=True,
+                               validate=validate.Length(min=1, max=MAX_BATCH_SIZE))
+
+
+class CheckoutResultSchema(Schema):
+    '''
+    Outcome of one item of a batch checkout.
+    '''
+    book = fields.Integer()
+    num_copies = fields.Integer()
+    url = fields.String()
+    error = fields.String()
+
+
+class ReturnResultSchema(Schema):
+    '''
+    Outcome of one rental of a batch return.
+    '''
+    transaction = fields.Integer()
+    returned = fields.Boolean()
+    error = fields.String()
+
+
+class BookSchema(SparseFieldsMixin, CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     '''
     Serializes book from and to DB.
     '''
     class Meta:
         model = Book
         include_fk = True
+        exclude = ('rent_count', 'version')
 
     url = ma.URLFor('book', values=dict(book_id='<id>'))
 
     @post_load
-    def make_book(self, data, **kwargs):
+    def make_book(self, data, partial=False, **kwargs):
+        if partial:
+            return data
         return Book(**data)
 
 
-class UserSchema(ma.SQLAlchemyAutoSchema):
+class UserSchema(SparseFieldsMixin, CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     '''
     Serializes book from and to DB.
     '''
     class Meta:
         model = User
         include_fk = True
+        exclude = ('total_rent', 'outstanding_due', 'version')
 
     url = ma.URLFor('user', values=dict(user_id='<id>'))
 
     @post_load
-    def make_user(self, data, **kwargs):
+    def make_user(self, data, partial=False, **kwargs):
+        if partial:
+            return data
         return User(**data)
 
 
-class TransactionSchema(ma.SQLAlchemyAutoSchema):
+class TransactionSchema(SparseFieldsMixin, CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     '''
     Serializes rent from and to DB.
     '''
     class Meta:
         model = Transaction
         include_fk = True
+        exclude = ('version', )
 
+    num_copies = fields.Integer(required=True, validate=validate.Range(min=1))
     url = ma.URLFor('transaction', values=dict(transaction_id='<id>'))
 
+    # Foreign keys `?expand=` replaces with the related row, by relationship.
+    expandable = {
+        'member': ('rented_by', UserSchema()),
+        'book': ('rented_book', BookSchema()),
+    }
+
     @post_load
-    def make_transaction(self, data, **kwargs):
+    def make_transaction(self, data, partial=False, **kwargs):
+        if partial:
+            return data
         return Transaction(**data)
 
 
+def missing_fields(schema, data):
+    '''
+    The errors a full load would report for the fields `schema` requires
+    that partially loaded `data` lacks.
+    '''
+    return {name: [field.error_messages['required']]
+            for name, field in schema.load_fields.items()
+            if field.required and name not in data}
+
+
 book_schema = BookSchema()
 user_schema = UserSchema()
 transaction_schema = TransactionSchema()
@@ -1,68 +1,285 @@
+import random
+import time
+from collections import Counter
 from datetime import datetime
 
-from sqlalchemy import desc
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm.exc import NoResultFound
+from marshmallow import ValidationError
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.exc import NoResultFound, StaleDataError
 from sqlalchemy.sql.functions import func
 
-from api.constants import DEFAULT_RESULT_LIMIT, MAX_ALLOWED_DUE
-from api.messages import OUT_OF_STOCK, OVERDUE, STOCK_SHORTAGE
-from api.models import Book, Transaction, User, db
-from api.serializers import book_schema, transaction_schema, user_schema
+from api.bulk import batched, invalid_json_error, upsert, upsert_rows
+from api.cache import entity_cache
+from api.constants import (CHECKOUT_BACKOFF, CHECKOUT_RETRIES, DEFAULT_RESULT_LIMIT,
+                           IMPORT_BATCH_SIZE, MAX_ALLOWED_DUE, TRANSACTIONS_ENDPOINT)
+from api.etags import ANY_VERSION
+from api.fieldsets import load_fields
+from api.messages import (CHECKOUT_CONFLICT, DUPLICATE_IDS, OUT_OF_STOCK, OVERDUE, STATUS_404,
+                          STOCK_SHORTAGE)
+from api.models import (Book, Change, Transaction, User, db, feed_condition, mark_written,
+                        record_writes)
+from api.pagination import Page, paginate
+from api.ranking import highest_paying_users, popular_books
+from api.search import search_index
+from api.serializers import book_schema, missing_fields, transaction_schema, user_schema
+
+
+def rows_by(model, key, values, fields=None):
+    '''
+    Rows of `model` whose `key` column matches `values`, fetched with one IN
+    query and returned in the order of `values`, with None where no row
+    matches.
+    '''
+    column = getattr(model, key)
+    rows = load_fields(model.query, model, fields, key).filter(column.in_(set(values)))
+    found = {getattr(row, key): row for row in rows}
+    return [found.get(value) for value in values]
+
+
+def upsert_entities(model, schema, rows):
+    '''
+    Upsert `rows` of `model` keyed by id and return whether each was
+    created.
+
+    Raises ValidationError, writing nothing, when a row has no id, ids
+    repeat or a row for a missing id lacks fields `schema` requires to
+    create it.
+    '''
+    table = model.__table__
+    unkeyed = {index: {'id': [schema.fields['id'].error_messages['required']]}
+               for index, row in enumerate(rows) if row.get('id') is None}
+    if unkeyed:
+        raise ValidationError(unkeyed)
+
+    ids = [row['id'] for row in rows]
+    duplicates = sorted({row_id for row_id in ids if ids.count(row_id) > 1})
+    if duplicates:
+        raise ValidationError({'id': [DUPLICATE_IDS % ', '.join(map(str, duplicates))]})
+
+    required = [name for name, field in schema.load_fields.items() if field.required]
+    connection = db.session.connection()
+    try:
+        created = upsert_rows(connection, table, rows, 'id', required)
+        errors = {index: missing_fields(schema, row)
+                  for index, (row, flag) in enumerate(zip(rows, created)) if flag is None}
+        if errors:
+            raise ValidationError(errors if len(rows) > 1 else errors[0])
+
+        if any(created) and connection.dialect.name == 'postgresql':
+            # Explicit ids leave the serial behind; move it past them.
+            connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                                    f"(SELECT max(id) FROM {table.name}))"))
+        record_writes(db.session, table.name, [(row_id, 'insert' if flag else 'update')
+                                               for row_id, flag in zip(ids, created)])
+        if model is Book:
+            search_index.index_ids(connection, ids)
+        db.session.commit()
+    except (ValidationError, SQLAlchemyError):
+        db.session.rollback()
+        raise
+
+    return created
+
+
+def matches(row, versions):
+    '''
+    Whether `row` satisfies the If-Match `versions` (see `if_match`).
+    '''
+    if versions is None:
+        return True
+    if row is None:
+        return False
+    return versions == ANY_VERSION or row.version in versions
+
+
+def update_entity(model, schema, row_id, data, versions=None):
+    '''
+    Create or update row `row_id` of `model` with the fields in `data`,
+    returning True when it was created.
+
+    With If-Match `versions` only an existing row at one of them is
+    updated, in a single statement that moves its version on; otherwise
+    StaleDataError is raised and nothing written.
+    '''
+    if versions is None:
+        return upsert_entities(model, schema, [dict(data, id=row_id)])[0]
+
+    table = model.__table__
+    data = {name: value for name, value in data.items() if name != 'id'}
+    condition = table.c.id == row_id
+    if versions != ANY_VERSION:
+        condition &= table.c.version.in_(versions)
+
+    connection = db.session.connection()
+    try:
+        if not connection.execute(table.update().where(condition)
+                                  .values(dict(data, version=table.c.version + 1))).rowcount:
+            raise StaleDataError(f'{table.name} {row_id} does not match If-Match')
+
+        record_writes(db.session, table.name, [(row_id, 'update')])
+        if model is Book:
+            search_index.index_ids(connection, [row_id])
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+
+    return False
+
+
+def delete_entity(model, row_id, versions=None):
+    '''
+    Delete row `row_id` of `model`, returning its id, or None when there
+    is no such row.
+
+    The ORM checks the version the row was read at when deleting it;
+    StaleDataError is raised when that or the If-Match `versions` do not
+    match.
+    '''
+    row = model.query.get(row_id)
+    if not matches(row, versions):
+        raise StaleDataError(f'{model.__tablename__} {row_id} does not match If-Match')
+    if row is None:
+        return None
+
+    try:
+        db.session.delete(row)
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        raise
+
+    return row_id
 
 
 class BookService():
     '''
     Bridge between book resource and model.
     '''
-    def get_popular_books(self, limit=DEFAULT_RESULT_LIMIT):
-        # Ref: https://stackoverflow.com/q/27900018
-        books = Book.query.join(Transaction, Book.id == Transaction.book, isouter=True)\
-               .group_by(Book)\
-               .order_by(desc(func.count(Transaction.book)))\
-               .limit(limit).all()
-        return books
+    def get_popular_books(self, limit=DEFAULT_RESULT_LIMIT, after=None, fields=None):
+        return popular_books.page(limit, after, fields)
 
-    def search_book(self, title, author):
-        if title and author:
-            books = Book.query.filter(Book.title.like(f'%{title}%'),
-                                      Book.author.like(f'%{author}%')
-                                      ).all()
-        elif title:
-            books = Book.query.filter(Book.title.like(f'%{title}%')).all()
-        elif author:
-            books = Book.query.filter(Book.author.like(f'%{author}%')).all()
-        return books
+    def search_book(self, title, author, limit=DEFAULT_RESULT_LIMIT, after=None, fields=None):
+        return search_index.search(title, author, limit, after, fields)
 
-    def get_books(self, request_type, **kwargs):
+    def get_books(self, request_type, limit=DEFAULT_RESULT_LIMIT, after=None, fields=None,
+                  **kwargs):
         if request_type == 'popular':
-            limit = kwargs.get('limit')
-            books = self.get_popular_books(limit)
+            books = self.get_popular_books(limit, after, fields)
 
         elif request_type == 'search':
             title = kwargs.get('title')
             author = kwargs.get('author')
-            books = self.search_book(title, author)
+            books = self.search_book(title, author, limit, after, fields)
 
         else:
-            books = Book.query.all()
+            books = paginate(self.query_books(request_type, after, fields), limit,
+                             key=lambda book: (book.id, ))
 
         return books
 
-    def get_book(self, book_id):
-        book = Book.query.get(book_id)
+    def query_books(self, request_type, after=None, fields=None):
+        '''
+        All books following `after` in listing order, as an unexecuted query.
+
+        With `fields` only the columns those fields need are selected.
+        '''
+        if request_type == 'popular':
+            return popular_books.query(after, fields)
+
+        books = load_fields(Book.query, Book, fields)
+        if after:
+            books = books.filter(Book.id > after[0])
+        return books.order_by(Book.id)
+
+    def import_books(self, rows, batch_size=IMPORT_BATCH_SIZE):
+        '''
+        Validate and upsert parsed (row number, row) pairs in batches.
+
+        Each row is the complete book, keyed by isbn: omitted optional
+        columns take their defaults. Invalid rows and batches that fail to
+        save are reported and skipped without aborting the load.
+        '''
+        books = Book.__table__
+        columns = ('title', 'author', 'price', 'stock')
+        report = {'imported': 0, 'errors': []}
+
+        for batch in batched(rows, batch_size):
+            parsed = [row for _, row in batch if row is not None]
+            errors = book_schema.validate(parsed, many=True)
+
+            valid = []
+            index = 0
+            for number, row in batch:
+                if row is None:
+                    report['errors'].append(invalid_json_error(number))
+                    continue
+
+                if index in errors:
+                    report['errors'].append({'row': number, 'errors': errors[index]})
+                else:
+                    valid.append((number, row))
+                index += 1
+
+            if not valid:
+                continue
+
+            new_books = book_schema.load([row for _, row in valid], many=True)
+            values = {}
+            for book in new_books:
+                values[book.isbn] = {
+                    'isbn': book.isbn,
+                    'title': book.title,
+                    'author': book.author,
+                    'price': book.price or books.c.price.default.arg,
+                    'stock': book.stock or books.c.stock.default.arg,
+                }
+
+            try:
+                connection = db.session.connection()
+                saved = select([books.c.id, books.c.isbn]).where(books.c.isbn.in_(list(values)))
+                existing = {isbn for _, isbn in connection.execute(saved)}
+
+                upsert(connection, books, list(values.values()), 'isbn', columns)
+                search_index.index_isbns(connection, list(values))
+
+                changes = [(book_id, 'update' if isbn in existing else 'insert')
+                           for book_id, isbn in connection.execute(saved)]
+                record_writes(db.session, 'books', changes)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                report['errors'].extend({'row': number, 'errors': {'_schema': [str(getattr(e, 'orig', e))]}}
+                                        for number, _ in valid)
+            else:
+                report['imported'] += len(valid)
+
+        return report
+
+    def get_book(self, book_id, fields=None):
+        book = load_fields(Book.query, Book, fields).get(book_id)
         return book
 
-    def add_book(self, book_json):
-        new_book = book_schema.load(book_json)
+    def get_books_by(self, key, values, fields=None):
+        return rows_by(Book, key, values, fields)
+
+    def get_book_data(self, book_id):
+        '''
+        The book's version and serialized payload, read through the entity
+        cache.
+        '''
+        return entity_cache.fetch(Book, book_id, book_schema)
 
+    def add_book(self, new_book):
         try:
             db.session.add(new_book)
             db.session.commit()
         except IntegrityError as e:
             db.session.rollback()
 
-            existing_book = Book.query.filter_by(isbn=book_json['isbn']).one()
+            existing_book = Book.query.filter_by(isbn=new_book.isbn).one()
             book_serialized = book_schema.dump(existing_book)
 
             e.message = book_serialized['url']
@@ -70,63 +287,81 @@ class BookService():
         else:
             return new_book
 
-    def update_book(self, book_id, data):
-        existing_book = Book.query.get(book_id)
-
-        if not existing_book:
-            new_book = book_schema.load(data)
-            db.session.add(new_book)
-            db.session.commit()
+    def update_book(self, book_id, data, versions=None):
+        '''
+        Create or update book `book_id` with the fields in `data`. Returns
+        True when it was created.
+        '''
+        return update_entity(Book, book_schema, book_id, data, versions)
 
-            return new_book
+    def update_books(self, rows):
+        '''
+        Upsert books by id, each updating only the fields it holds.
+        '''
+        return upsert_entities(Book, book_schema, rows)
 
-        else:
-            if 'title' in data:
-                existing_book.title = data.pop('title')
-            if 'isbn' in data:
-                existing_book.isbn = data.pop('isbn')
-            if 'author' in data:
-                existing_book.author = data.pop('author')
-            if 'price' in data:
-                existing_book.price = data.pop('price')
-            if 'stock' in data:
-                existing_book.stock = data.pop('stock')
-            db.session.add(existing_book)
-            db.session.commit()
-            return
-
-    def delete_book(self, book_id):
-        book = Book.query.get(book_id)
-
-        if book:
-            db.session.delete(book)
-            db.session.commit()
-            return book.id
-        return
+    def delete_book(self, book_id, versions=None):
+        return delete_entity(Book, book_id, versions)
 
 
 class UserService():
     '''
     Bridge between user resource and model.
     '''
-    def get_users(self, highest_paying, limit):
+    def get_users(self, highest_paying, limit=DEFAULT_RESULT_LIMIT, after=None, fields=None):
         if highest_paying:
-            # Ref: https://stackoverflow.com/q/27900018
-            users = User.query.join(Transaction, User.id == Transaction.member, isouter=True)\
-                   .group_by(User)\
-                   .order_by(desc(func.sum(Transaction.rent)))\
-                   .limit(limit).all()
-        else:
-            users = User.query.all()
-        return users
+            return highest_paying_users.page(limit, after, fields)
+
+        return paginate(self.query_users(highest_paying, after, fields), limit,
+                        key=lambda user: (user.id, ))
+
+    def query_users(self, highest_paying, after=None, fields=None):
+        if highest_paying:
+            return highest_paying_users.query(after, fields)
+
+        users = load_fields(User.query, User, fields)
+        if after:
+            users = users.filter(User.id > after[0])
+        return users.order_by(User.id)
+
+    def reconcile_dues(self, fix=False):
+        '''
+        Compare each member's outstanding dues with their open rentals.
+
+        Returns (member id, recorded, actual) for every mismatch, correcting
+        the recorded balance when `fix` is set.
+        '''
+        open_rent = db.session.query(Transaction.member,
+                                     func.sum(Transaction.rent).label('rent'))\
+                              .filter(Transaction.date_return.is_(None))\
+                              .group_by(Transaction.member)\
+                              .subquery()
+        actual = func.coalesce(open_rent.c.rent, 0)
+
+        mismatches = db.session.query(User.id, User.outstanding_due, actual)\
+                               .outerjoin(open_rent, open_rent.c.member == User.id)\
+                               .filter(User.outstanding_due != actual)\
+                               .order_by(User.id).all()
+
+        if fix and mismatches:
+            for member_id, _, due in mismatches:
+                User.query.filter_by(id=member_id).update({'outstanding_due': due})
+            mark_written(db.session, 'users')
+            db.session.commit()
+
+        return mismatches
 
-    def get_user(self, user_id):
-        user = User.query.get(user_id)
+    def get_user(self, user_id, fields=None):
+        user = load_fields(User.query, User, fields).get(user_id)
         return user
 
-    def add_user(self, user_json):
-        new_user = user_schema.load(user_json)
+    def get_users_by(self, key, values, fields=None):
+        return rows_by(User, key, values, fields)
 
+    def get_user_data(self, user_id):
+        return entity_cache.fetch(User, user_id, user_schema)
+
+    def add_user(self, new_user):
         try:
             db.session.add(new_user)
             db.session.commit()
@@ -134,7 +369,7 @@ class UserService():
         except IntegrityError as e:
             db.session.rollback()
 
-            existing_user = User.query.filter_by(email=user_json['email']).one()
+            existing_user = User.query.filter_by(email=new_user.email).one()
             user_serialized = user_schema.dump(existing_user)
 
             e.message = user_serialized['url']
@@ -142,93 +377,332 @@ class UserService():
         else:
             return new_user
 
-    def update_user(self, user_id, data):
-        existing_user = User.query.get(user_id)
-
-        if not existing_user:
-            new_user = user_schema.load(data)
-            db.session.add(new_user)
-            db.session.commit()
-            return new_user
-
-        else:
-            if 'email' in data:
-                existing_user.email = data.pop('email')
-            if 'first_name' in data:
-                existing_user.first_name = data.pop('first_name')
-            if 'last_name' in data:
-                existing_user.last_name = data.pop('last_name')
-            if 'contact' in data:
-                existing_user.contact = data.pop('contact')
-            db.session.add(existing_user)
-            db.session.commit()
-            return
+    def update_user(self, user_id, data, versions=None):
+        '''
+        Create or update member `user_id` with the fields in `data`. Returns
+        True when they were created.
+        '''
+        return update_entity(User, user_schema, user_id, data, versions)
 
-    def delete_user(self, user_id):
-        user = User.query.get(user_id)
+    def update_users(self, rows):
+        '''
+        Upsert members by id, each updating only the fields it holds.
+        '''
+        return upsert_entities(User, user_schema, rows)
 
-        if user:
-            db.session.delete(user)
-            db.session.commit()
-            return user.id
-        return
+    def delete_user(self, user_id, versions=None):
+        return delete_entity(User, user_id, versions)
 
 
 class TransactionService():
     '''
     Bridge between transaction resource and model.
     '''
-    def get_transactions(self):
-        transactions = Transaction.query.all()
+    def get_transactions(self, limit=DEFAULT_RESULT_LIMIT, after=None, fields=None, expand=()):
+        return paginate(self.query_transactions(after, fields, expand), limit,
+                        key=lambda transaction: (transaction.id, ))
+
+    def query_transactions(self, after=None, fields=None, expand=()):
+        transactions = self.load_transactions(fields, expand)
+        if after:
+            transactions = transactions.filter(Transaction.id > after[0])
+        return transactions.order_by(Transaction.id)
+
+    def load_transactions(self, fields=None, expand=()):
+        '''
+        Transaction query selecting `fields`, with the rows behind the
+        `expand` foreign keys loaded by one extra query per relation.
+        '''
+        transactions = load_fields(Transaction.query, Transaction, fields, *expand)
+        for name in expand:
+            attribute, _ = transaction_schema.expandable[name]
+            transactions = transactions.options(selectinload(getattr(Transaction, attribute)))
         return transactions
 
-    def get_transaction(self, transaction_id):
-        transaction = Transaction.query.get(transaction_id)
+    def get_transaction(self, transaction_id, fields=None, expand=()):
+        transaction = self.load_transactions(fields, expand).get(transaction_id)
 
         return transaction
 
+    def get_transaction_data(self, transaction_id):
+        return entity_cache.fetch(Transaction, transaction_id, transaction_schema)
+
     def add_transaction(self, transaction_json):
-        book_id = transaction_json.get('book')
-        member_id = transaction_json.get('book')
-        num_copies = int(transaction_json.get('num_copies'))
-
-        member_occupied_books = Transaction.query.filter_by(
-                                                            member=member_id,
-                                                            date_return=None
-                                                            )
-        total_due = sum([int(book.rent) for book in member_occupied_books])
-        if total_due > MAX_ALLOWED_DUE:
-            raise ValueError(OVERDUE)
+        book_id = transaction_json['book']
+        member_id = transaction_json['member']
+        num_copies = transaction_json['num_copies']
 
-        book = Book.query.get(book_id)
-        if not book.stock:
-            raise ValueError(OUT_OF_STOCK)
-        elif book.stock < num_copies:
-            raise ValueError(STOCK_SHORTAGE % book.stock)
-        else:
-            book.stock -= int(num_copies)
+        book = db.session.query(Book.price).filter_by(id=book_id).one_or_none()
+        if not book:
+            raise NoResultFound
 
         rent = num_copies * book.price
+        try:
+            self.charge_member(member_id, rent)
+            self.take_stock(book_id, num_copies)
+        except (NoResultFound, ValueError):
+            db.session.rollback()
+            raise
+
         transaction_json['rent'] = rent
-        new_transaction = transaction_schema.load(transaction_json)
+        new_transaction = Transaction(**transaction_json)
         db.session.add(new_transaction)
-        db.session.add(book)
+        db.session.flush()
+        record_writes(db.session, 'books', [(book_id, 'update')])
         db.session.commit()
 
         return new_transaction
 
-    def update_transaction(self, transaction_id):
+    def update_transaction(self, transaction_id, versions=None):
         transaction = Transaction.query.get(transaction_id)
 
         if not transaction:
             raise NoResultFound
+        if not matches(transaction, versions):
+            raise StaleDataError(f'transactions {transaction_id} does not match If-Match')
+
+        # Under If-Match the rental must still be at the version just read.
+        version = transaction.version if versions not in (None, ANY_VERSION) else None
+        if self.mark_returned(transaction_id, version):
+            # Member before book, the order checkouts lock them in.
+            self.credit_member(transaction.member, transaction.rent)
+            self.restock(transaction.book, transaction.num_copies)
+
+            mark_written(db.session, 'users')
+            record_writes(db.session, 'books', [(transaction.book, 'update')])
+            record_writes(db.session, 'transactions', [(transaction_id, 'update')])
+        elif version is not None and transaction.date_return is None:
+            db.session.rollback()
+            raise StaleDataError(f'transactions {transaction_id} does not match If-Match')
 
-        book = Book.query.get(transaction.book)
-        num_copies = transaction.num_copies
-
-        book.stock += num_copies
-        transaction.date_return = datetime.now()
-        db.session.add(transaction)
-        db.session.add(book)
         db.session.commit()
         return
+
+    def mark_returned(self, transaction_id, version=None):
+        '''
+        Set the return date of an open rental, telling whether this call did.
+
+        Only the request that actually marks the rental returned puts the
+        copies back, so concurrent returns cannot restock twice. Given a
+        `version`, the rental must also still be at it.
+        '''
+        transactions = Transaction.__table__
+        mark = transactions.update()\
+                           .where(transactions.c.id == transaction_id)\
+                           .where(transactions.c.date_return.is_(None))\
+                           .values(date_return=datetime.now(), version=transactions.c.version + 1)
+        if version is not None:
+            mark = mark.where(transactions.c.version == version)
+
+        return bool(db.session.execute(mark).rowcount)
+
+    def checkout_books(self, member_id, items):
+        '''
+        Rent several books to one member in a single database transaction.
+
+        The member's dues are checked once against the rent of the whole
+        batch, and stock is taken book by book in id order so concurrent
+        batches lock rows in the same order. Either every item is rented or
+        none is. Returns a result per item and whether the batch went through;
+        an unknown or overdue member fails every item with that error.
+        '''
+        results = [{'book': item['book'], 'num_copies': item['num_copies']} for item in items]
+        copies = Counter()
+        for item in items:
+            copies[item['book']] += item['num_copies']
+
+        prices = dict(db.session.query(Book.id, Book.price).filter(Book.id.in_(list(copies))))
+        errors = {book_id: STATUS_404 for book_id in copies if book_id not in prices}
+
+        if not errors:
+            rent = sum(prices[book_id] * num_copies for book_id, num_copies in copies.items())
+            try:
+                self.charge_member(member_id, rent)
+            except NoResultFound:
+                errors = dict.fromkeys(copies, STATUS_404)
+            except ValueError as e:
+                errors = dict.fromkeys(copies, e.args[0])
+
+        if not errors:
+            for book_id in sorted(copies):
+                try:
+                    self.take_stock(book_id, copies[book_id])
+                except NoResultFound:
+                    errors[book_id] = STATUS_404
+                except ValueError as e:
+                    errors[book_id] = e.args[0]
+
+        if errors:
+            db.session.rollback()
+            for result in results:
+                if result['book'] in errors:
+                    result['error'] = errors[result['book']]
+            return results, False
+
+        transactions = [Transaction(member=member_id, book=item['book'],
+                                    num_copies=item['num_copies'],
+                                    rent=item['num_copies'] * prices[item['book']])
+                        for item in items]
+        db.session.add_all(transactions)
+        db.session.flush()
+        record_writes(db.session, 'books', [(book_id, 'update') for book_id in sorted(copies)])
+        db.session.commit()
+
+        for result, transaction in zip(results, transactions):
+            result['url'] = f'{TRANSACTIONS_ENDPOINT}/{transaction.id}/'
+        return results, True
+
+    def return_transactions(self, transaction_ids):
+        '''
+        Return several rentals in a single database transaction.
+
+        Rentals are marked returned in id order, then the dues go back one
+        update per member and the copies one update per book, members before
+        books as checkouts lock them. Rentals already
+        returned are left as they are; unknown ids fail the whole batch.
+        Returns a result per rental and whether the batch went through.
+        '''
+        ids = sorted(set(transaction_ids))
+        rentals = {transaction.id: transaction
+                   for transaction in Transaction.query.filter(Transaction.id.in_(ids))}
+
+        if len(rentals) < len(ids):
+            return [{'transaction': transaction_id} if transaction_id in rentals
+                    else {'transaction': transaction_id, 'error': STATUS_404}
+                    for transaction_id in transaction_ids], False
+
+        returned = [rentals[transaction_id] for transaction_id in ids
+                    if self.mark_returned(transaction_id)]
+
+        copies = Counter()
+        dues = Counter()
+        for transaction in returned:
+            copies[transaction.book] += transaction.num_copies
+            dues[transaction.member] += transaction.rent
+
+        for member_id in sorted(dues):
+            self.credit_member(member_id, dues[member_id])
+        for book_id in sorted(copies):
+            self.restock(book_id, copies[book_id])
+
+        if returned:
+            mark_written(db.session, 'users')
+            record_writes(db.session, 'books', [(book_id, 'update') for book_id in sorted(copies)])
+            record_writes(db.session, 'transactions',
+                          [(transaction.id, 'update') for transaction in returned])
+
+        db.session.commit()
+
+        returned_ids = {transaction.id for transaction in returned}
+        return [{'transaction': transaction_id, 'returned': transaction_id in returned_ids}
+                for transaction_id in transaction_ids], True
+
+    def charge_member(self, member_id, rent):
+        '''
+        Atomically add `rent` to the member's outstanding dues, refusing new
+        rentals while the dues are over the allowed limit.
+        '''
+        users = User.__table__
+        charge = users.update()\
+                      .where(users.c.id == member_id)\
+                      .where(users.c.outstanding_due <= MAX_ALLOWED_DUE)\
+                      .values(outstanding_due=users.c.outstanding_due + rent)
+
+        if not db.session.execute(charge).rowcount:
+            if not db.session.query(User.id).filter_by(id=member_id).scalar():
+                raise NoResultFound
+            raise ValueError(OVERDUE)
+
+    def credit_member(self, member_id, rent):
+        users = User.__table__
+        db.session.execute(users.update()
+                           .where(users.c.id == member_id)
+                           .values(outstanding_due=users.c.outstanding_due - rent))
+
+    def take_stock(self, book_id, num_copies):
+        '''
+        Atomically take copies off the shelf, moving the book's version on.
+
+        The decrement is conditional on the stock alone, so concurrent
+        checkouts of one title never conflict while copies are left. When
+        it misses although copies show up again, it is retried up to
+        CHECKOUT_RETRIES times after a random backoff that doubles each
+        attempt, and the checkout fails as a conflict past that. The
+        caller logs the change.
+        '''
+        books = Book.__table__
+        take = books.update()\
+                    .where(books.c.id == book_id)\
+                    .where(books.c.stock >= num_copies)\
+                    .values(stock=books.c.stock - num_copies, version=books.c.version + 1)
+
+        for attempt in range(CHECKOUT_RETRIES):
+            if attempt:
+                time.sleep(random.uniform(0, CHECKOUT_BACKOFF * 2 ** attempt))
+            if db.session.execute(take).rowcount:
+                return
+
+            stock = db.session.query(Book.stock).filter_by(id=book_id).one_or_none()
+            if stock is None:
+                raise NoResultFound
+            elif not stock.stock:
+                raise ValueError(OUT_OF_STOCK)
+            elif stock.stock < num_copies:
+                raise ValueError(STOCK_SHORTAGE % stock.stock)
+
+        raise ValueError(CHECKOUT_CONFLICT)
+
+    def restock(self, book_id, num_copies):
+        books = Book.__table__
+        db.session.execute(books.update()
+                           .where(books.c.id == book_id)
+                           .values(stock=books.c.stock + num_copies, version=books.c.version + 1))
+
+
+class ChangeService():
+    '''
+    Bridge between change feed resource and change log.
+    '''
+    models = {
+        'books': (Book, book_schema),
+        'transactions': (Transaction, transaction_schema),
+        'users': (User, user_schema),
+    }
+
+    def get_changes(self, limit=DEFAULT_RESULT_LIMIT, since=None):
+        '''
+        Rows written after the `since` position of the change log.
+
+        Several writes to one row within the page collapse into the last
+        one, carrying the row as it is now; rows gone since are tombstones
+        without data. Returns the page and the position to resume from.
+        '''
+        changes = Change.query.filter(feed_condition(db.session.connection(), since))
+        changes = paginate(changes.order_by(Change.txid, Change.id), limit,
+                           key=lambda change: (change.txid, change.id))
+
+        latest = {}
+        for change in changes:
+            key = (change.table_name, change.row_id)
+            latest.pop(key, None)
+            latest[key] = change.operation
+
+        rows = {}
+        for table, (model, schema) in self.models.items():
+            ids = [row_id for name, row_id in latest if name == table]
+            if ids:
+                found = model.query.filter(model.id.in_(ids)).all()
+                rows[table] = dict(zip([row.id for row in found], schema.dump(found, many=True)))
+
+        items = []
+        for (table, row_id), operation in latest.items():
+            data = rows.get(table, {}).get(row_id) if operation != 'delete' else None
+            items.append({
+                'table': table,
+                'id': row_id,
+                'operation': operation if data is not None else 'delete',
+                'data': data,
+            })
+
+        position = (changes[-1].txid, changes[-1].id) if changes else since
+        return Page(items, changes.next_key), position
@@ -0,0 +1,162 @@
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from api.constants import SLOW_QUERY_EXPLAIN_INTERVAL, SLOW_QUERY_LOG_SIZE
+
+EXPLAIN = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+EXPLAINABLE = ('select', 'update', 'delete', 'insert', 'with')
+# Databases on which a failed statement aborts the whole transaction.
+ABORTING_DIALECTS = ('postgresql', )
+
+
+def fingerprint(statement):
+    '''
+    The shape of a statement: literals and expanded IN lists collapsed so
+    that statements differing only in values share one entry.
+    '''
+    statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    statement = re.sub(r'\b\d+(?:\.\d+)?\b', '?', statement)
+    statement = re.sub(r'%\(\w+\)s|:\w+|\$\d+', '?', statement)
+    statement = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(...)', statement)
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+def explain(connection, statement, parameters):
+    '''
+    The plan of `statement`, read on a raw cursor so the engine hooks do
+    not see it. Returns None where the database cannot explain it.
+
+    Where a failed statement aborts the transaction, the plan is read in
+    a savepoint so a failure cannot break the request's own transaction.
+    '''
+    prefix = EXPLAIN.get(connection.dialect.name)
+    if not prefix or not statement.lstrip().lower().startswith(EXPLAINABLE):
+        return None
+
+    savepoint = connection.dialect.name in ABORTING_DIALECTS
+    cursor = connection.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = '\n'.join(' '.join(str(value) for value in row) for row in cursor.fetchall())
+        except Exception as e:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return f'EXPLAIN failed: {e}'
+
+        if savepoint:
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+        return plan
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog():
+    '''
+    The latest slow statements in a ring buffer, aggregated by fingerprint.
+
+    Each fingerprint's plan is captured with EXPLAIN when first seen and
+    refreshed at most every `explain_interval` seconds.
+    '''
+    def __init__(self, size=SLOW_QUERY_LOG_SIZE, explain_interval=SLOW_QUERY_EXPLAIN_INTERVAL):
+        self.lock = threading.Lock()
+        self.size = size
+        self.explain_interval = explain_interval
+        self.entries = deque(maxlen=size)
+        self.fingerprints = OrderedDict()
+
+    def record(self, connection, statement, parameters, duration):
+        key = fingerprint(statement)
+        now = time.monotonic()
+
+        with self.lock:
+            summary = self.fingerprints.pop(key, None)
+            if summary is None:
+                summary = {'fingerprint': key, 'count': 0, 'total': 0.0, 'max': 0.0,
+                           'statement': statement, 'plan': None, 'explained': None}
+            self.fingerprints[key] = summary
+            while len(self.fingerprints) > self.size:
+                self.fingerprints.popitem(last=False)
+
+            summary['count'] += 1
+            summary['total'] += duration
+            summary['max'] = max(summary['max'], duration)
+
+            stale = summary['explained'] is None or now - summary['explained'] > self.explain_interval
+            if stale:
+                summary['explained'] = now
+
+        if stale:
+            summary['plan'] = explain(connection, statement, parameters)
+
+        self.entries.append({'fingerprint': key, 'statement': statement,
+                             'duration': duration, 'date': datetime.now()})
+
+    def summaries(self):
+        '''
+        Fingerprints by total time spent, slowest first.
+        '''
+        with self.lock:
+            summaries = [dict(summary) for summary in self.fingerprints.values()]
+        return sorted(summaries, key=lambda summary: summary['total'], reverse=True)
+
+    def recent(self):
+        return list(reversed(self.entries))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.fingerprints.clear()
+
+
+class SlowQueries():
+    '''
+    Opt-in recorder of statements taking `SLOW_QUERY_THRESHOLD` seconds or
+    more; unset, nothing is timed. Each app keeps its own log of
+    `SLOW_QUERY_LOG_SIZE` statements.
+    '''
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_THRESHOLD', None)
+        app.config.setdefault('SLOW_QUERY_LOG_SIZE', SLOW_QUERY_LOG_SIZE)
+        app.extensions['slow_queries'] = SlowQueryLog(app.config['SLOW_QUERY_LOG_SIZE'])
+
+    @property
+    def log(self):
+        return current_app.extensions['slow_queries']
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(connection, cursor, statement, parameters, context, executemany):
+    if context is not None and has_app_context() \
+            and current_app.config.get('SLOW_QUERY_THRESHOLD') is not None:
+        context.slow_query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_statement(connection, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'slow_query_start', None)
+    if start is None or not has_app_context():
+        return
+
+    duration = time.perf_counter() - start
+    threshold = current_app.config.get('SLOW_QUERY_THRESHOLD')
+    if threshold is not None and duration >= threshold:
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        slow_queries.log.record(connection, statement, parameters, duration)
+
+
+slow_queries = SlowQueries()
@@ -0,0 +1,51 @@
+from flask import Response, json, request, stream_with_context
+
+from api.bulk import batched
+from api.constants import STREAM_CHUNK_SIZE
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def stream_format():
+    '''
+    The streaming format requested with `?stream=` or the Accept header:
+    `json`, `ndjson` or None for a regular paginated response.
+    '''
+    stream = request.args.get('stream', '').lower()
+    if stream == 'ndjson':
+        return 'ndjson'
+    elif stream in ('1', 'true', 'json'):
+        return 'json'
+
+    if request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return 'ndjson'
+    return None
+
+
+def stream_response(query, schema, stream_format, limit=None, chunk_size=STREAM_CHUNK_SIZE):
+    '''
+    Write the rows of `query` as they are fetched, `chunk_size` at a time.
+
+    Rows come through `yield_per`, which uses a server side cursor where the
+    driver has one, so memory stays bounded by the chunk size whatever the
+    result size. Without a Content-Length the body goes out chunked.
+    '''
+    if limit:
+        query = query.limit(limit)
+    rows = query.yield_per(chunk_size)
+
+    def generate_json():
+        separator = '['
+        for chunk in batched(rows, chunk_size):
+            # Dump the chunk as a list and drop the brackets to append it.
+            yield separator + json.dumps(schema.dump(chunk, many=True))[1:-1]
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+    def generate_ndjson():
+        for chunk in batched(rows, chunk_size):
+            yield ''.join(json.dumps(item) + '\n' for item in schema.dump(chunk, many=True))
+
+    if stream_format == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype=NDJSON_MIMETYPE)
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
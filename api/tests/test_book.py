@@ -1,9 +1,13 @@
+import json
 import re
 import unittest
 from datetime import datetime
 
-from api.models import Book, Transaction, db
+from api.messages import INVALID_CURSOR
+from api.models import Book, Transaction, bump_version, db, log_changes, rebuild_counters
+from api.pagination import encode_cursor
 from api.serializers import book_schema, response_schema
+from api.services import BookService
 from app import create_app
 
 
@@ -54,6 +58,19 @@ class BookResourceTest(unittest.TestCase):
         self.assertEqual(2, len(response.json))
         self.assertEqual(2, response.json[0]['id'])
 
+    def test_rebuild_counters(self):
+        # Given
+        with self.app.app_context():
+            Book.query.update({'rent_count': 7})
+            db.session.commit()
+
+            # When
+            rebuild_counters(db.session.connection())
+            db.session.commit()
+
+            # Then
+            self.assertEqual([0, 1], [book.rent_count for book in Book.query.order_by(Book.id)])
+
     def test_search_books(self):
         # When
         response = self.client.get('/api/v1/books/search/?title=lean')
@@ -62,6 +79,85 @@ class BookResourceTest(unittest.TestCase):
         self.assertEqual(200, response.status_code)
         self.assertEqual('Lean In', response.json[0]['title'])
 
+    def test_search_books_by_author(self):
+        # When
+        response = self.client.get('/api/v1/books/search/?author=rock')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['Your Brain at Work'], [book['title'] for book in response.json])
+
+    def test_search_books_after_update(self):
+        # Given
+        self.client.put('/api/v1/books/1/', json={'title': 'Option B'})
+
+        # When
+        old_title = self.client.get('/api/v1/books/search/?title=lean')
+        new_title = self.client.get('/api/v1/books/search/?title=option')
+
+        # Then
+        self.assertEqual(0, len(old_title.json))
+        self.assertEqual(1, new_title.json[0]['id'])
+
+    def test_search_books_after_delete(self):
+        # Given
+        self.client.delete('/api/v1/books/1/')
+
+        # When
+        response = self.client.get('/api/v1/books/search/?title=lean')
+
+        # Then
+        self.assertEqual(0, len(response.json))
+
+    def test_search_books_memory_backend(self):
+        # Given
+        self.app.config['SEARCH_BACKEND'] = 'memory'
+        self.app.extensions['search'] = None
+        self.client.get('/api/v1/books/search/?title=lean')
+        self.client.put('/api/v1/books/2/', json={'title': 'Lean Thinking'})
+
+        # When
+        response = self.client.get('/api/v1/books/search/?title=lean&limit=1')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.json))
+        self.assertIn('Link', response.headers)
+
+    def test_search_books_memory_backend_ranking(self):
+        # Given
+        self.app.config['SEARCH_BACKEND'] = 'memory'
+        self.app.extensions['search'] = None
+        self.client.get('/api/v1/books/search/?title=lean')
+        self.client.post('/api/v1/books/', json={'title': 'Lean Lean Startup', 'isbn': '0307887898',
+                                                 'author': 'Eric Ries', 'stock': 1, 'price': 20})
+
+        # When
+        response = self.client.get('/api/v1/books/search/?title=lean')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([3, 1], [book['id'] for book in response.json])
+
+    def test_search_books_memory_backend_other_worker(self):
+        # Given
+        self.app.config['SEARCH_BACKEND'] = 'memory'
+        self.app.extensions['search'] = None
+        self.client.get('/api/v1/books/search/?title=lean')
+        with self.app.app_context():
+            # Written by another worker, which this process never hears of.
+            db.session.execute(Book.__table__.update().where(Book.__table__.c.id == 2)
+                               .values(title='Lean Thinking'))
+            bump_version(db.session.connection(), 'books')
+            log_changes(db.session.connection(), 'books', [(2, 'update')])
+            db.session.commit()
+
+        # When
+        response = self.client.get('/api/v1/books/search/?title=thinking')
+
+        # Then
+        self.assertEqual([2], [book['id'] for book in response.json])
+
     def test_get_book_200(self):
         # When
         response = self.client.get('/api/v1/books/1/')
@@ -70,6 +166,89 @@ class BookResourceTest(unittest.TestCase):
         self.assertEqual(200, response.status_code)
         self.assertFalse(book_schema.validate(response.json))
 
+    def test_get_book_sparse_fields(self):
+        # When
+        response = self.client.get('/api/v1/books/1/?fields=author,url')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'author': 'Sheryl Sandberg', 'url': '/api/v1/books/1/'}, response.json)
+
+    def test_get_book_cached(self):
+        # Given
+        self.client.get('/api/v1/books/1/')
+
+        # When
+        response = self.client.get('/api/v1/books/1/')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'hits': 1, 'misses': 1, 'evictions': 0},
+                         self.client.get('/api/v1/cache/').json)
+
+    def test_get_book_after_update(self):
+        # Given
+        self.client.get('/api/v1/books/1/')
+        self.client.put('/api/v1/books/1/', json={'title': 'Lean Out'})
+
+        # When
+        response = self.client.get('/api/v1/books/1/')
+
+        # Then
+        self.assertEqual('Lean Out', response.json['title'])
+
+    def test_get_book_after_orm_update(self):
+        # Given
+        self.client.get('/api/v1/books/1/')
+        with self.app.app_context():
+            Book.query.get(1).title = 'Lean Out'
+            db.session.commit()
+
+        # When
+        response = self.client.get('/api/v1/books/1/')
+
+        # Then
+        self.assertEqual('Lean Out', response.json['title'])
+
+    def test_get_book_after_orm_delete(self):
+        # Given
+        self.client.get('/api/v1/books/1/')
+        with self.app.app_context():
+            db.session.delete(Book.query.get(1))
+            db.session.commit()
+
+        # When
+        response = self.client.get('/api/v1/books/1/')
+
+        # Then
+        self.assertEqual(404, response.status_code)
+
+    def test_get_book_after_rolled_back_update(self):
+        # Given
+        self.client.get('/api/v1/books/1/')
+        with self.app.app_context():
+            Book.query.get(1).title = 'Lean Out'
+            db.session.flush()
+            db.session.rollback()
+
+        # When
+        response = self.client.get('/api/v1/books/1/')
+
+        # Then
+        self.assertEqual('Lean In', response.json['title'])
+
+    def test_get_book_not_modified(self):
+        # Given
+        etag = self.client.get('/api/v1/books/1/').headers['ETag']
+
+        # When
+        response = self.client.get('/api/v1/books/1/', headers={'If-None-Match': etag})
+        other = self.client.get('/api/v1/books/2/', headers={'If-None-Match': etag})
+
+        # Then
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(200, other.status_code)
+
     def test_get_book_404(self):
         # When
         response = self.client.get('/api/v1/books/3/')
@@ -86,6 +265,188 @@ class BookResourceTest(unittest.TestCase):
         self.assertEqual(2, len(response.json))
         self.assertFalse(book_schema.validate(response.json[0]))
 
+    def test_get_books_paginated(self):
+        # When
+        response = self.client.get('/api/v1/books/?limit=1')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.json))
+        self.assertEqual(1, response.json[0]['id'])
+
+        next_url = re.match(r'<(.+)>; rel="next"', response.headers['Link']).group(1)
+
+        # When
+        response = self.client.get(next_url)
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, response.json[0]['id'])
+        self.assertNotIn('Link', response.headers)
+
+    def test_get_popular_books_paginated(self):
+        # When
+        response = self.client.get('/api/v1/books/popular/?limit=1')
+        next_url = re.match(r'<(.+)>; rel="next"', response.headers['Link']).group(1)
+        next_response = self.client.get(next_url)
+
+        # Then
+        self.assertEqual(2, response.json[0]['id'])
+        self.assertEqual(1, next_response.json[0]['id'])
+
+    def test_get_books_sparse_fields(self):
+        # When
+        response = self.client.get('/api/v1/books/?fields=id,title')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'id': 1, 'title': 'Lean In'}, {'id': 2, 'title': 'Your Brain at Work'}],
+                         response.json)
+
+    def test_get_books_sparse_fields_query(self):
+        # When
+        with self.app.test_request_context():
+            books = BookService().get_books(None, fields=('url', 'title'))
+
+            # Then
+            self.assertEqual({'id', 'title'}, set(books[0].__dict__) & set(book_schema.fields))
+
+    def test_get_popular_books_sparse_fields(self):
+        # When
+        response = self.client.get('/api/v1/books/popular/?limit=1&fields=url')
+        next_url = re.match(r'<(.+)>; rel="next"', response.headers['Link']).group(1)
+        next_response = self.client.get(next_url)
+
+        # Then
+        self.assertEqual([{'url': '/api/v1/books/2/'}], response.json)
+        self.assertEqual([{'url': '/api/v1/books/1/'}], next_response.json)
+
+    def test_get_books_streamed_sparse_fields(self):
+        # When
+        response = self.client.get('/api/v1/books/?stream=ndjson&fields=isbn')
+
+        # Then
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([{'isbn': '0385349949'}, {'isbn': '0385359949'}],
+                         [json.loads(line) for line in lines])
+
+    def test_get_books_unknown_fields(self):
+        # When
+        response = self.client.get('/api/v1/books/?fields=title,rent_count')
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
+    def test_get_books_not_modified(self):
+        # Given
+        etag = self.client.get('/api/v1/books/').headers['ETag']
+
+        # When
+        response = self.client.get('/api/v1/books/', headers={'If-None-Match': etag})
+
+        # Then
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response.headers['ETag'])
+        self.assertEqual(b'', response.data)
+
+    def test_get_books_modified(self):
+        # Given
+        etag = self.client.get('/api/v1/books/').headers['ETag']
+        self.client.put('/api/v1/books/1/', json={'stock': 2})
+
+        # When
+        response = self.client.get('/api/v1/books/', headers={'If-None-Match': etag})
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers['ETag'])
+        self.assertNotEqual(etag, self.client.get('/api/v1/books/?limit=1').headers['ETag'])
+
+    def test_get_books_by_ids(self):
+        # When
+        response = self.client.get('/api/v1/books/?ids=2,9,1')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([2, None, 1], [book and book['id'] for book in response.json])
+        self.assertFalse(book_schema.validate(response.json[0]))
+
+    def test_get_books_by_isbn(self):
+        # When
+        response = self.client.get('/api/v1/books/?isbn=0385359949,0385349949&fields=title')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'title': 'Your Brain at Work'}, {'title': 'Lean In'}], response.json)
+
+    def test_get_books_by_invalid_ids(self):
+        # When
+        response = self.client.get('/api/v1/books/?ids=1,two')
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
+    def test_get_books_invalid_cursor(self):
+        # When
+        response = self.client.get('/api/v1/books/?after=not-a-cursor')
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
+    def test_get_popular_books_listing_cursor(self):
+        # Given
+        after = self.client.get('/api/v1/books/?limit=1').headers['Link']
+        after = re.search(r'after=([^&>]+)', after).group(1)
+
+        # When
+        response = self.client.get(f'/api/v1/books/popular/?after={after}')
+
+        # Then
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(INVALID_CURSOR, response.json['message'])
+
+    def test_get_books_tampered_cursor(self):
+        for url, key in (('/api/v1/books/?after=', [{'a': 1}]),
+                         ('/api/v1/books/?after=', [True]),
+                         ('/api/v1/books/popular/?after=', ['a', 'b']),
+                         ('/api/v1/books/search/?title=lean&after=', [1])):
+            # When
+            response = self.client.get(url + encode_cursor(key))
+
+            # Then
+            self.assertEqual(400, response.status_code, url)
+
+    def test_get_books_ignores_unknown_arguments(self):
+        for url in ('/api/v1/books/?request_type=x',
+                    '/api/v1/books/search/?title=lean&request_type=x'):
+            # When
+            response = self.client.get(url)
+
+            # Then
+            self.assertEqual(200, response.status_code, url)
+
+    def test_get_books_streamed(self):
+        # When
+        response = self.client.get('/api/v1/books/?stream=1')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.is_streamed)
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEqual([1, 2], [book['id'] for book in response.json])
+        self.assertEqual(self.client.get('/api/v1/books/').json, response.json)
+
+    def test_get_popular_books_ndjson(self):
+        # When
+        response = self.client.get('/api/v1/books/popular/',
+                                   headers={'Accept': 'application/x-ndjson'})
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson', response.mimetype)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([2, 1], [json.loads(line)['id'] for line in lines])
+
     def test_post_book_201(self):
         # Given
         data = {
@@ -119,6 +480,13 @@ class BookResourceTest(unittest.TestCase):
         # Then
         self.assertEqual(400, response.status_code)
 
+    def test_post_book_without_body_400(self):
+        # When
+        response = self.client.post('/api/v1/books/', data='title=Some Title')
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
     def test_post_book_409(self):
         # Given
         data = {
@@ -135,6 +503,50 @@ class BookResourceTest(unittest.TestCase):
         # Then
         self.assertEqual(409, response.status_code)
 
+    def test_bulk_import_jsonl(self):
+        # Given
+        data = '\n'.join([
+            '{"title": "Lean In", "isbn": "0385349949", "author": "Sheryl Sandberg", "stock": 9}',
+            '{"title": "Some Title", "isbn": "1385349947", "author": "Some Author"}',
+            '{"title": "No Author", "isbn": "2385349947"}',
+            'not json',
+        ])
+
+        # When
+        response = self.client.post('/api/v1/books/bulk/', data=data,
+                                    content_type='application/x-ndjson')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, response.json['imported'])
+        self.assertEqual([3, 4], [error['row'] for error in response.json['errors']])
+        self.assertIn('author', response.json['errors'][0]['errors'])
+
+        with self.app.app_context():
+            self.assertEqual(9, Book.query.get(1).stock)
+            self.assertEqual(3, Book.query.count())
+
+        search = self.client.get('/api/v1/books/search/?title=some')
+        self.assertEqual('1385349947', search.json[0]['isbn'])
+
+    def test_bulk_import_csv(self):
+        # Given
+        data = ('title,isbn,author,price,stock\n'
+                'Some Title,1385349947,Some Author,,4\n'
+                'Bad Price,2385349947,Some Author,cheap,1\n')
+
+        # When
+        response = self.client.post('/api/v1/books/bulk/', data=data, content_type='text/csv')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, response.json['imported'])
+        self.assertEqual(2, response.json['errors'][0]['row'])
+
+        with self.app.app_context():
+            book = Book.query.filter_by(isbn='1385349947').one()
+            self.assertEqual((30, 4), (book.price, book.stock))
+
     def test_put_book_400(self):
         # Given
         data = {"title": 5}
@@ -173,6 +585,126 @@ class BookResourceTest(unittest.TestCase):
         self.assertFalse(response_schema.validate(response.json))
         assert re.match(r'/api/v1/books/\d+/', response.json['url'])
 
+    def test_put_book_incomplete_new_400(self):
+        # Given
+        data = {"title": "Some Title"}
+
+        # When
+        response = self.client.put(f'/api/v1/books/3/', json=data)
+
+        # Then
+        self.assertEqual(400, response.status_code)
+        self.assertIn('isbn', response.json['message'])
+
+    def test_put_book_updates_only_given_fields(self):
+        # When
+        response = self.client.put('/api/v1/books/1/', json={'stock': 9})
+        book = self.client.get('/api/v1/books/1/').json
+
+        # Then
+        self.assertEqual(204, response.status_code)
+        self.assertEqual((9, 'Lean In', 30), (book['stock'], book['title'], book['price']))
+
+    def test_get_book_etag_is_version(self):
+        # When
+        response = self.client.get('/api/v1/books/1/')
+        narrowed = self.client.get('/api/v1/books/1/?fields=title')
+
+        # Then
+        self.assertEqual('"1.1"', response.headers['ETag'])
+        self.assertEqual('"1.1;fields=title"', narrowed.headers['ETag'])
+        self.assertNotIn('version', response.json)
+
+    def test_put_book_if_match(self):
+        # Given
+        etag = self.client.get('/api/v1/books/1/').headers['ETag']
+
+        # When
+        response = self.client.put('/api/v1/books/1/', json={'stock': 9},
+                                   headers={'If-Match': etag})
+        book = self.client.get('/api/v1/books/1/')
+
+        # Then
+        self.assertEqual(204, response.status_code)
+        self.assertEqual(9, book.json['stock'])
+        self.assertEqual('"1.2"', book.headers['ETag'])
+
+    def test_put_book_if_match_412(self):
+        # Given
+        etag = self.client.get('/api/v1/books/1/').headers['ETag']
+        self.client.put('/api/v1/books/1/', json={'stock': 9})
+
+        # When
+        response = self.client.put('/api/v1/books/1/', json={'stock': 1},
+                                   headers={'If-Match': etag})
+        other = self.client.put('/api/v1/books/2/', json={'stock': 1},
+                                headers={'If-Match': '"1.1"'})
+
+        # Then
+        self.assertEqual(412, response.status_code)
+        self.assertEqual(412, other.status_code)
+        self.assertEqual(9, self.client.get('/api/v1/books/1/').json['stock'])
+
+    def test_delete_book_if_match_412(self):
+        # When
+        response = self.client.delete('/api/v1/books/1/', headers={'If-Match': '"1.2"'})
+
+        # Then
+        self.assertEqual(412, response.status_code)
+        self.assertEqual(200, self.client.get('/api/v1/books/1/').status_code)
+
+    def test_put_book_409(self):
+        # When
+        response = self.client.put('/api/v1/books/1/', json={'isbn': '0385359949'})
+
+        # Then
+        self.assertEqual(409, response.status_code)
+
+    def test_put_books(self):
+        # Given
+        data = [
+            {'id': 1, 'title': 'Lean Out'},
+            {'id': 5, 'title': 'New Title', 'isbn': '1385349947', 'author': 'Someone'},
+        ]
+
+        # When
+        response = self.client.put('/api/v1/books/', json=data)
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'url': '/api/v1/books/1/', 'created': False},
+                          {'url': '/api/v1/books/5/', 'created': True}], response.json)
+        self.assertEqual('Lean Out', self.client.get('/api/v1/books/1/').json['title'])
+        self.assertEqual(30, self.client.get('/api/v1/books/5/').json['price'])
+        self.assertEqual(5, self.client.get('/api/v1/books/search/?title=new').json[0]['id'])
+
+        changes = self.client.get('/api/v1/changes/').json['changes']
+        self.assertIn(('books', 5, 'insert'), [(change['table'], change['id'], change['operation'])
+                                              for change in changes])
+
+    def test_put_books_400(self):
+        # Given
+        data = [
+            {'id': 1, 'title': 'Lean Out'},
+            {'id': 5, 'title': 'New Title'},
+        ]
+
+        # When
+        response = self.client.put('/api/v1/books/', json=data)
+
+        # Then
+        self.assertEqual(400, response.status_code)
+        self.assertIn('isbn', response.json['message']['1'])
+        self.assertEqual('Lean In', self.client.get('/api/v1/books/1/').json['title'])
+
+    def test_put_books_repeated_ids_400(self):
+        # When
+        response = self.client.put('/api/v1/books/', json=[{'id': 1, 'stock': 1},
+                                                            {'id': 1, 'stock': 2}])
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
     def test_delete_book_200(self):
         # When
         response = self.client.delete(f'/api/v1/books/1/')
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import time
+import unittest
+
+from api.cache import MemoryCacheBackend, SQLiteCacheBackend
+
+
+class MemoryCacheBackendTest(unittest.TestCase):
+
+    def test_least_recently_used_evicted(self):
+        # Given
+        cache = MemoryCacheBackend(size=2)
+        cache.set('books:1', '1')
+        cache.set('books:2', '2')
+        cache.get('books:1')
+
+        # When
+        cache.set('books:3', '3')
+
+        # Then
+        self.assertEqual('1', cache.get('books:1'))
+        self.assertIsNone(cache.get('books:2'))
+        self.assertEqual({'hits': 2, 'misses': 1, 'evictions': 1}, cache.stats())
+
+    def test_expired(self):
+        # Given
+        cache = MemoryCacheBackend(ttl=0)
+        cache.set('books:1', '1')
+
+        # When
+        payload = cache.get('books:1')
+
+        # Then
+        self.assertIsNone(payload)
+        self.assertEqual({'hits': 0, 'misses': 1, 'evictions': 1}, cache.stats())
+
+
+class SQLiteCacheBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        descriptor, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(descriptor)
+
+    def test_shared_between_workers(self):
+        # Given
+        SQLiteCacheBackend(self.path).set('books:1', '1')
+        worker = SQLiteCacheBackend(self.path)
+
+        # When
+        payload = worker.get('books:1')
+
+        # Then
+        self.assertEqual('1', payload)
+        self.assertEqual({'hits': 1, 'misses': 0, 'evictions': 0}, worker.stats())
+
+    def test_delete(self):
+        # Given
+        cache = SQLiteCacheBackend(self.path)
+        cache.set('books:1', '1')
+
+        # When
+        SQLiteCacheBackend(self.path).delete(['books:1'])
+
+        # Then
+        self.assertIsNone(cache.get('books:1'))
+
+    def test_evicted_past_size(self):
+        # Given
+        cache = SQLiteCacheBackend(self.path, size=2)
+        cache.set('books:1', '1')
+        time.sleep(0.01)
+        cache.set('books:2', '2')
+
+        # When
+        cache.set('books:3', '3')
+
+        # Then
+        self.assertIsNone(cache.get('books:1'))
+        self.assertEqual('3', cache.get('books:3'))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
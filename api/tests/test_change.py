@@ -0,0 +1,141 @@
+import os
+import re
+import unittest
+
+from sqlalchemy import text
+
+from api.models import Book, User, db, log_changes
+from app import create_app
+
+
+class ChangeResourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('config.TestingConfig')
+        self.client = self.app.test_client()
+
+        self.user = User(
+            email='abc@example.com',
+            first_name='First',
+            contact='1234567890',
+        )
+
+        self.book = Book(
+            title='Lean In',
+            isbn='0385349949',
+            author='Sheryl Sandberg',
+            stock=5,
+            price=30
+        )
+
+        self.book2 = Book(
+            title='Your Brain at Work',
+            isbn='0385359949',
+            author='David Rock',
+            stock=8,
+            price=40
+        )
+
+        with self.app.app_context():
+            db.create_all()
+
+            db.session.add(self.user)
+            db.session.add(self.book)
+            db.session.add(self.book2)
+            db.session.commit()
+
+    def test_get_changes(self):
+        # When
+        response = self.client.get('/api/v1/changes/')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([('books', 1, 'insert'), ('books', 2, 'insert'), ('users', 1, 'insert')],
+                         [(change['table'], change['id'], change['operation'])
+                          for change in response.json['changes']])
+        self.assertEqual('Lean In', response.json['changes'][0]['data']['title'])
+
+    def test_get_changes_since(self):
+        # Given
+        since = self.client.get('/api/v1/changes/').json['next']
+
+        self.client.put('/api/v1/books/1/', json={'title': 'Lean Out'})
+        self.client.delete('/api/v1/books/2/')
+        self.client.post('/api/v1/transactions/', json={'book': 1, 'member': 1, 'num_copies': 1})
+
+        # When
+        response = self.client.get(f'/api/v1/changes/?since={since}')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        changes = response.json['changes']
+        self.assertEqual([('books', 2, 'delete'), ('transactions', 1, 'insert'), ('books', 1, 'update')],
+                         [(change['table'], change['id'], change['operation']) for change in changes])
+        self.assertIsNone(changes[0]['data'])
+        self.assertEqual({'title': 'Lean Out', 'stock': 4},
+                         {key: changes[2]['data'][key] for key in ('title', 'stock')})
+
+    def test_get_changes_up_to_date(self):
+        # Given
+        since = self.client.get('/api/v1/changes/').json['next']
+
+        # When
+        response = self.client.get(f'/api/v1/changes/?since={since}')
+
+        # Then
+        self.assertEqual([], response.json['changes'])
+        self.assertEqual(since, response.json['next'])
+
+    def test_get_changes_paginated(self):
+        # When
+        response = self.client.get('/api/v1/changes/?limit=2')
+        next_url = re.match(r'<(.+)>; rel="next"', response.headers['Link']).group(1)
+        next_response = self.client.get(next_url)
+
+        # Then
+        self.assertEqual(2, len(response.json['changes']))
+        self.assertEqual([('users', 1)], [(change['table'], change['id'])
+                                          for change in next_response.json['changes']])
+        self.assertNotIn('Link', next_response.headers)
+
+    @unittest.skipUnless(os.environ['TEST_DATABASE_URL'].startswith('postgres'),
+                         'concurrent writers need Postgres')
+    def test_concurrent_writers_do_not_block(self):
+        # Given
+        since = self.client.get('/api/v1/changes/').json['next']
+
+        with self.app.app_context():
+            engine = db.get_engine()
+            first = engine.connect()
+            second = engine.connect()
+            try:
+                pending = first.begin()
+                log_changes(first, 'books', [(1, 'update')])
+
+                # When
+                with second.begin():
+                    second.execute(text("SET LOCAL lock_timeout = '1s'"))
+                    log_changes(second, 'books', [(2, 'update')])
+
+                waiting = self.client.get(f'/api/v1/changes/?since={since}').json['changes']
+                pending.commit()
+                committed = self.client.get(f'/api/v1/changes/?since={since}').json['changes']
+            finally:
+                first.close()
+                second.close()
+
+        # Then
+        self.assertEqual([], waiting)
+        self.assertEqual([1, 2], [change['id'] for change in committed])
+
+    def test_get_changes_invalid_token(self):
+        # When
+        response = self.client.get('/api/v1/changes/?since=not-a-token')
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,58 @@
+import unittest
+
+from api.constants import MAX_ALLOWED_DUE
+from api.dataset import generate
+from api.models import Book, Transaction, User, db
+from api.services import UserService
+from app import create_app
+
+
+class DatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('config.TestingConfig')
+
+        with self.app.app_context():
+            db.create_all()
+
+    def test_generate(self):
+        with self.app.app_context():
+            # When
+            generate(db.session.connection(), users=50, books=20, transactions=2000)
+            db.session.commit()
+
+            # Then
+            self.assertEqual(50, User.query.count())
+            self.assertEqual(20, Book.query.count())
+            self.assertEqual(2000, Transaction.query.count())
+            self.assertEqual(2000, db.session.query(db.func.sum(Book.rent_count)).scalar())
+            self.assertLessEqual(db.session.query(db.func.max(User.outstanding_due)).scalar(),
+                                 MAX_ALLOWED_DUE)
+            self.assertEqual([], UserService().reconcile_dues())
+
+    def test_generate_skewed(self):
+        with self.app.app_context():
+            # When
+            generate(db.session.connection(), users=50, books=100, transactions=2000)
+
+            # Then
+            counts = sorted((count for count, in db.session.query(Book.rent_count)),
+                            reverse=True)
+            self.assertGreater(sum(counts[:10]), sum(counts) / 2)
+
+    def test_generate_repeatable(self):
+        with self.app.app_context():
+            # When
+            generate(db.session.connection(), users=10, books=10, transactions=100, seed=7)
+            first = [(row.member, row.book, row.rent) for row in Transaction.query]
+            db.session.rollback()
+            generate(db.session.connection(), users=10, books=10, transactions=100, seed=7)
+            second = [(row.member, row.book, row.rent) for row in Transaction.query]
+
+            # Then
+            self.assertEqual(first, second)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
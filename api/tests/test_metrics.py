@@ -0,0 +1,86 @@
+import gc
+import threading
+import unittest
+
+from api.models import Book, db
+from app import create_app
+
+
+class MetricsResourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('config.TestingConfig')
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+            db.session.add(Book(
+                title='Lean In',
+                isbn='0385349949',
+                author='Sheryl Sandberg',
+                stock=5,
+                price=30
+            ))
+            db.session.commit()
+
+    def test_get_metrics(self):
+        # Given
+        self.client.get('/api/v1/books/')
+        self.client.get('/api/v1/books/9/')
+
+        # When
+        response = self.client.get('/metrics')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertIn('elibrary_http_requests_total{endpoint="books",method="GET",status="200"} 1',
+                      lines)
+        self.assertIn('elibrary_http_requests_total{endpoint="book",method="GET",status="404"} 1',
+                      lines)
+        self.assertIn('elibrary_http_request_duration_seconds_count'
+                      '{endpoint="books",method="GET"} 1', lines)
+        self.assertIn('elibrary_http_requests_in_flight 1', lines)
+        self.assertIn('elibrary_cache_misses_total 1', lines)
+
+    def test_get_metrics_sql(self):
+        # Given
+        self.client.get('/api/v1/books/')
+
+        # When
+        lines = self.client.get('/metrics').get_data(as_text=True).splitlines()
+
+        # Then
+        queries = [line for line in lines
+                   if line.startswith('elibrary_http_request_queries_sum{endpoint="books"')]
+        self.assertEqual(1, len(queries))
+        self.assertGreater(float(queries[0].split()[-1]), 0)
+        self.assertIn('elibrary_http_request_queries_bucket'
+                      '{endpoint="books",method="GET",le="0"} 0', lines)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_metrics_of_finished_threads_are_kept(self):
+        # Given
+        registry = self.app.extensions['metrics']
+
+        def serve():
+            registry.shard.requests[('books', 'GET', 200)] += 1
+
+        threads = [threading.Thread(target=serve) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # When
+        del threads, thread
+        gc.collect()
+
+        # Then
+        self.assertEqual([], registry.shards)
+        self.assertEqual(3, registry.collect()[1][('books', 'GET', 200)])
@@ -0,0 +1,103 @@
+import unittest
+
+from flask_admin import Admin
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+
+from api.models import Book, db
+from api.pool import InstrumentedNullPool, InstrumentedQueuePool, engine_pool_stats, pool_options
+from api.views.pool import PoolView
+from app import create_app
+
+
+class PoolStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('config.TestingConfig')
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+            db.session.add(Book(
+                title='Lean In',
+                isbn='0385349949',
+                author='Sheryl Sandberg',
+                stock=5,
+                price=30
+            ))
+            db.session.commit()
+
+    def test_get_pool_stats(self):
+        # Given
+        self.client.get('/api/v1/books/1/')
+
+        # When
+        response = self.client.get('/api/v1/pool/')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        primary, = response.json
+        self.assertEqual(('primary', 'sqlite', 'InstrumentedNullPool'),
+                         (primary['bind'], primary['dialect'], primary['pool']))
+        self.assertEqual(0, primary['checked_out'])
+        self.assertGreaterEqual(primary['checkouts'], 1)
+        self.assertEqual(primary['checkouts'], primary['wait_buckets'][-1]['count'])
+
+    def test_queue_pool_overflow_and_timeout(self):
+        # Given
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=1,
+                               max_overflow=1, pool_timeout=0.01,
+                               connect_args={'check_same_thread': False})
+
+        # When
+        connections = [engine.connect(), engine.connect()]
+        with self.assertRaises(exc.TimeoutError):
+            engine.connect()
+        stats = engine_pool_stats(engine)
+
+        # Then
+        self.assertEqual({'size': 1, 'checked_out': 2, 'overflow': 1, 'checkouts': 2,
+                          'overflow_events': 1, 'timeouts': 1},
+                         {name: stats[name] for name in ('size', 'checked_out', 'overflow',
+                                                         'checkouts', 'overflow_events',
+                                                         'timeouts')})
+
+        for connection in connections:
+            connection.close()
+        self.assertEqual(0, engine_pool_stats(engine)['checked_out'])
+
+    def test_pool_options(self):
+        # When
+        postgres = pool_options(self.app.config, make_url('postgresql://localhost/library'), {})
+        sqlite = pool_options(self.app.config, make_url('sqlite:////tmp/library.db'),
+                              {'poolclass': NullPool})
+
+        # Then
+        self.assertEqual((InstrumentedQueuePool, 2, 2, 5, False),
+                         (postgres['poolclass'], postgres['pool_size'],
+                          postgres['max_overflow'], postgres['pool_timeout'],
+                          postgres['pool_pre_ping']))
+        self.assertEqual('-c statement_timeout=10000', postgres['connect_args']['options'])
+        self.assertIs(InstrumentedNullPool, sqlite['poolclass'])
+        self.assertNotIn('pool_size', sqlite)
+        self.assertNotIn('connect_args', sqlite)
+
+    def test_admin_view(self):
+        # Given
+        Admin(self.app, template_mode='bootstrap3').add_view(
+            PoolView(name='Connection pools', endpoint='pool'))
+        self.client.get('/api/v1/books/1/')
+
+        # When
+        response = self.client.get('/admin/pool/')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b'InstrumentedNullPool', response.data)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
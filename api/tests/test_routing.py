@@ -0,0 +1,103 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from api.models import Book, db
+from api.routing import WeightedRoundRobin, parse_replicas
+from app import create_app
+
+
+class ReplicaRoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('config.TestingConfig')
+        self.client = self.app.test_client()
+
+        # Two SQLite files stand in for the primary and a lagging replica.
+        handle, self.replica_path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app.config['SQLALCHEMY_REPLICAS'] = f'sqlite:///{self.replica_path}'
+
+        replica = create_engine(f'sqlite:///{self.replica_path}')
+        db.Model.metadata.create_all(replica)
+        replica.execute(Book.__table__.insert(), title='Lean In (replica)',
+                        isbn='0385349949', author='Sheryl Sandberg', stock=5, price=30)
+        replica.dispose()
+
+        with self.app.app_context():
+            db.create_all()
+
+            db.session.add(Book(
+                title='Lean In',
+                isbn='0385349949',
+                author='Sheryl Sandberg',
+                stock=5,
+                price=30
+            ))
+            db.session.commit()
+
+    def test_get_reads_replica(self):
+        # When
+        response = self.client.get('/api/v1/books/1/')
+        listing = self.client.get('/api/v1/books/')
+
+        # Then
+        self.assertEqual('Lean In (replica)', response.json['title'])
+        self.assertEqual('Lean In (replica)', listing.json[0]['title'])
+
+    def test_write_goes_to_primary(self):
+        # When
+        response = self.client.put('/api/v1/books/1/', json={'stock': 9})
+
+        # Then
+        self.assertEqual(204, response.status_code)
+
+        with self.app.app_context():
+            self.assertEqual(9, Book.query.get(1).stock)
+
+        replica = create_engine(f'sqlite:///{self.replica_path}')
+        self.assertEqual(5, replica.execute('SELECT stock FROM books').scalar())
+        replica.dispose()
+
+    def test_read_your_writes(self):
+        # Given
+        other = self.app.test_client()
+        self.client.get('/api/v1/books/1/')
+
+        # When
+        self.client.put('/api/v1/books/1/', json={'stock': 9})
+        own = self.client.get('/api/v1/books/1/')
+        theirs = other.get('/api/v1/books/')
+
+        # Then
+        self.assertEqual(('Lean In', 9), (own.json['title'], own.json['stock']))
+        self.assertEqual('Lean In (replica)', theirs.json[0]['title'])
+
+    def test_read_your_writes_disabled(self):
+        # Given
+        self.app.config['READ_YOUR_WRITES_WINDOW'] = 0
+
+        # When
+        self.client.put('/api/v1/books/1/', json={'stock': 9})
+        response = self.client.get('/api/v1/books/1/')
+
+        # Then
+        self.assertEqual('Lean In (replica)', response.json['title'])
+
+    def test_weighted_round_robin(self):
+        # Given
+        balancer = WeightedRoundRobin(parse_replicas('sqlite:///a.db|2,sqlite:///b.db'))
+
+        # When
+        chosen = [balancer.next() for _ in range(6)]
+
+        # Then
+        self.assertEqual(['sqlite:///a.db', 'sqlite:///b.db', 'sqlite:///a.db'] * 2, chosen)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.remove(self.replica_path)
@@ -0,0 +1,107 @@
+import unittest
+from datetime import datetime
+
+from flask import json
+from marshmallow import Schema
+
+from api.dumpers import compiled_dumper
+from api.models import Book, Transaction, User, db
+from api.serializers import BookSchema, TransactionSchema, UserSchema
+from app import create_app
+
+
+class CompiledDumpTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('config.TestingConfig')
+
+        with self.app.app_context():
+            db.create_all()
+
+            db.session.add(User(
+                email='abc@example.com',
+                first_name='First',
+                contact='1234567890',
+            ))
+            db.session.add(Book(
+                title='Lean In',
+                isbn='0385349949',
+                author='Sheryl Sandberg',
+                stock=5,
+                price=30
+            ))
+            db.session.add(Book(
+                title='Ünïcode & <Markup>',
+                isbn='0385359949',
+                author='David Rock',
+            ))
+            db.session.add(Transaction(
+                member=1,
+                book=1,
+                num_copies=2,
+                rent=60,
+                date_rented=datetime(2021, 4, 1, 10, 30, 15, 123456),
+                date_return=datetime(2021, 4, 8)
+            ))
+            db.session.add(Transaction(
+                member=1,
+                book=2,
+                num_copies=1,
+                rent=30
+            ))
+            db.session.commit()
+
+    def assertSameJSON(self, schema, rows):
+        with self.app.test_request_context('/'):
+            expected = json.dumps(Schema.dump(schema, rows))
+            compiled = json.dumps(schema.dump(rows))
+
+        self.assertEqual(expected, compiled)
+
+    def test_book_parity(self):
+        with self.app.app_context():
+            self.assertSameJSON(BookSchema(many=True), Book.query.all())
+            self.assertSameJSON(BookSchema(), Book.query.get(2))
+
+    def test_user_parity(self):
+        with self.app.app_context():
+            self.assertSameJSON(UserSchema(many=True), User.query.all())
+
+    def test_transaction_parity(self):
+        with self.app.app_context():
+            self.assertSameJSON(TransactionSchema(many=True), Transaction.query.all())
+
+    def test_script_root_parity(self):
+        with self.app.app_context():
+            books = Book.query.all()
+
+            with self.app.test_request_context('/', base_url='http://localhost/library'):
+                compiled = BookSchema(many=True).dump(books)
+
+        self.assertEqual('/library/api/v1/books/1/', compiled[0]['url'])
+
+    def test_host_headers_share_url_template(self):
+        # Given
+        with self.app.app_context():
+            books = Book.query.all()
+
+            # When
+            for number in range(5):
+                with self.app.test_request_context('/', base_url=f'http://host{number}.example/'):
+                    BookSchema(many=True).dump(books)
+
+        # Then
+        self.assertEqual(1, len(self.app.extensions['url_templates']))
+
+    def test_field_orders_share_compiled_dumper(self):
+        # When
+        dumpers = {compiled_dumper(BookSchema(only=fields))
+                   for fields in (('id', 'title'), ('title', 'id'))}
+
+        # Then
+        self.assertEqual(1, len(dumpers))
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,75 @@
+import unittest
+
+from flask_admin import Admin
+
+from api.models import Book, db
+from api.slowlog import fingerprint
+from api.views.slow_queries import SlowQueryView
+from app import create_app
+
+
+class SlowQueryLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('config.TestingConfig')
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+            db.session.add(Book(
+                title='Lean In',
+                isbn='0385349949',
+                author='Sheryl Sandberg',
+                stock=5,
+                price=30
+            ))
+            db.session.commit()
+
+    def test_fingerprint(self):
+        # When
+        shape = fingerprint("SELECT * FROM books WHERE id IN (?, ?, ?) AND title = 'x'  LIMIT 10")
+
+        # Then
+        self.assertEqual('SELECT * FROM books WHERE id IN (...) AND title = ? LIMIT ?', shape)
+
+    def test_not_recording_by_default(self):
+        # When
+        self.client.get('/api/v1/books/1/')
+
+        # Then
+        self.assertEqual([], self.app.extensions['slow_queries'].recent())
+
+    def test_record_slow_queries(self):
+        # Given
+        self.app.config['SLOW_QUERY_THRESHOLD'] = 0
+
+        # When
+        self.client.get('/api/v1/books/1/')
+        self.client.get('/api/v1/books/?author=Rock')
+
+        # Then
+        summaries = self.app.extensions['slow_queries'].summaries()
+        books = [summary for summary in summaries
+                 if summary['fingerprint'].startswith('SELECT books.id')]
+        self.assertTrue(books)
+        self.assertIn('books', books[0]['plan'])
+
+    def test_admin_view(self):
+        # Given
+        self.app.config['SLOW_QUERY_THRESHOLD'] = 0
+        Admin(self.app, template_mode='bootstrap3').add_view(
+            SlowQueryView(name='Slow queries', endpoint='slow_queries'))
+        self.client.get('/api/v1/books/1/')
+
+        # When
+        response = self.client.get('/admin/slow_queries/')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b'FROM books', response.data)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
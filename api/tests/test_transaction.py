@@ -2,9 +2,14 @@ import re
 import unittest
 from datetime import datetime
 
-from api.messages import STOCK_SHORTAGE
+from sqlalchemy import event
+
+from api.constants import MAX_ALLOWED_DUE
+from api.messages import CHECKOUT_CONFLICT, OVERDUE, STATUS_404, STOCK_SHORTAGE
 from api.models import Book, Transaction, User, db
+from api.pagination import encode_cursor
 from api.serializers import response_schema, transaction_schema
+from api.services import UserService
 from app import create_app
 
 
@@ -53,6 +58,14 @@ class TransactionResourceTest(unittest.TestCase):
         self.assertEqual(200, response.status_code)
         self.assertFalse(transaction_schema.validate(response.json))
 
+    def test_get_transaction_sparse_fields(self):
+        # When
+        response = self.client.get('/api/v1/transactions/1/?fields=rent')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['rent'], list(response.json))
+
     def test_get_transaction_404(self):
         # When
         response = self.client.get('/api/v1/transactions/2/')
@@ -69,6 +82,89 @@ class TransactionResourceTest(unittest.TestCase):
         self.assertEqual(1, len(response.json))
         self.assertFalse(transaction_schema.validate(response.json[0]))
 
+    def test_get_transactions_not_modified_until_return(self):
+        # Given
+        etag = self.client.get('/api/v1/transactions/').headers['ETag']
+
+        # When
+        unchanged = self.client.get('/api/v1/transactions/', headers={'If-None-Match': etag})
+        self.client.put('/api/v1/transactions/1/')
+        changed = self.client.get('/api/v1/transactions/', headers={'If-None-Match': etag})
+
+        # Then
+        self.assertEqual(304, unchanged.status_code)
+        self.assertEqual(200, changed.status_code)
+        self.assertIsNotNone(changed.json[0]['date_return'])
+
+    def test_get_transactions_expanded(self):
+        # Given
+        with self.app.app_context():
+            for _ in range(4):
+                db.session.add(Transaction(member=1, book=1, num_copies=1, rent=30))
+            db.session.commit()
+        self.client.get('/api/v1/transactions/')
+
+        def count_queries(url):
+            statements = []
+            with self.app.app_context():
+                engine = db.get_engine()
+                record = lambda *args: statements.append(args[2])
+                event.listen(engine, 'before_cursor_execute', record)
+                try:
+                    response = self.client.get(url)
+                finally:
+                    event.remove(engine, 'before_cursor_execute', record)
+            return response, len(statements)
+
+        # When
+        response, queries = count_queries('/api/v1/transactions/?expand=member,book&limit=5')
+        _, fewer_queries = count_queries('/api/v1/transactions/?expand=member,book&limit=2')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(5, len(response.json))
+        self.assertEqual('abc@example.com', response.json[0]['member']['email'])
+        self.assertEqual('Lean In', response.json[0]['book']['title'])
+        self.assertEqual(fewer_queries, queries)
+
+    def test_get_transaction_expanded(self):
+        # When
+        response = self.client.get('/api/v1/transactions/1/?expand=book&fields=id,book')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, response.json['id'])
+        self.assertEqual('/api/v1/books/1/', response.json['book']['url'])
+
+    def test_get_transactions_expand_unknown(self):
+        # When
+        response = self.client.get('/api/v1/transactions/?expand=rent')
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
+    def test_get_transactions_invalid_limit(self):
+        # When
+        response = self.client.get('/api/v1/transactions/?limit=0')
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
+    def test_get_transactions_nested_cursor(self):
+        # When
+        response = self.client.get(f'/api/v1/transactions/?after={encode_cursor([[1]])}')
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
+    def test_get_transactions_streamed_empty(self):
+        # When
+        response = self.client.get('/api/v1/transactions/?stream=json&after=WzFd')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], response.json)
+
     def test_post_transaction_201(self):
         # Given
         data = {
@@ -83,6 +179,7 @@ class TransactionResourceTest(unittest.TestCase):
         with self.app.app_context():
             book = Book.query.get(1)
             self.assertEqual(book.stock, 3)
+            self.assertEqual(book.rent_count, 2)
 
         # Then
         self.assertEqual(201, response.status_code)
@@ -107,6 +204,328 @@ class TransactionResourceTest(unittest.TestCase):
             book = Book.query.get(1)
             self.assertEqual(STOCK_SHORTAGE % book.stock, response.json['message'])
 
+    def test_post_transaction_bumps_versions_after_commit(self):
+        # Given
+        statements = []
+
+        def executed(connection, cursor, statement, *args):
+            statements.append(statement.split(' (')[0])
+
+        def committed(connection):
+            statements.append('COMMIT')
+
+        data = {"book": 1, "member": 1, "num_copies": 1}
+
+        # When
+        with self.app.app_context():
+            engine = db.get_engine()
+            event.listen(engine, 'before_cursor_execute', executed)
+            event.listen(engine, 'commit', committed)
+            try:
+                response = self.client.post('/api/v1/transactions/', json=data)
+            finally:
+                event.remove(engine, 'before_cursor_execute', executed)
+                event.remove(engine, 'commit', committed)
+
+        # Then
+        self.assertEqual(201, response.status_code)
+        bumps = [index for index, statement in enumerate(statements)
+                 if statement.startswith('UPDATE table_versions')]
+        self.assertEqual(3, len(bumps))
+        self.assertLess(statements.index('COMMIT'), bumps[0])
+        self.assertLess(statements.index('INSERT INTO transactions'), statements.index('COMMIT'))
+
+    def test_post_transaction_gives_up_after_retries(self):
+        # Given
+        def hide_stock(connection, cursor, statement, *args):
+            # The shelf looks empty to the update and full again afterwards.
+            if statement.startswith('UPDATE books SET stock='):
+                cursor.execute('UPDATE books SET stock = 0')
+
+        def restore_stock(connection, cursor, statement, *args):
+            if statement.startswith('UPDATE books SET stock='):
+                # A cursor of its own keeps the update's rowcount intact.
+                connection.connection.cursor().execute('UPDATE books SET stock = 5')
+
+        data = {"book": 1, "member": 1, "num_copies": 1}
+
+        # When
+        with self.app.app_context():
+            engine = db.get_engine()
+            event.listen(engine, 'before_cursor_execute', hide_stock)
+            event.listen(engine, 'after_cursor_execute', restore_stock)
+            try:
+                response = self.client.post('/api/v1/transactions/', json=data)
+            finally:
+                event.remove(engine, 'before_cursor_execute', hide_stock)
+                event.remove(engine, 'after_cursor_execute', restore_stock)
+
+            book = Book.query.get(1)
+
+        # Then
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(CHECKOUT_CONFLICT, response.json['message'])
+        self.assertEqual(5, book.stock)
+
+    def test_post_transaction_ignores_concurrent_version_moves(self):
+        # Given
+        def race(connection, cursor, statement, *args):
+            # Another write moves the book on just before the stock is taken.
+            if statement.startswith('UPDATE books SET stock='):
+                cursor.execute('UPDATE books SET version = version + 1')
+
+        data = {"book": 1, "member": 1, "num_copies": 1}
+
+        # When
+        with self.app.app_context():
+            engine = db.get_engine()
+            event.listen(engine, 'before_cursor_execute', race)
+            try:
+                response = self.client.post('/api/v1/transactions/', json=data)
+            finally:
+                event.remove(engine, 'before_cursor_execute', race)
+
+            book = Book.query.get(1)
+
+        # Then
+        self.assertEqual(201, response.status_code)
+        self.assertEqual((4, 3), (book.stock, book.version))
+
+    def test_post_transaction_404(self):
+        # Given
+        data = {
+            "book": 2,
+            "member": 1,
+            "num_copies": 1,
+        }
+
+        # When
+        response = self.client.post('/api/v1/transactions/', json=data)
+
+        # Then
+        self.assertEqual(404, response.status_code)
+
+    def test_post_transaction_negative_copies(self):
+        # Given
+        data = {
+            "book": 1,
+            "member": 1,
+            "num_copies": -2,
+        }
+
+        # When
+        response = self.client.post('/api/v1/transactions/', json=data)
+
+        # Then
+        self.assertEqual(400, response.status_code)
+        self.assertIn('num_copies', response.json['message'])
+
+        with self.app.app_context():
+            self.assertEqual(5, Book.query.get(1).stock)
+            self.assertEqual(0, User.query.get(1).outstanding_due)
+
+    def test_post_transaction_zero_copies(self):
+        # Given
+        data = {
+            "book": 1,
+            "member": 1,
+            "num_copies": 0,
+        }
+
+        # When
+        response = self.client.post('/api/v1/transactions/', json=data)
+
+        # Then
+        self.assertEqual(400, response.status_code)
+        self.assertIn('num_copies', response.json['message'])
+
+    def test_post_transaction_missing_copies(self):
+        # Given
+        data = {
+            "book": 1,
+            "member": 1,
+        }
+
+        # When
+        response = self.client.post('/api/v1/transactions/', json=data)
+
+        # Then
+        self.assertEqual(400, response.status_code)
+        self.assertIn('num_copies', response.json['message'])
+
+    def test_post_transaction_overdue(self):
+        # Given
+        with self.app.app_context():
+            User.query.filter_by(id=1).update({'outstanding_due': MAX_ALLOWED_DUE + 1})
+            db.session.commit()
+
+        data = {
+            "book": 1,
+            "member": 1,
+            "num_copies": 1,
+        }
+
+        # When
+        response = self.client.post('/api/v1/transactions/', json=data)
+
+        # Then
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(OVERDUE, response.json['message'])
+
+        with self.app.app_context():
+            self.assertEqual(5, Book.query.get(1).stock)
+
+    def test_transaction_dues_balance(self):
+        # Given
+        data = {
+            "book": 1,
+            "member": 1,
+            "num_copies": 1,
+        }
+
+        # When
+        response = self.client.post('/api/v1/transactions/', json=data)
+
+        # Then
+        with self.app.app_context():
+            self.assertEqual(30, User.query.get(1).outstanding_due)
+
+        # When
+        self.client.put(response.json['url'])
+
+        # Then
+        with self.app.app_context():
+            self.assertEqual(0, User.query.get(1).outstanding_due)
+
+    def test_reconcile_dues(self):
+        with self.app.app_context():
+            # When
+            mismatches = UserService().reconcile_dues(fix=True)
+
+            # Then
+            self.assertEqual([(1, 0, 60)], mismatches)
+            self.assertEqual(60, User.query.get(1).outstanding_due)
+            self.assertEqual([], UserService().reconcile_dues())
+
+    def test_batch_checkout_201(self):
+        # Given
+        with self.app.app_context():
+            db.session.add(Book(title='Your Brain at Work', isbn='0385359949',
+                                author='David Rock', stock=8, price=40))
+            db.session.commit()
+
+        data = {'member': 1, 'items': [{'book': 2, 'num_copies': 1}, {'book': 1, 'num_copies': 2}]}
+
+        # When
+        response = self.client.post('/api/v1/transactions/batch/', json=data)
+
+        # Then
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(['/api/v1/transactions/2/', '/api/v1/transactions/3/'],
+                         [result['url'] for result in response.json])
+
+        with self.app.app_context():
+            self.assertEqual([3, 7], [book.stock for book in Book.query.order_by(Book.id)])
+            self.assertEqual(40 + 60, User.query.get(1).outstanding_due)
+
+    def test_batch_checkout_409(self):
+        # Given
+        data = {'member': 1, 'items': [{'book': 1, 'num_copies': 3}, {'book': 1, 'num_copies': 3}]}
+
+        # When
+        response = self.client.post('/api/v1/transactions/batch/', json=data)
+
+        # Then
+        self.assertEqual(409, response.status_code)
+        self.assertEqual([STOCK_SHORTAGE % 5] * 2, [result['error'] for result in response.json])
+
+        with self.app.app_context():
+            self.assertEqual(5, Book.query.get(1).stock)
+            self.assertEqual(0, User.query.get(1).outstanding_due)
+            self.assertEqual(1, Transaction.query.count())
+
+    def test_batch_checkout_404(self):
+        # Given
+        data = {'member': 1, 'items': [{'book': 1, 'num_copies': 1}, {'book': 9, 'num_copies': 1}]}
+
+        # When
+        response = self.client.post('/api/v1/transactions/batch/', json=data)
+
+        # Then
+        self.assertEqual(404, response.status_code)
+        self.assertNotIn('error', response.json[0])
+        self.assertEqual(STATUS_404, response.json[1]['error'])
+
+    def test_batch_checkout_unknown_member(self):
+        # Given
+        data = {'member': 9, 'items': [{'book': 1, 'num_copies': 1}, {'book': 1, 'num_copies': 2}]}
+
+        # When
+        response = self.client.post('/api/v1/transactions/batch/', json=data)
+
+        # Then
+        self.assertEqual(404, response.status_code)
+        self.assertEqual([{'book': 1, 'num_copies': 1, 'error': STATUS_404},
+                          {'book': 1, 'num_copies': 2, 'error': STATUS_404}], response.json)
+
+        with self.app.app_context():
+            self.assertEqual(5, Book.query.get(1).stock)
+
+    def test_batch_checkout_overdue(self):
+        # Given
+        with self.app.app_context():
+            User.query.filter_by(id=1).update({'outstanding_due': MAX_ALLOWED_DUE + 1})
+            db.session.commit()
+
+        data = {'member': 1, 'items': [{'book': 1, 'num_copies': 1}, {'book': 1, 'num_copies': 2}]}
+
+        # When
+        response = self.client.post('/api/v1/transactions/batch/', json=data)
+
+        # Then
+        self.assertEqual(409, response.status_code)
+        self.assertEqual([{'book': 1, 'num_copies': 1, 'error': OVERDUE},
+                          {'book': 1, 'num_copies': 2, 'error': OVERDUE}], response.json)
+
+        with self.app.app_context():
+            self.assertEqual(5, Book.query.get(1).stock)
+            self.assertEqual(1, Transaction.query.count())
+
+    def test_batch_checkout_400(self):
+        # When
+        response = self.client.post('/api/v1/transactions/batch/', json={'member': 1, 'items': []})
+
+        # Then
+        self.assertEqual(400, response.status_code)
+
+    def test_batch_return_200(self):
+        # Given
+        self.client.post('/api/v1/transactions/', json={'member': 1, 'book': 1, 'num_copies': 1})
+
+        # When
+        response = self.client.put('/api/v1/transactions/batch/', json={'transactions': [2]})
+        again = self.client.put('/api/v1/transactions/batch/', json={'transactions': [2]})
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([True], [result['returned'] for result in response.json])
+        self.assertEqual([False], [result['returned'] for result in again.json])
+
+        with self.app.app_context():
+            self.assertEqual(5, Book.query.get(1).stock)
+            self.assertEqual(0, User.query.get(1).outstanding_due)
+
+    def test_batch_return_404(self):
+        # When
+        response = self.client.put('/api/v1/transactions/batch/', json={'transactions': [1, 5]})
+
+        # Then
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(STATUS_404, response.json[1]['error'])
+
+        with self.app.app_context():
+            self.assertIsNone(Transaction.query.get(1).date_return)
+
     def test_put_transaction_204(self):
         # When
         response = self.client.put(f'/api/v1/transactions/1/')
@@ -119,6 +538,32 @@ class TransactionResourceTest(unittest.TestCase):
             self.assertEqual(transaction.date_return.date(),
                              datetime.now().today().date())
 
+    def test_put_transaction_twice_restocks_once(self):
+        # When
+        self.client.put(f'/api/v1/transactions/1/')
+        response = self.client.put(f'/api/v1/transactions/1/')
+
+        # Then
+        self.assertEqual(204, response.status_code)
+
+        with self.app.app_context():
+            book = Book.query.get(1)
+            self.assertEqual(7, book.stock)
+
+    def test_put_transaction_if_match_412(self):
+        # Given
+        etag = self.client.get('/api/v1/transactions/1/').headers['ETag']
+        self.client.put('/api/v1/transactions/1/')
+
+        # When
+        response = self.client.put('/api/v1/transactions/1/', headers={'If-Match': etag})
+
+        # Then
+        self.assertEqual(412, response.status_code)
+
+        with self.app.app_context():
+            self.assertEqual(7, Book.query.get(1).stock)
+
     def test_put_transaction_404(self):
         # When
         response = self.client.put(f'/api/v1/transactions/2/')
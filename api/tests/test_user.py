@@ -1,7 +1,7 @@
 import re
 import unittest
 
-from api.models import User, db
+from api.models import Transaction, User, db
 from api.serializers import response_schema, user_schema
 from app import create_app
 
@@ -49,6 +49,49 @@ class UserResourceTest(unittest.TestCase):
         self.assertEqual(1, len(response.json))
         self.assertFalse(user_schema.validate(response.json[0]))
 
+    def test_get_users_sparse_fields(self):
+        # When
+        response = self.client.get('/api/v1/users/highest_paying/?fields=email')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([['email']], [list(user) for user in response.json])
+
+    def test_get_users_by_ids(self):
+        # When
+        response = self.client.get('/api/v1/users/?ids=3,1')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.json[0])
+        self.assertEqual('/api/v1/users/1/', response.json[1]['url'])
+
+    def test_get_highest_paying_users(self):
+        # When
+        response = self.client.get('/api/v1/users/highest_paying/?limit=1')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.json))
+        self.assertNotIn('Link', response.headers)
+
+    def test_get_highest_paying_users_ranked(self):
+        # Given
+        other_worker = create_app('config.TestingConfig').test_client()
+        other_worker.get('/api/v1/users/highest_paying/')
+
+        with self.app.app_context():
+            db.session.add(User(first_name='Second', contact='1234567890'))
+            db.session.add(Transaction(member=2, book=1, num_copies=1, rent=90))
+            db.session.commit()
+
+        # When
+        response = other_worker.get('/api/v1/users/highest_paying/')
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([2, 1], [user['id'] for user in response.json])
+
     def test_post_user_201(self):
         # Given
         data = {
@@ -115,6 +158,30 @@ class UserResourceTest(unittest.TestCase):
         # Then
         self.assertEqual(204, response.status_code)
 
+    def test_put_user_incomplete_new_400(self):
+        # When
+        response = self.client.put('/api/v1/users/2/', json={'last_name': 'Author'})
+
+        # Then
+        self.assertEqual(400, response.status_code)
+        self.assertIn('first_name', response.json['message'])
+
+    def test_put_users(self):
+        # Given
+        data = [
+            {'id': 1, 'contact': '9012345678'},
+            {'id': 2, 'first_name': 'Some', 'contact': '1234567890'},
+        ]
+
+        # When
+        response = self.client.put('/api/v1/users/', json=data)
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([False, True], [result['created'] for result in response.json])
+        self.assertEqual('9012345678', self.client.get('/api/v1/users/1/').json['contact'])
+        self.assertEqual('Some', self.client.get('/api/v1/users/2/').json['first_name'])
+
     def test_put_user_201(self):
         # Given
         data = {
@@ -0,0 +1,13 @@
+from flask_admin import BaseView, expose
+
+from api.models import db
+
+
+class PoolView(BaseView):
+    '''
+    Connection pools of the primary and replicas in this worker, with their
+    checkout waits.
+    '''
+    @expose('/')
+    def index(self):
+        return self.render('admin/pool.html', pools=db.pool_stats())
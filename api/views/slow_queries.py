@@ -0,0 +1,20 @@
+from flask_admin import BaseView, expose
+
+from api.slowlog import slow_queries
+
+
+class SlowQueryView(BaseView):
+    '''
+    Statements recorded by the slow query log, grouped by fingerprint with
+    their captured plans.
+    '''
+    @expose('/')
+    def index(self):
+        log = slow_queries.log
+        return self.render('admin/slow_queries.html',
+                           summaries=log.summaries(), recent=log.recent())
+
+    @expose('/clear/', methods=('POST', ))
+    def clear(self):
+        slow_queries.log.clear()
+        return self.index()
@@ -3,8 +3,13 @@ import os
 from flask import Flask
 
 from api.api import api, docs
+from api.cache import entity_cache
+from api.metrics import metrics
 from api.models import db
+from api.routing import replicas
+from api.search import search_index
 from api.serializers import ma
+from api.slowlog import slow_queries
 
 app = Flask(__name__,
             static_url_path='/static',
@@ -12,8 +17,13 @@ app = Flask(__name__,
 app.config.from_object(os.environ['APP_SETTINGS'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 api.init_app(app)
+metrics.init_app(app)
+slow_queries.init_app(app)
 db.init_app(app)
+replicas.init_app(app)
 ma.init_app(app)
+search_index.init_app(app)
+entity_cache.init_app(app)
 docs.init_app(app)
 
 
@@ -24,7 +34,12 @@ def create_app(config_name):
     app.config.from_object(config_name)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     api.init_app(app)
+    metrics.init_app(app)
+    slow_queries.init_app(app)
     db.init_app(app)
+    replicas.init_app(app)
     ma.init_app(app)
+    search_index.init_app(app)
+    entity_cache.init_app(app)
 
     return app
@@ -0,0 +1,131 @@
+'''
+Concurrent checkout stress test.
+
+Many threads check out and return copies of one hot title at the same time.
+Afterwards the shelf must balance: the remaining stock plus the copies still
+rented out equals the starting stock, and stock never went negative.
+
+    APP_SETTINGS=config.TestingConfig python -m benchmarks.checkout_stress \
+        --threads 16 --checkouts 200 --stock 8
+
+Uses a throwaway SQLite file unless --database-url is given.
+'''
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy.exc import OperationalError
+
+from api.models import Book, Transaction, User, db
+from api.services import TransactionService
+from app import create_app
+
+
+def setup(app, threads, stock):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        db.session.add(Book(title='Hot Title', isbn='0000000001', author='Someone',
+                            stock=stock, price=1))
+        for number in range(threads):
+            db.session.add(User(first_name=f'Member {number}', contact='0000000000'))
+        db.session.commit()
+
+
+def member_loop(app, member_id, checkouts, outcomes, latencies):
+    service = TransactionService()
+
+    with app.app_context():
+        for attempt in range(checkouts):
+            started = time.perf_counter()
+            try:
+                transaction_id = service.add_transaction({'book': 1, 'member': member_id,
+                                                          'num_copies': 1}).id
+            except ValueError as e:
+                outcomes[e.args[0]] += 1
+                continue
+            except OperationalError:
+                db.session.rollback()
+                outcomes['database busy'] += 1
+                continue
+            finally:
+                latencies.append(time.perf_counter() - started)
+                db.session.remove()
+
+            outcomes['checked out'] += 1
+
+            # Return all but the last rental so stock keeps moving both ways.
+            if attempt < checkouts - 1:
+                service.update_transaction(transaction_id)
+                db.session.remove()
+
+
+def run(app, threads, checkouts, stock):
+    setup(app, threads, stock)
+
+    # Each thread records into its own counter and list, summed once joined.
+    outcomes = [Counter() for _ in range(threads)]
+    latencies = [[] for _ in range(threads)]
+    workers = [threading.Thread(target=member_loop,
+                                args=(app, member_id, checkouts, outcomes[member_id - 1],
+                                      latencies[member_id - 1]))
+               for member_id in range(1, threads + 1)]
+
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    outcomes = sum(outcomes, Counter())
+    latencies = [latency for thread_latencies in latencies for latency in thread_latencies]
+
+    with app.app_context():
+        final_stock = db.session.query(Book.stock).filter_by(id=1).scalar()
+        rented = db.session.query(db.func.coalesce(db.func.sum(Transaction.num_copies), 0))\
+                   .filter(Transaction.date_return.is_(None)).scalar()
+
+    latencies.sort()
+    attempts = threads * checkouts
+    print(f'{attempts} checkout attempts by {threads} threads in {elapsed:.2f}s '
+          f'({attempts / elapsed:.0f} attempts/s, '
+          f"{outcomes['checked out'] / elapsed:.0f} checkouts/s)")
+    print(f'latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms')
+    for outcome, count in sorted(outcomes.items()):
+        print(f'  {outcome}: {count}')
+    print(f'stock {final_stock} + rented {rented} = {final_stock + rented} (started with {stock})')
+
+    balanced = final_stock >= 0 and final_stock + rented == stock
+    print('no lost updates' if balanced else 'LOST UPDATES')
+    return balanced
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--checkouts', type=int, default=100,
+                        help='checkout attempts per thread')
+    parser.add_argument('--stock', type=int, default=8)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'checkout_stress.db')
+
+    app = create_app(os.environ.get('APP_SETTINGS', 'config.TestingConfig'))
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    if database_url.startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+
+    if not run(app, args.threads, args.checkouts, args.stock):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
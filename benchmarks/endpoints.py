@@ -0,0 +1,380 @@
+'''
+End-to-end latency and throughput of every API endpoint.
+
+Generates a synthetic library, then drives each endpoint in `api/api.py`
+through the Flask test client and through a local WSGI server, reporting
+p50/p95/p99 latency and requests per second. Results are saved as JSON;
+pass an earlier results file with --compare to flag p95 regressions.
+
+    APP_SETTINGS=config.TestingConfig python -m benchmarks.endpoints \
+        --transactions 100000 --requests 200 --output results.json
+    APP_SETTINGS=config.TestingConfig python -m benchmarks.endpoints \
+        --transactions 100000 --requests 200 --compare results.json
+
+Uses a throwaway SQLite file unless --database-url is given.
+'''
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from api.dataset import generate
+from api.models import Book, Transaction, User, db
+from api.search import search_index
+from app import create_app
+
+SERVERS = ('client', 'wsgi')
+
+
+class Scenario():
+    '''
+    One endpoint and method. `build(state, rng)` returns the path, JSON body
+    and headers of the next request; `done(state, body)` sees its response.
+    '''
+    def __init__(self, name, method, build, done=None):
+        self.name = name
+        self.method = method
+        self.build = build
+        self.done = done
+
+
+def created_id(body):
+    return int(json.loads(body)['url'].rstrip('/').rsplit('/', 1)[1])
+
+
+def take(ids, rng):
+    return ids.pop(rng.randrange(len(ids))) if ids else 0
+
+
+def book_json(state, rng):
+    state['isbn'] += 1
+    return {'title': 'Benchmark Title', 'author': 'Bench Mark',
+            'isbn': str(state['isbn']), 'stock': 5, 'price': 20}
+
+
+def user_json(state, rng):
+    state['email'] += 1
+    return {'first_name': 'Bench', 'last_name': 'Mark', 'contact': '1234567890',
+            'email': f"bench{state['email']}@example.com"}
+
+
+def import_body(state, rng):
+    lines = [json.dumps(book_json(state, rng)) for _ in range(10)]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+SCENARIOS = [
+    Scenario('GET book', 'GET',
+             lambda state, rng: (f"/api/v1/books/{rng.randint(1, state['books'])}/", None, {})),
+    Scenario('GET books', 'GET',
+             lambda state, rng: ('/api/v1/books/?limit=20', None, {})),
+    Scenario('GET books by ids', 'GET',
+             lambda state, rng: ('/api/v1/books/?ids=' + ','.join(
+                 str(rng.randint(1, state['books'])) for _ in range(10)), None, {})),
+    Scenario('GET popular books', 'GET',
+             lambda state, rng: ('/api/v1/books/popular/?limit=20', None, {})),
+    Scenario('GET book search', 'GET',
+              lambda state, rng: ('/api/v1/books/search/?title='
+                                 + rng.choice(('atlas', 'riv', 'time')), None, {})),
+    Scenario('GET books stream', 'GET',
+             lambda state, rng: ('/api/v1/books/?stream=ndjson&limit=500&fields=id,title',
+                                 None, {})),
+    Scenario('POST book', 'POST',
+             lambda state, rng: ('/api/v1/books/', book_json(state, rng), {}),
+             lambda state, body: state['new_books'].append(created_id(body))),
+    Scenario('PUT book', 'PUT',
+             lambda state, rng: (f"/api/v1/books/{rng.randint(1, state['books'])}/",
+                                 {'stock': rng.randint(1, 10)}, {})),
+    Scenario('DELETE book', 'DELETE',
+             lambda state, rng: (f"/api/v1/books/{take(state['new_books'], rng)}/", None, {})),
+    Scenario('PUT books bulk', 'PUT',
+             lambda state, rng: ('/api/v1/books/', [{'id': book_id, 'stock': rng.randint(1, 10)}
+                                                    for book_id in rng.sample(
+                                                        range(1, state['books'] + 1), 10)], {})),
+    Scenario('POST books bulk', 'POST',
+             lambda state, rng: ('/api/v1/books/bulk/', import_body(state, rng),
+                                 {'Content-Type': 'application/x-ndjson'})),
+    Scenario('GET user', 'GET',
+             lambda state, rng: (f"/api/v1/users/{rng.randint(1, state['users'])}/", None, {})),
+    Scenario('GET users', 'GET',
+             lambda state, rng: ('/api/v1/users/?limit=20', None, {})),
+    Scenario('GET highest paying users', 'GET',
+             lambda state, rng: ('/api/v1/users/highest_paying/?limit=20', None, {})),
+    Scenario('POST user', 'POST',
+             lambda state, rng: ('/api/v1/users/', user_json(state, rng), {}),
+             lambda state, body: state['new_users'].append(created_id(body))),
+    Scenario('PUT user', 'PUT',
+             lambda state, rng: (f"/api/v1/users/{rng.randint(1, state['users'])}/",
+                                 {'contact': '0987654321'}, {})),
+    Scenario('PUT users bulk', 'PUT',
+             lambda state, rng: ('/api/v1/users/', [{'id': user_id, 'contact': '0987654321'}
+                                                    for user_id in rng.sample(
+                                                        range(1, state['users'] + 1), 10)], {})),
+    Scenario('DELETE user', 'DELETE',
+             lambda state, rng: (f"/api/v1/users/{take(state['new_users'], rng)}/", None, {})),
+    Scenario('GET transaction', 'GET',
+             lambda state, rng: (f"/api/v1/transactions/{rng.randint(1, state['transactions'])}/",
+                                 None, {})),
+    Scenario('GET transactions', 'GET',
+             lambda state, rng: ('/api/v1/transactions/?limit=20', None, {})),
+    Scenario('GET transactions expanded', 'GET',
+             lambda state, rng: ('/api/v1/transactions/?limit=20&expand=member,book', None, {})),
+    Scenario('POST transaction', 'POST',
+             lambda state, rng: ('/api/v1/transactions/',
+                                 {'member': take(state['members'], rng),
+                                  'book': rng.choice(state['in_stock']), 'num_copies': 1}, {}),
+             lambda state, body: state['open'].append(created_id(body))),
+    Scenario('PUT transaction', 'PUT',
+             lambda state, rng: (f"/api/v1/transactions/{take(state['open'], rng)}/", None, {})),
+    Scenario('POST transactions batch', 'POST',
+             lambda state, rng: ('/api/v1/transactions/batch/',
+                                 {'member': take(state['members'], rng),
+                                  'items': [{'book': book, 'num_copies': 1}
+                                            for book in rng.sample(state['in_stock'], 3)]}, {}),
+             lambda state, body: state['open'].extend(
+                 created_id(json.dumps(result)) for result in json.loads(body))),
+    Scenario('PUT transactions batch', 'PUT',
+             lambda state, rng: ('/api/v1/transactions/batch/',
+                                 {'transactions': [take(state['open'], rng)
+                                                   for _ in range(3)]}, {})),
+    Scenario('GET cache stats', 'GET',
+             lambda state, rng: ('/api/v1/cache/', None, {})),
+    Scenario('GET pool stats', 'GET',
+             lambda state, rng: ('/api/v1/pool/', None, {})),
+    Scenario('GET changes', 'GET',
+             lambda state, rng: ('/api/v1/changes/?limit=50', None, {})),
+]
+
+
+class ClientDriver():
+    def __init__(self, app):
+        self.local = threading.local()
+        self.app = app
+
+    def close(self):
+        pass
+
+    def request(self, method, path, body, headers):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+
+        kwargs = {'data': body} if isinstance(body, bytes) else {'json': body}
+        response = client.open(path, method=method, headers=headers, **kwargs)
+        return response.status_code, response.get_data()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class WSGIDriver():
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True,
+                                  request_handler=QuietRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+
+    def request(self, method, path, body, headers):
+        if body is not None and not isinstance(body, bytes):
+            body, headers = json.dumps(body).encode(), dict(headers,
+                                                           **{'Content-Type': 'application/json'})
+
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_port)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+
+def percentile(latencies, fraction):
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+def run_scenario(driver, scenario, state, requests, concurrency, seed):
+    lock = threading.Lock()
+    latencies, errors = [], []
+
+    def worker(number):
+        rng = random.Random(f'{seed}-{scenario.name}-{number}')
+        for _ in range(number, requests, concurrency):
+            with lock:
+                path, body, headers = scenario.build(state, rng)
+
+            started = time.perf_counter()
+            status, content = driver.request(scenario.method, path, body, headers)
+            elapsed = time.perf_counter() - started
+
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors.append(status)
+                elif scenario.done:
+                    scenario.done(state, content)
+
+    workers = [threading.Thread(target=worker, args=(number, ))
+               for number in range(concurrency)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'scenario': scenario.name,
+        'requests': requests,
+        'errors': len(errors),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+    }
+
+
+def setup(app, transactions, users, books):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        generate(db.session.connection(), users, books, transactions)
+        db.session.commit()
+        search_index.reindex()
+
+        return {
+            'books': books, 'users': users, 'transactions': transactions,
+            'in_stock': [book_id for book_id, in
+                         db.session.query(Book.id).filter(Book.stock >= 5)],
+            'members': [user_id for user_id, in
+                        db.session.query(User.id).filter(User.outstanding_due == 0)],
+            'open': [transaction_id for transaction_id, in
+                     db.session.query(Transaction.id).filter(Transaction.date_return.is_(None))],
+            'new_books': [], 'new_users': [],
+            'isbn': 9790000000000, 'email': 0,
+        }
+
+
+def compare(meta, results, baseline, threshold):
+    '''
+    Print the change in p95 against `baseline` and return the regressions.
+    '''
+    previous = {(result['server'], result['scenario']): result for result in baseline['results']}
+    regressions = []
+
+    print(f"\np95 against {baseline['meta']['date']}")
+    for setting in ('database', 'transactions', 'requests', 'concurrency'):
+        if baseline['meta'].get(setting) != meta[setting]:
+            print(f"  note: {setting} differs ({baseline['meta'].get(setting)} "
+                  f"then, {meta[setting]} now)")
+    for result in results:
+        before = previous.get((result['server'], result['scenario']))
+        if not before or not before['p95_ms']:
+            continue
+
+        change = result['p95_ms'] / before['p95_ms'] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(result)
+        print(f"{result['server']:6} {result['scenario']:28} {before['p95_ms']:>9.2f}ms "
+              f"-> {result['p95_ms']:>9.2f}ms {change:>+7.1%}{'  REGRESSION' if regressed else ''}")
+
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--books', type=int)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--server', choices=SERVERS + ('both', ), default='both')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='p95 slowdown counted as a regression (default 0.2 = 20%%)')
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'endpoints.db')
+
+    app = create_app(os.environ.get('APP_SETTINGS', 'config.TestingConfig'))
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['DEBUG'] = app.config['TESTING'] = False
+    if database_url.startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30,
+                                                                    'check_same_thread': False}}
+
+    users = args.users or max(args.transactions // 10, 1)
+    books = args.books or max(args.transactions // 20, 1)
+    started = time.perf_counter()
+    state = setup(app, args.transactions, users, books)
+    print(f'generated {args.transactions} rentals in {time.perf_counter() - started:.1f}s')
+
+    results = []
+    servers = SERVERS if args.server == 'both' else (args.server, )
+    for server in servers:
+        driver = ClientDriver(app) if server == 'client' else WSGIDriver(app)
+        try:
+            print(f'\n{server:6} {"endpoint":28} {"p50":>9} {"p95":>9} {"p99":>9} '
+                  f'{"req/s":>8} errors')
+            for scenario in SCENARIOS:
+                result = dict(run_scenario(driver, scenario, state, args.requests,
+                                           args.concurrency, args.seed), server=server)
+                results.append(result)
+                print(f"{server:6} {scenario.name:28} {result['p50_ms']:>7.2f}ms "
+                      f"{result['p95_ms']:>7.2f}ms {result['p99_ms']:>7.2f}ms "
+                      f"{result['throughput_rps']:>8.1f} {result['errors']}")
+        finally:
+            driver.close()
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+            'transactions': args.transactions, 'users': users, 'books': books,
+            'requests': args.requests, 'concurrency': args.concurrency,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            if compare(report['meta'], results, json.load(baseline), args.threshold):
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
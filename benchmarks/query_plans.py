@@ -0,0 +1,140 @@
+'''
+Query plans and timings of the transaction hot paths, before and after the
+transaction indexes.
+
+Loads members, books and rentals (a tenth of them still open), drops the
+indexes declared on `transactions`, then explains and times each query,
+creates the indexes and does it again.
+
+    APP_SETTINGS=config.TestingConfig python -m benchmarks.query_plans \
+        --transactions 1000000 --members 20000 --books 10000
+
+Uses a throwaway SQLite file unless --database-url is given.
+'''
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from api.models import Book, Transaction, User, db
+from api.slowlog import EXPLAIN
+from app import create_app
+
+CHUNK_SIZE = 50000
+
+QUERIES = {
+    'open rentals of a member':
+        'SELECT count(*), coalesce(sum(rent), 0) FROM transactions '
+        'WHERE member = :member AND date_return IS NULL',
+    'dues of every member':
+        'SELECT member, sum(rent) FROM transactions '
+        'WHERE date_return IS NULL GROUP BY member',
+    'rent total of a member':
+        'SELECT coalesce(sum(rent), 0) FROM transactions WHERE member = :member',
+    'rentals of a book':
+        'SELECT count(id) FROM transactions WHERE book = :book',
+}
+
+
+def setup(app, transactions, members, books):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        connection = db.session.connection()
+
+        connection.execute(User.__table__.insert(), [
+            {'first_name': f'Member {number}', 'contact': '0000000000'}
+            for number in range(members)])
+        connection.execute(Book.__table__.insert(), [
+            {'title': f'Title {number}', 'isbn': str(number).zfill(13),
+             'author': f'Author {number % 997}', 'stock': 5, 'price': 30}
+            for number in range(books)])
+
+        for index in Transaction.__table__.indexes:
+            index.drop(connection)
+
+        rng = random.Random(0)
+        started = datetime(2020, 1, 1)
+        for offset in range(0, transactions, CHUNK_SIZE):
+            rows = []
+            for number in range(offset, min(offset + CHUNK_SIZE, transactions)):
+                rented = started + timedelta(minutes=number)
+                rows.append({
+                    'member': rng.randint(1, members), 'book': rng.randint(1, books),
+                    'num_copies': 1, 'rent': 30, 'date_rented': rented,
+                    'date_return': None if rng.random() < 0.1 else rented + timedelta(days=7),
+                })
+            connection.execute(Transaction.__table__.insert(), rows)
+        connection.execute(text('ANALYZE'))
+        db.session.commit()
+
+
+def measure(app, repeat, members, books):
+    rng = random.Random(1)
+    with app.app_context():
+        connection = db.session.connection()
+        prefix = EXPLAIN.get(connection.dialect.name)
+
+        for name, statement in QUERIES.items():
+            params = {'member': rng.randint(1, members), 'book': rng.randint(1, books)}
+
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                connection.execute(text(statement), params).fetchall()
+                timings.append(time.perf_counter() - started)
+
+            print(f'{name}: median {statistics.median(timings) * 1000:.2f}ms '
+                  f'min {min(timings) * 1000:.2f}ms')
+            if prefix:
+                for row in connection.execute(text(prefix + statement), params):
+                    print('    ' + ' '.join(str(value) for value in row))
+        db.session.remove()
+
+
+def create_indexes(app):
+    with app.app_context():
+        connection = db.session.connection()
+        started = time.perf_counter()
+        for index in Transaction.__table__.indexes:
+            index.create(connection)
+        connection.execute(text('ANALYZE'))
+        db.session.commit()
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--members', type=int, default=20000)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'query_plans.db')
+
+    app = create_app(os.environ.get('APP_SETTINGS', 'config.TestingConfig'))
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+
+    started = time.perf_counter()
+    setup(app, args.transactions, args.members, args.books)
+    print(f'loaded {args.transactions} transactions in {time.perf_counter() - started:.1f}s')
+
+    print('\nwithout transaction indexes')
+    measure(app, args.repeat, args.members, args.books)
+
+    print(f'\ncreated transaction indexes in {create_indexes(app):.1f}s\n')
+    print('with transaction indexes')
+    measure(app, args.repeat, args.members, args.books)
+
+
+if __name__ == '__main__':
+    main()
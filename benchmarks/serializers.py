@@ -0,0 +1,69 @@
+'''
+Compiled dumpers against marshmallow's own Schema.dump.
+
+Serializes the same list of books, members and rentals both ways, checks
+the JSON is byte identical and reports rows per second.
+
+    APP_SETTINGS=config.TestingConfig python -m benchmarks.serializers --rows 10000
+'''
+import argparse
+import os
+import timeit
+from datetime import datetime
+
+from flask import json
+from marshmallow import Schema
+
+from api.models import Book, Transaction, User
+from api.serializers import BookSchema, TransactionSchema, UserSchema
+from app import create_app
+
+
+def make_rows(count):
+    books, users, transactions = [], [], []
+    for number in range(1, count + 1):
+        book = Book(title=f'Title {number}', isbn=str(number).zfill(13),
+                    author=f'Author {number % 97}', stock=number % 7, price=30)
+        book.id = number
+        books.append(book)
+
+        user = User(first_name=f'First {number}', last_name='Last',
+                    contact='1234567890', email=f'member{number}@example.com')
+        user.id = number
+        users.append(user)
+
+        transaction = Transaction(member=number, book=number, num_copies=1, rent=30,
+                                  date_rented=datetime(2021, 4, 1, 10, 30))
+        transaction.id = number
+        transactions.append(transaction)
+
+    return {BookSchema: books, UserSchema: users, TransactionSchema: transactions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app(os.environ.get('APP_SETTINGS', 'config.TestingConfig'))
+
+    with app.test_request_context('/'):
+        for schema_class, rows in make_rows(args.rows).items():
+            schema = schema_class(many=True)
+            if json.dumps(Schema.dump(schema, rows)) != json.dumps(schema.dump(rows)):
+                raise SystemExit(f'{schema_class.__name__}: compiled output differs')
+
+            marshmallow = min(timeit.repeat(lambda: Schema.dump(schema, rows),
+                                            number=1, repeat=args.repeat))
+            compiled = min(timeit.repeat(lambda: schema.dump(rows),
+                                         number=1, repeat=args.repeat))
+
+            print(f'{schema_class.__name__:18} '
+                  f'marshmallow {args.rows / marshmallow:>10.0f} rows/s  '
+                  f'compiled {args.rows / compiled:>10.0f} rows/s  '
+                  f'{marshmallow / compiled:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
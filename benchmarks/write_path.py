@@ -0,0 +1,69 @@
+'''
+Request parsing on the write path: validate then load against one load.
+
+Parses the same book, member and rental payloads the way writes used to,
+`schema.validate` in the decorator followed by `schema.load` in the
+service, and in the single pass `load_request_data` now makes, and reports
+payloads per second.
+
+    APP_SETTINGS=config.TestingConfig python -m benchmarks.write_path --payloads 10000
+'''
+import argparse
+import os
+import timeit
+
+from api.serializers import BookSchema, TransactionSchema, UserSchema
+from app import create_app
+
+
+def make_payloads(count):
+    books, users, transactions = [], [], []
+    for number in range(1, count + 1):
+        books.append({'title': f'Title {number}', 'isbn': str(number).zfill(13),
+                      'author': f'Author {number % 97}', 'stock': number % 7, 'price': 30})
+        users.append({'first_name': f'First {number}', 'last_name': 'Last',
+                      'contact': '1234567890', 'email': f'member{number}@example.com'})
+        transactions.append({'member': number, 'book': number, 'num_copies': 1})
+
+    # Each write as the resource receives it: (schema, partial, payloads).
+    return {
+        'POST book': (BookSchema(), False, books),
+        'POST user': (UserSchema(), False, users),
+        'POST transaction': (TransactionSchema(), True, transactions),
+    }
+
+
+def validate_then_load(schema, partial, payloads):
+    for payload in payloads:
+        if not schema.validate(payload, partial=partial):
+            schema.load(payload, partial=partial)
+
+
+def load_once(schema, partial, payloads):
+    for payload in payloads:
+        schema.load(payload, partial=partial)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--payloads', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app(os.environ.get('APP_SETTINGS', 'config.TestingConfig'))
+
+    with app.test_request_context('/'):
+        for name, (schema, partial, payloads) in make_payloads(args.payloads).items():
+            before = min(timeit.repeat(lambda: validate_then_load(schema, partial, payloads),
+                                       number=1, repeat=args.repeat))
+            after = min(timeit.repeat(lambda: load_once(schema, partial, payloads),
+                                      number=1, repeat=args.repeat))
+
+            print(f'{name:18} '
+                  f'validate+load {args.payloads / before:>9.0f}/s  '
+                  f'load {args.payloads / after:>9.0f}/s  '
+                  f'{(1 - after / before) * 100:.0f}% less CPU')
+
+
+if __name__ == '__main__':
+    main()
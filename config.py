@@ -12,6 +12,18 @@ class Config(object):
     CSRF_ENABLED = True
     SECRET_KEY = os.environ['SECRET_KEY']
     SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
+    # Comma separated `uri` or `uri|weight`, taking GET reads off the primary.
+    SQLALCHEMY_REPLICAS = os.environ.get('DATABASE_REPLICA_URLS', '')
+
+    # Per engine, replicas included. Sizing does not apply to SQLite files,
+    # which open a connection per checkout; the statement timeout (seconds)
+    # is applied on Postgres only.
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 20))
+    DATABASE_POOL_TIMEOUT = 10  # seconds a checkout waits for a connection
+    DATABASE_POOL_RECYCLE = 1800  # seconds before a connection is reopened
+    DATABASE_POOL_PRE_PING = True
+    DATABASE_STATEMENT_TIMEOUT = 30
 
     APISPEC_SPEC = APISpec(
         title='e Library',
@@ -26,9 +38,20 @@ class Config(object):
 class DevelopmentConfig(Config):
     DEVELOPMENT = True
     DEBUG = True
+    SLOW_QUERY_THRESHOLD = 0.1  # seconds
+    DATABASE_POOL_SIZE = 2
+    DATABASE_MAX_OVERFLOW = 5
+    DATABASE_POOL_TIMEOUT = 5
+    DATABASE_STATEMENT_TIMEOUT = 60
 
 
 class TestingConfig(Config):
     TESTING = True
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ['TEST_DATABASE_URL']
+    SQLALCHEMY_REPLICAS = ''
+    DATABASE_POOL_SIZE = 2
+    DATABASE_MAX_OVERFLOW = 2
+    DATABASE_POOL_TIMEOUT = 5
+    DATABASE_POOL_PRE_PING = False
+    DATABASE_STATEMENT_TIMEOUT = 10
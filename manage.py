@@ -1,8 +1,15 @@
+import time
+
 from flask_migrate import Migrate, MigrateCommand
 from flask_script import Manager, Server
 
 from api import admin
-from api.models import db
+from api import dataset
+from api.bulk import read_rows
+from api import models
+from api.models import Book, Transaction, User, db
+from api.search import search_index
+from api.services import BookService, UserService
 from app import app
 
 migrate = Migrate(app, db)
@@ -11,5 +18,79 @@ manager.add_command('db', MigrateCommand)
 manager.add_command('runserver', Server())
 
 
+@manager.command
+def rebuild_search_index():
+    '''
+    Rebuild the book search index from the books table.
+    '''
+    search_index.reindex()
+
+
+@manager.command
+def rebuild_counters():
+    '''
+    Recompute book rent counts and member rent totals from the transaction
+    history.
+    '''
+    models.rebuild_counters(db.session.connection())
+    db.session.commit()
+
+
+@manager.option('path', help='JSONL or CSV file of books')
+@manager.option('--csv', dest='csv_format', action='store_true', default=None,
+                help='Parse as CSV (default: by file extension)')
+def import_books(path, csv_format=None):
+    '''
+    Bulk import books from a JSONL or CSV file, upserting on isbn.
+    '''
+    if csv_format is None:
+        csv_format = path.lower().endswith('.csv')
+
+    with open(path, encoding='utf-8', newline='') as books_file:
+        report = BookService().import_books(read_rows(books_file, csv_format))
+
+    for error in report['errors']:
+        print(f"row {error['row']}: {error['errors']}")
+    print(f"imported {report['imported']} books, {len(report['errors'])} rows rejected")
+
+
+@manager.option('--fix', action='store_true', help='Correct mismatching balances')
+def reconcile_dues(fix=False):
+    '''
+    Verify member outstanding dues against their open rentals.
+    '''
+    mismatches = UserService().reconcile_dues(fix)
+
+    for member_id, recorded, actual in mismatches:
+        print(f'member {member_id}: recorded {recorded}, open rentals {actual}')
+    print(f"{len(mismatches)} mismatching balances{' corrected' if fix else ''}")
+
+
+@manager.option('--transactions', type=int, default=100000,
+                help='Rentals to generate (10k to 10M)')
+@manager.option('--users', type=int, help='Members (default: a tenth of the rentals)')
+@manager.option('--books', type=int, help='Titles (default: a twentieth of the rentals)')
+@manager.option('--open-ratio', dest='open_ratio', type=float, default=0.5,
+                help='Share of last month\'s rentals still out')
+@manager.option('--seed', type=int, default=0)
+def generate_dataset(transactions, users=None, books=None, open_ratio=0.5, seed=0):
+    '''
+    Fill an empty database with synthetic members, books and rentals.
+    '''
+    if any(db.session.query(model.id).first() for model in (Book, Transaction, User)):
+        print('the database already holds data, generate into an empty one')
+        return
+
+    users = users or max(transactions // 10, 1)
+    books = books or max(transactions // 20, 1)
+
+    started = time.perf_counter()
+    dataset.generate(db.session.connection(), users, books, transactions, open_ratio, seed)
+    db.session.commit()
+    search_index.reindex()
+    print(f'generated {users} members, {books} books and {transactions} rentals '
+          f'in {time.perf_counter() - started:.1f}s')
+
+
 if __name__ == '__main__':
     manager.run()
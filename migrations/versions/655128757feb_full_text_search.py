@@ -0,0 +1,35 @@
+"""full text search
+
+Revision ID: 655128757feb
+Revises: 61fb276aa0a0
+Create Date: 2026-10-18 21:12:04.318842
+
+"""
+from alembic import op
+
+from api.search import PostgresSearchBackend, fts5_available
+
+
+# revision identifiers, used by Alembic.
+revision = '655128757feb'
+down_revision = '61fb276aa0a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # As created alongside `books` by db.create_all(), filled from the
+    # existing books; Postgres builds the GIN index from the rows itself.
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite' and fts5_available():
+        op.execute('CREATE VIRTUAL TABLE books_fts USING fts5(title, author)')
+        op.execute('INSERT INTO books_fts (rowid, title, author) '
+                   'SELECT id, title, author FROM books')
+    elif dialect == 'postgresql':
+        op.execute(f'CREATE INDEX books_search_idx ON books '
+                   f'USING gin (({PostgresSearchBackend.DOCUMENT}))')
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS books_fts' if op.get_bind().dialect.name == 'sqlite'
+               else 'DROP INDEX IF EXISTS books_search_idx')